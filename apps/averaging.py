@@ -1,8 +1,14 @@
 import asyncio
+import math
 
 import voluptuous as vol
 
 import common.validation as cv
+from common.aggregation import (SlidingWindow,
+                                AGGREGATES,
+                                AGG_MEAN,
+                                AGG_PERCENTILE,
+                                DEFAULT_MAX_SAMPLES)
 from common.base_app import BaseApp
 from common.conditions import SCHEMA_STATE_CONDITION
 from common.const import (ARG_ATTRIBUTE,
@@ -13,9 +19,30 @@ ARG_WEIGHT = 'weight'
 ARG_MAX_WEIGHT = 'max_weight'
 ARG_TRIGGER = 'trigger'
 ARG_REMEMBER_LAST = 'remember_last'
+ARG_SENSORS = 'sensors'
+ARG_SOURCE = 'source'
+ARG_WINDOW = 'window'
+ARG_AGGREGATE = 'aggregate'
+ARG_PERCENTILE = 'percentile'
+ARG_OUTLIER_THRESHOLD = 'outlier_threshold'
+ARG_OUTLIER_MIN_MAD = 'outlier_min_mad'
+ARG_MAX_SAMPLES = 'max_samples'
+ARG_PRECISION = 'precision'
+ARG_ATTRIBUTES = 'attributes'
+ARG_REFRESH = 'refresh'
 
 ATTR_VALUE = 'value'
 ATTR_WEIGHT = 'weight'
+ATTR_MIN = 'min'
+ATTR_MAX = 'max'
+ATTR_MEDIAN = 'median'
+ATTR_SAMPLES = 'samples'
+ATTR_REJECTED = 'rejected_outliers'
+
+# Updates between exact recomputations of the running sums
+RECOMPUTE_INTERVAL = 1000
+# Smallest change of the average worth writing, unless output_deadband is set
+DEFAULT_DEADBAND = 0.1
 
 DEFAULT_WEIGHT = {
     ARG_WEIGHT: 1.0
@@ -31,6 +58,27 @@ SCHEMA_TEMP_SENSOR = vol.Schema({
 })
 
 
+def has_percentile(config):
+    if config[ARG_AGGREGATE] == AGG_PERCENTILE and ARG_PERCENTILE not in config:
+        raise vol.Invalid(f'{ARG_PERCENTILE} is required for the {AGG_PERCENTILE} aggregate')
+    return config
+
+
+SCHEMA_DERIVED_SENSOR = vol.All(vol.Schema({
+    vol.Required(ARG_ENTITY_ID): cv.entity_id,
+    vol.Required(ARG_SOURCE): cv.entity_id,
+    vol.Optional(ARG_ATTRIBUTE): cv.string,
+    vol.Required(ARG_WINDOW): vol.All(cv.time_period, cv.positive_timedelta),
+    vol.Optional(ARG_AGGREGATE, default=AGG_MEAN): vol.In(AGGREGATES),
+    vol.Optional(ARG_PERCENTILE): vol.All(vol.Coerce(float), vol.Range(min=0, max=100)),
+    vol.Optional(ARG_OUTLIER_THRESHOLD): vol.All(vol.Coerce(float), vol.Range(min=0)),
+    vol.Optional(ARG_OUTLIER_MIN_MAD, default=0.0): vol.All(vol.Coerce(float), vol.Range(min=0)),
+    vol.Optional(ARG_MAX_SAMPLES, default=DEFAULT_MAX_SAMPLES): vol.All(vol.Coerce(int), vol.Range(min=1)),
+    vol.Optional(ARG_PRECISION, default=2): cv.positive_int,
+    vol.Optional(ARG_ATTRIBUTES, default={}): dict
+}), has_percentile)
+
+
 class WeightedValue:
     """Represents a weighted value."""
 
@@ -49,16 +97,85 @@ class WeightedValue:
         return f"{self.value} {self.weight}"
 
 
+class WeightedAverage:
+    """Weighted mean of keyed values, updated in O(1) per change.
+
+    Running sums of weight and value × weight are adjusted by the old and new
+    contribution of the value that changed. They are recomputed exactly every
+    ``recompute_interval`` updates so float drift stays bounded.
+    """
+
+    def __init__(self, recompute_interval=RECOMPUTE_INTERVAL):
+        self.recompute_interval = recompute_interval
+        self._values = {}
+        self._total_weight = 0.0
+        self._total_value = 0.0
+        self._valid = 0
+        self._updates = 0
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self) -> str:
+        return repr({key: str(value) for key, value in self._values.items()})
+
+    def _add(self, weighted, sign):
+        if weighted.is_valid:
+            self._total_weight += sign * weighted.weight
+            self._total_value += sign * weighted.weight * weighted.value
+            self._valid += sign
+
+    def update(self, key, value=None, weight=None):
+        """Set the value and/or weight of ``key``, adding it if needed."""
+        weighted = self._values.get(key)
+        if weighted is None:
+            weighted = self._values[key] = WeightedValue(0.0, 0.0)
+        else:
+            self._add(weighted, -1)
+        if value is not None:
+            weighted.value = value
+        if weight is not None:
+            weighted.weight = weight
+        self._add(weighted, 1)
+
+        self._updates += 1
+        if self._updates >= self.recompute_interval:
+            self.recompute()
+
+    def recompute(self):
+        """Recompute the running sums exactly."""
+        valid = [val for val in self._values.values() if val.is_valid]
+        self._total_weight = float(sum(val.weight for val in valid))
+        self._total_value = float(sum(val.weight * val.value for val in valid))
+        self._valid = len(valid)
+        self._updates = 0
+
+    @property
+    def average(self):
+        """The weighted mean, ``None`` if the weights add up to zero."""
+        if not self._values:
+            return 0.0
+        if self._valid == 0:
+            return None
+        if abs(self._total_weight) < 1e-9:
+            # Could be drift around a real zero, decide on the exact sums
+            self.recompute()
+            if self._total_weight == 0:
+                return None
+        return self._total_value / self._total_weight
+
+
 class WeightedAveragedClimate(BaseApp):
     """Uses a weighed average to represent the current temperature."""
 
-    _values = {}
-    _last_triggered = None
-    _current_average = 0
-
     async def initialize_app(self):
+        self._values = WeightedAverage()
+        self._last_triggered = None
         for sensor in self.configs[ARG_TEMP_SENSORS]:
-            self._values[sensor[ARG_ENTITY_ID]] = WeightedValue(0, sensor.get(ARG_WEIGHT))
+            self._values.update(sensor[ARG_ENTITY_ID], value=0.0, weight=sensor.get(ARG_WEIGHT))
             await self.listen_state(self.handle_temperature_changed,
                                     entity=sensor[ARG_ENTITY_ID],
                                     immediate=True,
@@ -83,9 +200,6 @@ class WeightedAveragedClimate(BaseApp):
 
     async def handle_weight_trigger(self, entity, attribute, old, new, kwargs):
         sensor = kwargs['sensor_conf']
-        if sensor[ARG_ENTITY_ID] not in self._values:
-            self._values[sensor[ARG_ENTITY_ID]] = WeightedValue(0.0, 0.0)
-
         weight = sensor[ARG_WEIGHT]
         is_met = any(result
                      for result
@@ -99,35 +213,104 @@ class WeightedAveragedClimate(BaseApp):
             if self.configs[ARG_REMEMBER_LAST]:
                 self._last_triggered = sensor[ARG_ENTITY_ID]
         self.debug(f'weight {weight}')
-        self._values[sensor[ARG_ENTITY_ID]].weight = float(weight)
-        self.debug(
-            f'weighted value {self._values[sensor[ARG_ENTITY_ID]].value * self._values[sensor[ARG_ENTITY_ID]].weight}')
+        self._values.update(sensor[ARG_ENTITY_ID], weight=float(weight))
         await self.on_dataset_changed()
 
     async def handle_temperature_changed(self, entity, attribute, old, new, kwargs):
         sensor = kwargs['sensor_conf']
         self.debug(f"entity_id {sensor[ARG_ENTITY_ID]}")
-        if sensor[ARG_ENTITY_ID] not in self._values:
-            self._values[sensor[ARG_ENTITY_ID]] = WeightedValue(0.0, 0.0)
-
-        self._values[sensor[ARG_ENTITY_ID]].value = float(new)
+        self._values.update(sensor[ARG_ENTITY_ID], value=float(new))
         await self.on_dataset_changed()
 
-    def _weighted_average(self):
-        if self._values is None or len(self._values) == 0:
-            return 0.0
-        total_weight = float(sum([val.weight for _, val in self._values.items() if val.is_valid]))
-        total_value = float(sum([val.weight * val.value for _, val in self._values.items() if val.is_valid]))
-        if total_weight == 0:
-            return None
-        return total_value / total_weight
-
     async def on_dataset_changed(self):
         """Calculate the weighted mean of a list."""
-        w_average = self._weighted_average()
+        w_average = self._values.average
         if w_average is None:
             return
         self.debug(f"w_average {w_average}")
-        if abs(w_average - self._current_average) > 0.1:
-            await self.set_state(self.configs[ARG_ENTITY_ID], state=w_average)
-            self._current_average = w_average
+        await self.publish_derived(self.configs[ARG_ENTITY_ID], w_average, self.write_average,
+                                   deadband=DEFAULT_DEADBAND)
+
+    async def write_average(self, w_average):
+        await self.set_state(self.configs[ARG_ENTITY_ID], state=w_average)
+
+
+class WindowedAggregateSensors(BaseApp):
+    """Derived sensors aggregating a source entity over a sliding time window.
+
+    Each entry of ``sensors`` publishes one aggregate (time weighted mean, min,
+    max, median, percentile or last value) of its ``source`` over ``window``,
+    optionally rejecting MAD outliers, with the MAD floored at
+    ``outlier_min_mad`` in the source's unit. The window is re-evaluated every
+    ``refresh`` so the mean and expiry follow time even while the source is
+    quiet.
+    """
+
+    async def initialize_app(self):
+        self._windows = {}
+        self._published = {}
+        for sensor in self.configs[ARG_SENSORS]:
+            self._windows[sensor[ARG_ENTITY_ID]] = SlidingWindow(
+                sensor[ARG_WINDOW].total_seconds(),
+                max_samples=sensor[ARG_MAX_SAMPLES],
+                outlier_threshold=sensor.get(ARG_OUTLIER_THRESHOLD),
+                min_mad=sensor[ARG_OUTLIER_MIN_MAD])
+            await self.listen_state(self.handle_source_changed,
+                                    entity=sensor[ARG_SOURCE],
+                                    attribute=sensor.get(ARG_ATTRIBUTE),
+                                    immediate=True,
+                                    sensor_conf=sensor)
+
+        refresh = self.configs[ARG_REFRESH].total_seconds()
+        if refresh > 0:
+            await self.run_every(self.handle_refresh, 'now', refresh)
+
+    @property
+    def app_schema(self):
+        return vol.Schema({
+            vol.Required(ARG_SENSORS): vol.All(cv.ensure_list, [SCHEMA_DERIVED_SENSOR]),
+            vol.Optional(ARG_REFRESH, default=60): vol.All(cv.time_period, cv.positive_timedelta)
+        }, extra=vol.ALLOW_EXTRA)
+
+    async def handle_source_changed(self, entity, attribute, old, new, kwargs):
+        sensor = kwargs['sensor_conf']
+        try:
+            value = float(new)
+        except (TypeError, ValueError):
+            value = None
+        # float() also parses 'nan' and 'inf', neither can be aggregated
+        if value is None or not math.isfinite(value):
+            self.debug(f'Ignoring {entity} value {new}')
+            return
+
+        window = self._windows[sensor[ARG_ENTITY_ID]]
+        if not window.add(await self.get_now_ts(), value):
+            self.debug(f'Rejected outlier {value} from {entity}')
+            return
+        await self.publish_aggregate(sensor)
+
+    async def handle_refresh(self, kwargs):
+        for sensor in self.configs[ARG_SENSORS]:
+            await self.publish_aggregate(sensor)
+
+    async def publish_aggregate(self, sensor):
+        window = self._windows[sensor[ARG_ENTITY_ID]]
+        now = await self.get_now_ts()
+        value = window.aggregate(sensor[ARG_AGGREGATE], now, sensor.get(ARG_PERCENTILE))
+        if value is None:
+            return
+
+        precision = sensor[ARG_PRECISION]
+        state = round(value, precision)
+        attributes = dict(sensor[ARG_ATTRIBUTES])
+        attributes.update({
+            ATTR_MIN: round(window.minimum, precision),
+            ATTR_MAX: round(window.maximum, precision),
+            ATTR_MEDIAN: round(window.median, precision),
+            ATTR_SAMPLES: len(window),
+            ATTR_REJECTED: window.rejected
+        })
+        if self._published.get(sensor[ARG_ENTITY_ID]) == (state, attributes):
+            return
+        self._published[sensor[ARG_ENTITY_ID]] = (state, attributes)
+        await self.set_state(sensor[ARG_ENTITY_ID], state=state, attributes=attributes)
@@ -0,0 +1,374 @@
+"""Sliding window aggregation of numeric samples.
+
+A ``SlidingWindow`` keeps the samples of the last ``window`` seconds (capped at
+``max_samples``) and answers every aggregate without a pass over the window:
+
+* time weighted mean from a running integral, each sample holding its value
+  until the next one,
+* min and max from monotonic deques, O(1) amortized per sample,
+* median and percentiles from an indexable skiplist of the values, O(log n)
+  to add or drop a sample and to look up a rank,
+* MAD from a k-th smallest selection over the deviations either side of the
+  median, O(log n) rank lookups, used to reject outliers before they enter the
+  window.
+
+The MAD is floored at ``min_mad`` and at ``MAD_FLOOR_FRACTION`` of the median,
+so a flat signal does not let every spike through, or reject every small
+change. More than ``max_rejections`` consecutive outliers on the same side of
+the median are taken as a real change of level rather than noise. The window
+then starts over from that run, so the samples at the new level are accepted
+until the window has enough of them to judge outliers again.
+"""
+import math
+import random
+from collections import deque
+
+AGG_MEAN = 'mean'
+AGG_MIN = 'min'
+AGG_MAX = 'max'
+AGG_MEDIAN = 'median'
+AGG_PERCENTILE = 'percentile'
+AGG_LAST = 'last'
+
+AGGREGATES = [AGG_MEAN, AGG_MIN, AGG_MAX, AGG_MEDIAN, AGG_PERCENTILE, AGG_LAST]
+
+# Scales the MAD to the standard deviation of normally distributed samples
+MAD_SCALE = 1.4826
+# Smallest MAD as a fraction of the median
+MAD_FLOOR_FRACTION = 0.01
+DEFAULT_MAX_SAMPLES = 1024
+DEFAULT_MIN_SAMPLES = 10
+DEFAULT_MAX_REJECTIONS = 3
+
+
+class _End:
+    """Sorts after every value, ends every level of a skiplist."""
+
+    def __lt__(self, other):
+        return False
+
+    __le__ = __lt__
+
+
+class _Node:
+
+    __slots__ = ['value', 'next', 'width']
+
+    def __init__(self, value, levels):
+        self.value = value
+        self.next = [None] * levels
+        self.width = [None] * levels
+
+
+class IndexableSkiplist:
+    """Sorted values with O(log n) insert, remove, bisect and lookup by index.
+
+    Every link also counts the positions it skips, so the node at an index is
+    found by walking down the levels like a value is. ``expected_size`` sets the
+    number of levels, larger lists stay correct but get slower.
+    """
+
+    def __init__(self, expected_size=DEFAULT_MAX_SAMPLES):
+        self._levels = max(1, int(math.log2(max(expected_size, 1))) + 1)
+        self._end = _Node(_End(), 0)
+        self._head = _Node(None, self._levels)
+        self._head.next = [self._end] * self._levels
+        self._head.width = [1] * self._levels
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        node = self._head.next[0]
+        while node is not self._end:
+            yield node.value
+            node = node.next[0]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError('skiplist index out of range')
+        node = self._head
+        # The head is position 0, the first value position 1
+        position = index + 1
+        for level in reversed(range(self._levels)):
+            while node.width[level] <= position:
+                position -= node.width[level]
+                node = node.next[level]
+        return node.value
+
+    def bisect_left(self, value):
+        """The number of values smaller than ``value``."""
+        node = self._head
+        index = 0
+        for level in reversed(range(self._levels)):
+            while node.next[level].value < value:
+                index += node.width[level]
+                node = node.next[level]
+        return index
+
+    def insert(self, value):
+        chain = [None] * self._levels
+        steps_at_level = [0] * self._levels
+        node = self._head
+        for level in reversed(range(self._levels)):
+            while node.next[level].value <= value:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        height = min(self._levels, 1 - int(math.log2(1.0 - random.random())))
+        new = _Node(value, height)
+        steps = 0
+        for level in range(height):
+            previous = chain[level]
+            new.next[level] = previous.next[level]
+            previous.next[level] = new
+            new.width[level] = previous.width[level] - steps
+            previous.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(height, self._levels):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, value):
+        chain = [None] * self._levels
+        node = self._head
+        for level in reversed(range(self._levels)):
+            while node.next[level].value < value:
+                node = node.next[level]
+            chain[level] = node
+        found = chain[0].next[0]
+        if found is self._end or found.value != value:
+            raise ValueError(f'{value} not in skiplist')
+
+        for level in range(len(found.next)):
+            previous = chain[level]
+            previous.width[level] += found.width[level] - 1
+            previous.next[level] = found.next[level]
+        for level in range(len(found.next), self._levels):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+
+class SlidingWindow:
+    """Samples of the last ``window`` seconds with their aggregates."""
+
+    def __init__(self, window, max_samples=DEFAULT_MAX_SAMPLES, outlier_threshold=None,
+                 min_samples=DEFAULT_MIN_SAMPLES, max_rejections=DEFAULT_MAX_REJECTIONS,
+                 min_mad=0.0):
+        self.window = window
+        self.max_samples = max_samples
+        self.outlier_threshold = outlier_threshold
+        self.min_samples = min_samples
+        self.max_rejections = max_rejections
+        self.min_mad = min_mad
+        self.rejected = 0
+        self._rejected_run = []
+        self._rejected_above = None
+        self._samples = deque()
+        self._sorted = IndexableSkiplist(max_samples)
+        self._min = deque()
+        self._max = deque()
+        self._area = 0.0
+        self._sequence = 0
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, timestamp, value):
+        """Add a sample, returns ``False`` if it was rejected as an outlier."""
+        if not math.isfinite(value):
+            raise ValueError(f'Sample {value} is not finite')
+        if not self.is_outlier(value):
+            self._rejected_run = []
+            self._append(timestamp, value)
+            return True
+
+        above = value > self.median
+        if above != self._rejected_above:
+            self._rejected_run = []
+            self._rejected_above = above
+        self._rejected_run.append((timestamp, value))
+        if len(self._rejected_run) <= self.max_rejections:
+            self.rejected += 1
+            return False
+
+        # The level changed, start over from the run of rejected samples
+        run = self._rejected_run
+        self.clear()
+        self.rejected -= len(run) - 1
+        for sample_time, sample_value in run:
+            self._append(sample_time, sample_value)
+        return True
+
+    def _append(self, timestamp, value):
+        if self._samples:
+            last_time, last_value, _ = self._samples[-1]
+            timestamp = max(timestamp, last_time)
+            self._area += last_value * (timestamp - last_time)
+
+        self._sequence += 1
+        sample = (timestamp, value, self._sequence)
+        self._samples.append(sample)
+        self._sorted.insert(value)
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append(sample)
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append(sample)
+
+        while len(self._samples) > self.max_samples:
+            self._evict()
+        self.expire(timestamp)
+
+    def expire(self, now):
+        """Drop the samples superseded before the start of the window."""
+        start = now - self.window
+        # The oldest sample stays while it is still the value at the window start
+        while len(self._samples) > 1 and self._samples[1][0] <= start:
+            self._evict()
+
+    def _evict(self):
+        sample = self._samples.popleft()
+        if self._samples:
+            self._area -= sample[1] * (self._samples[0][0] - sample[0])
+        else:
+            self._area = 0.0
+        self._sorted.remove(sample[1])
+        if self._min and self._min[0][2] == sample[2]:
+            self._min.popleft()
+        if self._max and self._max[0][2] == sample[2]:
+            self._max.popleft()
+
+    def clear(self):
+        self._samples.clear()
+        self._sorted = IndexableSkiplist(self.max_samples)
+        self._min.clear()
+        self._max.clear()
+        self._area = 0.0
+        self._rejected_run = []
+        self._rejected_above = None
+
+    @property
+    def last(self):
+        return self._samples[-1][1] if self._samples else None
+
+    @property
+    def minimum(self):
+        return self._min[0][1] if self._min else None
+
+    @property
+    def maximum(self):
+        return self._max[0][1] if self._max else None
+
+    @property
+    def median(self):
+        return self.percentile(50)
+
+    def mean(self, now):
+        """Time weighted mean over the window ending at ``now``."""
+        if not self._samples:
+            return None
+        self.expire(now)
+        start = now - self.window
+        first_time, first_value, _ = self._samples[0]
+        last_time, last_value, _ = self._samples[-1]
+        now = max(now, last_time)
+
+        area = self._area + last_value * (now - last_time)
+        if first_time < start:
+            # Only the part of the oldest interval inside the window counts
+            area -= first_value * (start - first_time)
+            first_time = start
+        if now <= first_time:
+            return last_value
+        return area / (now - first_time)
+
+    def percentile(self, percent):
+        """Linearly interpolated percentile of the values in the window."""
+        values = self._sorted
+        if not values:
+            return None
+        rank = (len(values) - 1) * percent / 100.0
+        lower = int(rank)
+        if lower + 1 >= len(values):
+            return values[-1]
+        return values[lower] + (values[lower + 1] - values[lower]) * (rank - lower)
+
+    @property
+    def mad(self):
+        """Median absolute deviation from the median."""
+        count = len(self._sorted)
+        if count == 0:
+            return None
+        if count % 2:
+            return self._deviation(count // 2)
+        return (self._deviation(count // 2 - 1) + self._deviation(count // 2)) / 2.0
+
+    def _deviation(self, k):
+        """The k-th smallest absolute deviation from the median.
+
+        The deviations below and above the median are each already sorted, the
+        k-th element of the two sequences is found by bisecting on how many come
+        from the lower side.
+        """
+        values = self._sorted
+        median = self.median
+        split = values.bisect_left(median)
+        lower_count = split
+        upper_count = len(values) - split
+
+        def lower(index):
+            return median - values[split - 1 - index]
+
+        def upper(index):
+            return values[split + index] - median
+
+        low = max(0, k + 1 - upper_count)
+        high = min(k + 1, lower_count)
+        while low < high:
+            taken = (low + high) // 2
+            # Too few from the lower side while its next deviation is smaller
+            if upper(k - taken) > lower(taken):
+                low = taken + 1
+            else:
+                high = taken
+        taken = low
+        candidates = []
+        if taken > 0:
+            candidates.append(lower(taken - 1))
+        if k + 1 - taken > 0:
+            candidates.append(upper(k - taken))
+        return max(candidates)
+
+    def is_outlier(self, value):
+        """A value further than ``outlier_threshold`` scaled MADs from the median."""
+        if self.outlier_threshold is None or len(self._sorted) < self.min_samples:
+            return False
+        median = self.median
+        deviation = abs(value - median)
+        mad = max(self.mad, self.min_mad, MAD_FLOOR_FRACTION * abs(median)) * MAD_SCALE
+        if mad == 0:
+            return deviation > 0
+        return deviation / mad > self.outlier_threshold
+
+    def aggregate(self, name, now, percent=None):
+        """The named aggregate of the window ending at ``now``."""
+        self.expire(now)
+        if name == AGG_MEAN:
+            return self.mean(now)
+        if name == AGG_MIN:
+            return self.minimum
+        if name == AGG_MAX:
+            return self.maximum
+        if name == AGG_MEDIAN:
+            return self.median
+        if name == AGG_PERCENTILE:
+            return self.percentile(percent)
+        if name == AGG_LAST:
+            return self.last
+        raise ValueError(f'Unknown aggregate {name}')
@@ -23,6 +23,18 @@ from common.const import (
     ARG_VALUE,
     ARG_STATE,
     ARG_COMPARATOR,
+    ARG_STATE_FORMAT,
+    ARG_STATE_BATCH_WINDOW,
+    ARG_STATE_BATCH_CODEC,
+    ARG_OUTPUT_DEADBAND,
+    ARG_OUTPUT_DEADBAND_RELATIVE,
+    ARG_OUTPUT_MIN_INTERVAL,
+    ARG_OUTPUT_MAX_STALENESS,
+    ATTR_NEW_STATE,
+    ATTR_OLD_STATE,
+    EVENT_STATE_CHANGED,
+    STATE_FORMAT_JSON,
+    STATE_FORMAT_BATCH,
     EQUALS,
     NOT_EQUAL,
     LESS_THAN,
@@ -30,7 +42,9 @@ from common.const import (
     GREATER_THAN,
     GREATER_THAN_EQUAL_TO
 )
+from common.derived_output import DerivedOutput, WRITE, DEFER
 from common.listen_handle import ListenHandle, TimerHandle, StateListenHandle, EventListenHandle
+from common.state_batch import StateBatchEncoder, CODEC_ZLIB, CODEC_ZSTD, STATE_BATCH_SUFFIX
 from common.utils import (converge_types,
                           KWArgFormatter)
 from common.validation import valid_log_level, valid_entity_id
@@ -67,7 +81,17 @@ DEFAULT_PUBLISH_TOPIC = "events/rules"
 
 class BaseApp(hass.Hass):
     _base_config_schema = {
-        vol.Optional(ARG_LOG_LEVEL, default='ERROR'): valid_log_level
+        vol.Optional(ARG_LOG_LEVEL, default='ERROR'): valid_log_level,
+        vol.Optional(ARG_STATE_FORMAT, default=STATE_FORMAT_JSON): vol.In(
+            [STATE_FORMAT_JSON, STATE_FORMAT_BATCH]),
+        vol.Optional(ARG_STATE_BATCH_WINDOW, default=1.0): vol.All(
+            vol.Coerce(float),
+            vol.Range(min=0.0)),
+        vol.Optional(ARG_STATE_BATCH_CODEC, default=CODEC_ZLIB): vol.In([CODEC_ZLIB, CODEC_ZSTD]),
+        vol.Optional(ARG_OUTPUT_DEADBAND): vol.All(vol.Coerce(float), vol.Range(min=0.0)),
+        vol.Optional(ARG_OUTPUT_DEADBAND_RELATIVE): vol.Coerce(bool),
+        vol.Optional(ARG_OUTPUT_MIN_INTERVAL): vol.All(vol.Coerce(float), vol.Range(min=0.0)),
+        vol.Optional(ARG_OUTPUT_MAX_STALENESS): vol.All(vol.Coerce(float), vol.Range(min=0.0))
     }
 
     async def initialize(self):
@@ -78,6 +102,9 @@ class BaseApp(hass.Hass):
         self.data = {}
         self._data_save_handle = None
         self._data_lock = Lock()
+        self._state_batches = {}
+        self._state_batch_handle = None
+        self._derived_outputs = {}
         self._persistent_data_file = os.path.join(self.config_dir, self.namespace,
                                                   self.name + ".js")
         self.plugin_config = self.get_plugin_config()
@@ -247,6 +274,113 @@ class BaseApp(hass.Hass):
             namespace=namespace
         )
 
+    async def publish_state(self, topic, entity, new_state, old_state=None, qos=1, retain=True,
+                            namespace='default'):
+        """Publish a state_changed document, or queue it for the next state batch."""
+        if self.configs[ARG_STATE_FORMAT] == STATE_FORMAT_BATCH:
+            key = (topic, qos, retain, namespace)
+            if key not in self._state_batches:
+                self._state_batches[key] = StateBatchEncoder(
+                    self.name,
+                    codec=self.configs[ARG_STATE_BATCH_CODEC])
+            self._state_batches[key].add(entity, new_state)
+
+            if self._state_batch_handle is None:
+                self._state_batch_handle = await self.run_in(
+                    self.flush_state_batches,
+                    self.configs[ARG_STATE_BATCH_WINDOW])
+            return
+
+        payload = {
+            ATTR_EVENT_TYPE: EVENT_STATE_CHANGED,
+            ATTR_EVENT_DATA: {
+                ARG_ENTITY_ID: entity,
+                ATTR_NEW_STATE: new_state
+            },
+            ATTR_SOURCE: self.name
+        }
+        if old_state is not None:
+            payload[ATTR_EVENT_DATA][ATTR_OLD_STATE] = old_state
+
+        return self.mqtt_publish(
+            topic,
+            payload=json.dumps(payload),
+            qos=qos,
+            retain=retain,
+            namespace=namespace
+        )
+
+    async def flush_state_batches(self, kwargs):
+        self._state_batch_handle = None
+        for (topic, qos, retain, namespace), encoder in self._state_batches.items():
+            if len(encoder) == 0:
+                continue
+            payload = encoder.encode(keyframe=retain)
+            self.debug('State batch %s: %d states, %d raw bytes, %d wire bytes so far' % (
+                topic, encoder.states, encoder.raw_bytes, encoder.wire_bytes))
+            self.mqtt_publish(
+                '{}/{}'.format(topic, STATE_BATCH_SUFFIX),
+                payload=payload,
+                qos=qos,
+                retain=retain,
+                namespace=namespace
+            )
+
+    async def publish_derived(self, key, value, writer, deadband=0.0, relative=False,
+                              min_interval=0.0, max_staleness=0.0, **kwargs):
+        """Write a derived value through ``writer`` unless it is not worth writing.
+
+        The keyword arguments are this app's defaults for the output, the
+        ``output_*`` app settings override them. ``writer`` is awaited with the
+        value to write, extra keyword arguments go to ``DerivedOutput``.
+        """
+        output = self._derived_outputs.get(key)
+        if output is None:
+            output = self._derived_outputs[key] = DerivedOutput(
+                deadband=self.configs.get(ARG_OUTPUT_DEADBAND, deadband),
+                relative=self.configs.get(ARG_OUTPUT_DEADBAND_RELATIVE, relative),
+                min_interval=self.configs.get(ARG_OUTPUT_MIN_INTERVAL, min_interval),
+                max_staleness=self.configs.get(ARG_OUTPUT_MAX_STALENESS, max_staleness),
+                **kwargs)
+        output.writer = writer
+
+        now = await self.get_now_ts()
+        decision = output.offer(now, value)
+        if decision == WRITE:
+            await self._write_derived(key, now)
+        elif decision == DEFER and output.flush_handle is None:
+            output.flush_handle = await self.run_in(self._flush_derived,
+                                                    output.flush_delay(now),
+                                                    key=key)
+
+    async def _write_derived(self, key, now):
+        output = self._derived_outputs[key]
+        for handle in ('flush_handle', 'stale_handle'):
+            if getattr(output, handle) is not None:
+                await self.cancel_timer(getattr(output, handle))
+                setattr(output, handle, None)
+
+        await output.writer(output.latest)
+        output.written(now)
+        self.debug('Derived output %s: %d writes, %d suppressed' % (
+            key, output.writes, output.suppressed))
+
+        if output.max_staleness > 0:
+            output.stale_handle = await self.run_in(self._refresh_derived,
+                                                    output.max_staleness,
+                                                    key=key)
+
+    async def _flush_derived(self, kwargs):
+        output = self._derived_outputs[kwargs['key']]
+        output.flush_handle = None
+        if output.pending:
+            await self._write_derived(kwargs['key'], await self.get_now_ts())
+
+    async def _refresh_derived(self, kwargs):
+        output = self._derived_outputs[kwargs['key']]
+        output.stale_handle = None
+        await self._write_derived(kwargs['key'], await self.get_now_ts())
+
     async def condition_met(self, condition_to_check):
         """Verifies if condition is met."""
         condition_spec = copy.deepcopy(condition_to_check)
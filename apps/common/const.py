@@ -25,6 +25,13 @@ ARG_SENSOR = 'sensor'
 ARG_FILENAME = 'filename'
 ARG_LOG_LEVEL = 'log_level'
 ARG_ENABLED_FLAG = 'enabled_flag'
+ARG_STATE_FORMAT = 'state_format'
+ARG_STATE_BATCH_WINDOW = 'state_batch_window'
+ARG_STATE_BATCH_CODEC = 'state_batch_codec'
+ARG_OUTPUT_DEADBAND = 'output_deadband'
+ARG_OUTPUT_DEADBAND_RELATIVE = 'output_deadband_relative'
+ARG_OUTPUT_MIN_INTERVAL = 'output_min_interval'
+ARG_OUTPUT_MAX_STALENESS = 'output_max_staleness'
 
 ATTR_SCORE = 'score'
 ATTR_FILENAME = 'filename'
@@ -36,6 +43,9 @@ ATTR_COLOR_NAME = "color_name"
 
 EVENT_STATE_CHANGED = 'state_changed'
 
+STATE_FORMAT_JSON = 'json'
+STATE_FORMAT_BATCH = 'batch'
+
 DOMAIN_NOTIFY = 'notify'
 DOMAIN_HOMEASSISTANT = 'homeassistant'
 DOMAIN_CAMERA = 'camera'
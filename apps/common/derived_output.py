@@ -0,0 +1,89 @@
+"""Write throttling for derived outputs.
+
+A derived output is a value an app computes from other entities, an average,
+a group centroid, and writes somewhere on every recomputation. ``DerivedOutput``
+decides which of those writes are worth doing:
+
+* changes within the deadband of the last written value are suppressed,
+* changes arriving sooner than ``min_interval`` after the last write are held
+  back and the latest of them is written when the interval is over, so the
+  final value always gets out (trailing edge),
+* with ``max_staleness`` the latest value is rewritten when nothing was
+  written for that long.
+"""
+import math
+
+WRITE = 'write'
+DEFER = 'defer'
+SUPPRESS = 'suppress'
+
+
+def numeric_difference(old, new):
+    return abs(new - old)
+
+
+class DerivedOutput:
+    """Throttling state of one derived output.
+
+    ``difference`` measures how far apart two values are, it defaults to the
+    absolute difference of numbers. Values it can not compare, or that differ
+    structurally, should measure as ``math.inf``. A relative deadband is a
+    fraction of the last written value and only applies to numbers.
+    """
+
+    def __init__(self, deadband=0.0, relative=False, min_interval=0.0, max_staleness=0.0,
+                 difference=numeric_difference):
+        self.deadband = deadband
+        self.relative = relative
+        self.min_interval = min_interval
+        self.max_staleness = max_staleness
+        self.difference = difference
+        self.writer = None
+        self.latest = None
+        self.published = None
+        self.published_at = None
+        self.pending = False
+        self.flush_handle = None
+        self.stale_handle = None
+        self.writes = 0
+        self.suppressed = 0
+
+    def significant(self, value):
+        if self.published_at is None:
+            return True
+        try:
+            difference = self.difference(self.published, value)
+        except (TypeError, ValueError):
+            return True
+        deadband = self.deadband
+        if self.relative:
+            try:
+                deadband *= abs(self.published)
+            except TypeError:
+                return True
+        return math.isinf(difference) or difference > deadband
+
+    def offer(self, now, value):
+        """Record a new value and decide whether to write it now."""
+        self.latest = value
+        if not self.significant(value):
+            # The latest value is back near the written one, nothing to flush
+            self.pending = False
+            self.suppressed += 1
+            return SUPPRESS
+
+        if self.published_at is not None and now - self.published_at < self.min_interval:
+            if self.pending:
+                self.suppressed += 1
+            self.pending = True
+            return DEFER
+        return WRITE
+
+    def flush_delay(self, now):
+        return max(0.0, self.published_at + self.min_interval - now)
+
+    def written(self, now):
+        self.published = self.latest
+        self.published_at = now
+        self.pending = False
+        self.writes += 1
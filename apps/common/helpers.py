@@ -1,6 +1,12 @@
 from enum import Enum
 from math import radians, cos, sin, asin, sqrt
 
+# Optional, see apps/requirements.txt: the batch distances fall back to a loop without it
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # mean earth radius - https://en.wikipedia.org/wiki/Earth_radius#Mean_radius
 _AVG_EARTH_RADIUS_KM = 6371.0088
 
@@ -84,3 +90,56 @@ class Haversine:
         d = sin(lat * 0.5) ** 2 + cos(lat1) * cos(lat2) * sin(lng * 0.5) ** 2
 
         return 2 * self._average_earth_radius * asin(sqrt(d))
+
+    def _radians(self, points):
+        points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 2)
+        return numpy.radians(points[:, 0]), numpy.radians(points[:, 1])
+
+    def _finish(self, d, float32):
+        distances = 2 * self._average_earth_radius * numpy.arcsin(numpy.sqrt(numpy.clip(d, 0.0, 1.0)))
+        if float32:
+            return distances.astype(numpy.float32)
+        return distances
+
+    def matrix(self, points1, points2, float32=False):
+        """ Distances between every point of ``points1`` and every point of ``points2``.
+
+        :param points1: N (latitude, longitude) pairs in decimal degrees, or an N×2 array
+        :param points2: M (latitude, longitude) pairs in decimal degrees, or an M×2 array
+        :param float32: return single precision distances, computed in double precision
+
+        :return: an N×M NumPy array in this helper's unit, or a list of N lists of M
+                 floats when NumPy is not installed.
+        """
+        if numpy is None:
+            return [[self(point1, point2) for point2 in points2] for point1 in points1]
+
+        lat1, lng1 = self._radians(points1)
+        lat2, lng2 = self._radians(points2)
+        lat = lat2[numpy.newaxis, :] - lat1[:, numpy.newaxis]
+        lng = lng2[numpy.newaxis, :] - lng1[:, numpy.newaxis]
+        d = numpy.sin(lat * 0.5) ** 2 + \
+            numpy.outer(numpy.cos(lat1), numpy.cos(lat2)) * numpy.sin(lng * 0.5) ** 2
+        return self._finish(d, float32)
+
+    def paired(self, points1, points2, float32=False):
+        """ Distances between ``points1[i]`` and ``points2[i]`` for every i.
+
+        :param points1: N (latitude, longitude) pairs in decimal degrees, or an N×2 array
+        :param points2: N (latitude, longitude) pairs in decimal degrees, or an N×2 array
+        :param float32: return single precision distances, computed in double precision
+
+        :return: a NumPy array of N distances in this helper's unit, or a list of N
+                 floats when NumPy is not installed.
+        """
+        if len(points1) != len(points2):
+            raise ValueError('Expected the same number of points, got {} and {}'.format(
+                len(points1), len(points2)))
+        if numpy is None:
+            return [self(point1, point2) for point1, point2 in zip(points1, points2)]
+
+        lat1, lng1 = self._radians(points1)
+        lat2, lng2 = self._radians(points2)
+        d = numpy.sin((lat2 - lat1) * 0.5) ** 2 + \
+            numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin((lng2 - lng1) * 0.5) ** 2
+        return self._finish(d, float32)
@@ -0,0 +1,116 @@
+"""Encoder for batched state payloads.
+
+The wire format is decoded natively by the hassmqtt plugin (``hassmqttbatch``):
+
+    b'HMB' + format version (b'\\x01') + codec (b'z' zlib, b's' zstd) + compressed JSON
+
+Several state changes are coalesced into one message, latest state per entity wins,
+and attributes are sent as a delta against the last attributes published for the
+entity. A full keyframe is sent on the first publish and then every
+``keyframe_interval`` publishes so subscribers that missed a message recover.
+Retained batches are always keyframes, the broker hands them to subscribers that
+have no earlier state to apply a delta to.
+"""
+import json
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BATCH_MARKER = b'HMB\x01'
+CODEC_ZLIB = 'zlib'
+CODEC_ZSTD = 'zstd'
+STATE_BATCH_SUFFIX = 'batch'
+
+_CODEC_IDS = {
+    CODEC_ZLIB: b'z',
+    CODEC_ZSTD: b's',
+}
+
+ATTR_ENTITY_ID = 'entity_id'
+ATTR_STATE = 'state'
+ATTR_ATTRIBUTES = 'attributes'
+ATTR_DELTA = 'delta'
+ATTR_SET = 'set'
+ATTR_UNSET = 'unset'
+ATTR_SOURCE = 'source'
+ATTR_STATES = 'states'
+
+DEFAULT_KEYFRAME_INTERVAL = 20
+
+
+def attribute_delta(old, new):
+    """Compute the ``{"set": ..., "unset": [...]}`` delta turning ``old`` into ``new``."""
+    changed = {key: value for key, value in new.items()
+               if key not in old or old[key] != value}
+    removed = [key for key in old if key not in new]
+    delta = {ATTR_SET: changed}
+    if removed:
+        delta[ATTR_UNSET] = removed
+    return delta
+
+
+class StateBatchEncoder:
+    """Collects state changes and encodes them into one compressed batch."""
+
+    def __init__(self, source, codec=CODEC_ZLIB, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL,
+                 level=6):
+        if codec == CODEC_ZSTD and zstandard is None:
+            codec = CODEC_ZLIB
+        self.source = source
+        self.codec = codec
+        self.keyframe_interval = keyframe_interval
+        self.level = level
+        self._pending = {}
+        self._published = {}
+        self._since_keyframe = {}
+        self.states = 0
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, entity, new_state):
+        """Queue a state dict with ``state`` and ``attributes`` for ``entity``."""
+        self._pending[entity] = new_state
+
+    def _item(self, entity, new_state, keyframe):
+        attributes = new_state.get(ATTR_ATTRIBUTES) or {}
+        item = {
+            ATTR_ENTITY_ID: entity,
+            ATTR_STATE: new_state.get(ATTR_STATE),
+        }
+        last = self._published.get(entity)
+        since_keyframe = self._since_keyframe.get(entity, 0)
+        if keyframe or last is None or since_keyframe >= self.keyframe_interval:
+            item[ATTR_ATTRIBUTES] = attributes
+            self._since_keyframe[entity] = 0
+        else:
+            item[ATTR_DELTA] = attribute_delta(last, attributes)
+            self._since_keyframe[entity] = since_keyframe + 1
+        self._published[entity] = dict(attributes)
+        return item
+
+    def encode(self, keyframe=False):
+        """Encode and clear the pending state changes.
+
+        ``keyframe`` sends full attributes for every entity, retained batches must
+        be keyframes or a new subscriber would apply a delta to nothing.
+        """
+        items = [self._item(entity, new_state, keyframe)
+                 for entity, new_state in self._pending.items()]
+        self._pending = {}
+        raw = json.dumps({ATTR_SOURCE: self.source, ATTR_STATES: items}).encode()
+        if self.codec == CODEC_ZSTD:
+            body = zstandard.ZstdCompressor(level=self.level).compress(raw)
+        else:
+            body = zlib.compress(raw, self.level)
+        payload = BATCH_MARKER + _CODEC_IDS[self.codec] + body
+
+        self.states += len(items)
+        self.raw_bytes += len(raw)
+        self.wire_bytes += len(payload)
+        return payload
@@ -4,27 +4,983 @@ apps.yaml parameters:
 | - monitor_topic (default 'monitor'): MQTT Topic monitor.sh script publishes to
 | - mqtt_event (default 'MQTT_MESSAGE'): MQTT event name as specified in the plugin setting
 | - not_home_timeout (default 30s): Time interval before declaring not home
+|   until a per device timeout has been learned from departure_min_samples gaps
+| - departure_false_rate (default 0.05): Accepted rate of false departures
+| - departure_min_samples (default 10): Dropout gaps seen before a device's
+|   timeout is learned
+| - departure_min_timeout (default 5s): Shortest learned timeout, the learned
+|   timeout is never longer than not_home_timeout
+| - departure_max_gap (default 600s): Longest gap still counted as a dropout
 | - minimum_confidence (default 50): Minimum Confidence Level to consider home
 | - depart_check_time (default 30s): Time to wait before running depart scan
 | - system_timeout (default 90s): Time for system to report back from echo
 | - system_check (default 30s): Time interval for checking if system is online
+| - sensor_flush_interval (default 1s): Time attribute-only sensor updates are coalesced
+| - processing_stats (default 0s): Interval the message processing stats are
+|   published on <presence_name>.processing, 0 disables measuring
+| - forward_window (default 0.5s): Time monitor state changes are coalesced before forwarding
+| - forward_delta (default False): Also publish the changed fields to <topic>/state/delta
+| - rssi_smoothing (default 0.3): EWMA weight of a new RSSI sample
+| - rssi_hysteresis (default 3): dB a monitor must lead by to become the nearest
+| - rssi_max_age (default 300s): Age after which an RSSI reading is ignored and
+|   smoothing starts over
 | - everyone_not_home: Name to use for the "Everyone Not Home" Sensor
 | - everyone_home: Name to use for the "Everyone Home" Sensor
 | - somebody_is_home: Name to use for the "Somebody Is Home" Sensor
 | - user_device_domain: Use "binary_sensor" or "device_tracker" domains.
 | - known_devices: Known devices to be added to each monitor.
+| - provision_settle (default 3s): Quiet time after the last device report before
+|   the missing devices are pushed
+| - provision_ack_timeout (default 2s): Time to wait for a node to report a pushed device
+| - provision_confirm_timeout (default 15s): Time to wait for nodes to confirm all devices
+| - provision_rounds (default 3): Push rounds before giving up on nodes still missing devices
 | - known_beacons: Known Beacons to monitor.
 | - remote_monitors: login details of remote monitors that can be hardware rebooted
+|   (host, username, password, optional port and command_timeout)
+| - ssh_keepalive (default 30s): Keepalive interval of pooled SSH connections
+| - ssh_idle_timeout (default 300s): Time an unused SSH connection is kept open
+| - history_size (default 3600): Samples kept per device and location
+| - history_file: File the history is persisted to, empty to disable
+| - history_persist_interval (default 300s): Time between history saves
 """
+import asyncio
+import concurrent.futures
 import json
 import adbase as ad
-import copy
+from array import array
+from collections import deque
 from datetime import datetime, timedelta
+from functools import lru_cache
+import math
+import os
+import socket
+import struct
+import threading
+import time
 import traceback
+import zlib
+
+try:
+    import paramiko
+except ImportError:
+    paramiko = None
 
 
 __VERSION__ = "2.3.4"
 
+# Topic actions that carry nothing the app has to process
+IGNORED_ACTIONS = frozenset(
+    [
+        "depart",
+        "arrive",
+        "state",
+        "known device states",
+        "add static device",
+        "delete static device",
+        "output",
+        "result",
+        "delta",
+    ]
+)
+
+DEVICE_RECORD_CACHE_SIZE = 1024
+
+# Scan types in the order they are sent when several are waiting
+SCAN_ARRIVE = "arrive"
+SCAN_DEPART = "depart"
+SCAN_RSSI = "rssi"
+SCAN_PRIORITY = {SCAN_ARRIVE: 0, SCAN_DEPART: 1, SCAN_RSSI: 2}
+
+# Scan types as reported by the monitors when they start scanning
+SCAN_RUNNING_TYPES = {
+    SCAN_ARRIVE: ("arrive", "arrival"),
+    SCAN_DEPART: ("depart",),
+    SCAN_RSSI: ("rssi",),
+}
+
+# Seconds to give the scanner to report it started before sending the next scan
+SCAN_SETTLE_TIME = 1
+# Seconds to check back on a scanner that stays busy
+SCAN_BUSY_RETRY = 10
+# Seconds to wait for a node to report a scan started, or to answer an echo
+SCAN_START_TIMEOUT = 5
+ECHO_TIMEOUT = 5
+# Raised by the plugin's mqtt_request, or by AppDaemon waiting on it
+REQUEST_TIMEOUT_ERRORS = (asyncio.TimeoutError, concurrent.futures.TimeoutError)
+
+
+def as_int(value):
+    """Return ``value`` as an int, or None if it is not a number."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class PresenceMessage:
+    """A monitor message with its topic already parsed."""
+
+    __slots__ = ["topic", "topic_path", "action", "payload", "payload_json", "location"]
+
+    def __init__(self, topic, topic_path, action, payload, payload_json, location):
+        self.topic = topic
+        self.topic_path = topic_path
+        self.action = action
+        self.payload = payload
+        self.payload_json = payload_json
+        self.location = location
+
+
+class DeviceRecord:
+    """Every entity id and friendly name derived from a device and a location."""
+
+    __slots__ = [
+        "device_name",
+        "location",
+        "location_friendly",
+        "device_entity_id",
+        "state_sensor",
+        "conf_sensor",
+        "appdaemon_entity",
+        "friendly_name",
+    ]
+
+    def __init__(self, presence_name, user_device_domain, device_name, location):
+        self.device_name = device_name
+        self.location = location
+        self.location_friendly = location.replace("_", " ").title()
+        self.device_entity_id = f"{presence_name}_{device_name}"
+        self.state_sensor = f"{user_device_domain}.{self.device_entity_id}"
+        self.conf_sensor = f"sensor.{self.device_entity_id}_{location}_conf"
+        self.appdaemon_entity = f"{presence_name}.{device_name}_{location}"
+        self.friendly_name = device_name.strip().replace("_", " ").title()
+
+
+class RssiMatrix:
+    """Smoothed RSSI of every device at every location.
+
+    Each device owns a row of doubles indexed by location, holding an EWMA of
+    the reported RSSI (NaN when unknown) and the time it was last updated.
+    """
+
+    def __init__(self, smoothing=0.3, hysteresis=3, max_age=300):
+        self.smoothing = smoothing
+        self.hysteresis = hysteresis
+        self.max_age = max_age
+        self.locations = []
+        self.location_index = dict()
+        self.rssi = dict()
+        self.updated = dict()
+
+    def _row(self, device):
+        row = self.rssi.get(device)
+        if row is None:
+            row = self.rssi[device] = array("d", [math.nan] * len(self.locations))
+            self.updated[device] = array("d", [0.0] * len(self.locations))
+        elif len(row) < len(self.locations):
+            missing = len(self.locations) - len(row)
+            row.extend([math.nan] * missing)
+            self.updated[device].extend([0.0] * missing)
+        return row
+
+    def _index(self, location):
+        index = self.location_index.get(location)
+        if index is None:
+            index = self.location_index[location] = len(self.locations)
+            self.locations.append(location)
+        return index
+
+    def update(self, device, location, rssi, now=None):
+        """Fold a new RSSI sample into the smoothed value, returning it."""
+        now = time.monotonic() if now is None else now
+        index = self._index(location)
+        row = self._row(device)
+        updated = self.updated[device]
+        value = row[index]
+        if math.isnan(value) or now - updated[index] > self.max_age:
+            # Start over rather than smoothing against an old reading
+            value = rssi
+        else:
+            value += self.smoothing * (rssi - value)
+        row[index] = value
+        updated[index] = now
+        return value
+
+    def clear(self, device, location=None):
+        """Forget the RSSI of a device at one or every location."""
+        row = self.rssi.get(device)
+        if row is None:
+            return
+        if location is None:
+            for index in range(len(row)):
+                row[index] = math.nan
+            return
+        index = self.location_index.get(location)
+        if index is not None and index < len(row):
+            row[index] = math.nan
+
+    def clear_location(self, location):
+        for device in self.rssi:
+            self.clear(device, location)
+
+    def remove(self, device):
+        self.rssi.pop(device, None)
+        self.updated.pop(device, None)
+
+    def nearest(self, device, current=None, now=None):
+        """Return the location with the strongest smoothed RSSI.
+
+        Readings older than ``max_age`` are skipped, a monitor that stopped
+        reporting can not stay the nearest. The current location is kept unless
+        another one beats it by more than the hysteresis, so the result does not
+        flap between close monitors.
+        """
+        row = self.rssi.get(device)
+        if row is None:
+            return None
+
+        now = time.monotonic() if now is None else now
+        oldest = now - self.max_age
+        updated = self.updated[device]
+        best = None
+        best_value = -math.inf
+        for index, value in enumerate(row):
+            if value > best_value and updated[index] >= oldest:
+                best, best_value = index, value
+        if best is None:
+            return None
+
+        current_index = self.location_index.get(current)
+        if current_index is not None and current_index < len(row):
+            current_value = row[current_index]
+            if (
+                not math.isnan(current_value)
+                and updated[current_index] >= oldest
+                and best_value - current_value <= self.hysteresis
+            ):
+                return current
+        return self.locations[best]
+
+
+class ConfidenceVector:
+    """Latest confidence of one device at every location.
+
+    Keeps the number of locations at or above the home threshold and the
+    highest confidence up to date as values arrive, so deciding home or not
+    home never has to look at the other locations.
+    """
+
+    __slots__ = ["threshold", "values", "above", "max"]
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.values = dict()
+        self.above = 0
+        self.max = None
+
+    @property
+    def home(self):
+        return self.above > 0
+
+    def set(self, location, confidence):
+        old = self.values.get(location)
+        self.values[location] = confidence
+        self.above += (confidence >= self.threshold) - (
+            old is not None and old >= self.threshold
+        )
+
+        if self.max is None or confidence >= self.max:
+            self.max = confidence
+        elif old == self.max:
+            # The previous maximum dropped, only then look at the others
+            self.max = max(self.values.values())
+
+    def discard(self, location):
+        old = self.values.pop(location, None)
+        if old is None:
+            return
+        if old >= self.threshold:
+            self.above -= 1
+        if old == self.max:
+            self.max = max(self.values.values()) if self.values else None
+
+
+class DepartureGaps:
+    """Recent zero-confidence gaps of a device that ended with it reappearing.
+
+    The departure timeout is the gap length a device stays under with
+    probability ``1 - false_departure_rate``, so waiting that long declares a
+    device away that is only briefly missing at about that rate.
+    """
+
+    __slots__ = ["gaps", "next", "count", "started", "timeout"]
+
+    def __init__(self, size=100):
+        self.gaps = array("f", bytes(4 * size))
+        self.next = 0
+        self.count = 0
+        self.started = None
+        self.timeout = None
+
+    def start(self, now):
+        if self.started is None:
+            self.started = now
+
+    def end(self, now, cap):
+        """Close the open gap, returning True if it was recorded."""
+        if self.started is None:
+            return False
+
+        gap = now - self.started
+        self.started = None
+        if gap > cap:
+            # gone for longer than a short dropout, a real departure
+            return False
+
+        self.gaps[self.next] = gap
+        self.next = (self.next + 1) % len(self.gaps)
+        self.count = min(self.count + 1, len(self.gaps))
+        return True
+
+    def learn(self, false_departure_rate, min_samples, minimum, maximum):
+        """Recompute the timeout, None until enough gaps were seen."""
+        if self.count < min_samples:
+            self.timeout = None
+            return None
+
+        gaps = sorted(self.gaps[: self.count])
+        index = min(int(math.ceil((1 - false_departure_rate) * len(gaps))), len(gaps)) - 1
+        self.timeout = round(min(max(gaps[max(index, 0)], minimum), maximum), 1)
+        return self.timeout
+
+
+class OccupancyModel:
+    """Home, away and unknown counts over every tracked device."""
+
+    HOME = "home"
+    AWAY = "away"
+    UNKNOWN = "unknown"
+
+    def __init__(self):
+        self.states = dict()
+        self.counts = {self.HOME: 0, self.AWAY: 0, self.UNKNOWN: 0}
+
+    @property
+    def home(self):
+        return self.counts[self.HOME]
+
+    @property
+    def away(self):
+        return self.counts[self.AWAY]
+
+    def set(self, device, state):
+        old = self.states.get(device)
+        if old == state:
+            return
+        if old is not None:
+            self.counts[old] -= 1
+        self.states[device] = state
+        self.counts[state] += 1
+
+    def discard(self, device):
+        old = self.states.pop(device, None)
+        if old is not None:
+            self.counts[old] -= 1
+
+    def sensors(self):
+        """Return the somebody_is_home, everyone_home and everyone_not_home states.
+
+        Devices in an unknown state are left out, as if they were not tracked.
+        """
+        somebody_home = "on" if self.home > 0 else "off"
+        everyone_home = "on" if self.home > 0 and self.away == 0 else "off"
+        everyone_not_home = "on" if self.away > 0 and self.home == 0 else "off"
+        return somebody_home, everyone_home, everyone_not_home
+
+
+class ScanRequest:
+    """A scan waiting to be sent to the monitors."""
+
+    __slots__ = ["scan_type", "requested", "due", "repeats"]
+
+    def __init__(self, scan_type, requested, due, repeats=0):
+        self.scan_type = scan_type
+        self.requested = requested
+        self.due = due
+        self.repeats = repeats
+
+    @property
+    def priority(self):
+        return SCAN_PRIORITY[self.scan_type], self.due
+
+
+class ScanQueue:
+    """At most one pending request per scan type.
+
+    Monitors only listen to the scan topics shared by every node, so a scan
+    always runs everywhere and a request for a scan that is already waiting is
+    merged into it instead of queued again. Depart scans are debounced, a new
+    request moves the pending one back, every other scan keeps the earliest due
+    time.
+    """
+
+    def __init__(self):
+        self.pending = dict()
+        self.requested = 0
+        self.coalesced = 0
+        self.dispatched = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.latency_last = 0.0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, scan_type, delay=0, repeats=0, now=None):
+        now = time.monotonic() if now is None else now
+        self.requested += 1
+        due = now + delay
+
+        request = self.pending.get(scan_type)
+        if request is None:
+            self.pending[scan_type] = ScanRequest(scan_type, now, due, repeats)
+            return
+
+        self.coalesced += 1
+        request.repeats = max(request.repeats, repeats)
+        if scan_type == SCAN_DEPART:
+            request.due = due
+        else:
+            request.due = min(request.due, due)
+
+    def next_due(self):
+        if not self.pending:
+            return None
+        return min(request.due for request in self.pending.values())
+
+    def pop(self, now=None):
+        """Remove and return the most urgent request that is due, if any."""
+        now = time.monotonic() if now is None else now
+        ready = [request for request in self.pending.values() if request.due <= now]
+        if not ready:
+            return None
+
+        request = min(ready, key=lambda r: r.priority)
+        del self.pending[request.scan_type]
+        # Time the scan waited past its due time, mostly for a busy scanner
+        latency = now - request.due
+        self.dispatched += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.latency_last = latency
+        return request
+
+    def discard(self, scan_type, now=None):
+        """Drop a due request of a scan type the monitors are already running."""
+        now = time.monotonic() if now is None else now
+        request = self.pending.get(scan_type)
+        if request is not None and request.due <= now:
+            del self.pending[scan_type]
+            self.coalesced += 1
+
+    def clear(self):
+        self.pending.clear()
+
+
+class SSHConnectionPool:
+    """Reusable SSH connections to the remote monitors.
+
+    Connections are kept open with transport keepalives after a command
+    completes and closed once they have been idle for ``idle_timeout``.
+    Safe to use from the executor threads running node commands.
+    """
+
+    def __init__(self, keepalive=30, idle_timeout=300):
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+        self.idle = dict()
+        self.lock = threading.Lock()
+
+    def connect(self, setting, timeout):
+        if paramiko is None:
+            raise RuntimeError("paramiko is required to run commands on remote monitors")
+
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(
+            setting["host"],
+            port=int(setting.get("port", 22)),
+            username=setting["username"],
+            password=setting["password"],
+            timeout=timeout,
+        )
+        client.get_transport().set_keepalive(self.keepalive)
+        return client
+
+    def acquire(self, node, setting, timeout):
+        """Return an open connection to the node, reusing an idle one if possible."""
+        while True:
+            with self.lock:
+                connections = self.idle.get(node)
+                if not connections:
+                    break
+                client, _ = connections.pop()
+
+            transport = client.get_transport()
+            if transport is not None and transport.is_active():
+                return client
+            client.close()
+
+        return self.connect(setting, timeout)
+
+    def release(self, node, client):
+        with self.lock:
+            self.idle.setdefault(node, []).append((client, time.monotonic()))
+
+    def evict(self):
+        """Close connections idle for longer than the idle timeout."""
+        expired = []
+        now = time.monotonic()
+        with self.lock:
+            for node, connections in self.idle.items():
+                expired.extend(c for c, used in connections if now - used > self.idle_timeout)
+                connections[:] = [
+                    (c, used) for c, used in connections if now - used <= self.idle_timeout
+                ]
+        for client in expired:
+            client.close()
+        return len(expired)
+
+    def close(self, node=None):
+        """Close the idle connections of a node, or of every node."""
+        with self.lock:
+            if node is None:
+                connections = [c for idle in self.idle.values() for c in idle]
+                self.idle = dict()
+            else:
+                connections = self.idle.pop(node, [])
+        for client, _ in connections:
+            client.close()
+
+    def run(self, node, setting, cmd, timeout, on_line=None, reuse=True):
+        """Run a command on a node, passing each output line to ``on_line``.
+
+        Stdout and stderr are combined. The whole command must finish within
+        ``timeout`` seconds, otherwise ``TimeoutError`` is raised and the
+        connection is dropped. Every blocking step only waits for the time left
+        until that deadline. Returns the exit status and the output lines.
+        """
+        deadline = time.monotonic() + timeout
+
+        def remaining():
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise TimeoutError(f"{cmd} on {node} timed out after {timeout}s")
+            return left
+
+        client = self.acquire(node, setting, timeout)
+        lines = []
+        try:
+            channel = client.get_transport().open_session(timeout=remaining())
+            channel.set_combine_stderr(True)
+            channel.settimeout(remaining())
+            channel.exec_command(cmd)
+
+            pending = b""
+            while True:
+                channel.settimeout(remaining())
+                try:
+                    data = channel.recv(4096)
+                except socket.timeout:
+                    raise TimeoutError(f"{cmd} on {node} timed out after {timeout}s")
+                if not data:
+                    break
+
+                *complete, pending = (pending + data).split(b"\n")
+                for line in complete:
+                    lines.append(line.decode(errors="replace").rstrip("\r"))
+                    if on_line is not None:
+                        on_line(lines[-1])
+
+            if pending:
+                lines.append(pending.decode(errors="replace").rstrip("\r"))
+                if on_line is not None:
+                    on_line(lines[-1])
+
+            if not channel.status_event.wait(remaining()):
+                raise TimeoutError(f"{cmd} on {node} timed out after {timeout}s")
+            exit_status = channel.recv_exit_status()
+            channel.close()
+
+        except BaseException:
+            client.close()
+            raise
+
+        if reuse:
+            self.release(node, client)
+        else:
+            client.close()
+        return exit_status, lines
+
+
+class DeviceIndex:
+    """Every AppDaemon and HASS entity created for a device id (MAC or beacon)."""
+
+    def __init__(self):
+        self.built = False
+        self.device_names = dict()
+        self.names = dict()
+        self.ad_entities = dict()
+        self.hass_entities = dict()
+
+    def __iter__(self):
+        return iter(list(self.device_names))
+
+    def add(self, device_id, device_name, name=None, ad_entity=None, hass_entity=None):
+        self.device_names.setdefault(device_id, set()).add(device_name)
+        if name is not None:
+            self.names[device_id] = name.lower()
+        if ad_entity is not None:
+            self.ad_entities.setdefault(device_id, set()).add(ad_entity)
+        if hass_entity is not None:
+            self.hass_entities.setdefault(device_id, set()).add(hass_entity)
+
+    def pop(self, device_id):
+        """Forget a device, returning its device names, AD and HASS entities."""
+        self.names.pop(device_id, None)
+        return (
+            self.device_names.pop(device_id, set()),
+            self.ad_entities.pop(device_id, set()),
+            self.hass_entities.pop(device_id, set()),
+        )
+
+
+class KnownDeviceProvisioning:
+    """One run bringing the nodes' known devices in line with the configuration.
+
+    The run collects what every node reports for ``KNOWN DEVICE STATES``,
+    pushes only the devices some node is missing, one at a time as the
+    previous one is reported back, then asks for the states again and is
+    done once every node reports every configured device.
+    """
+
+    COLLECTING = "collecting"
+    PUSHING = "pushing"
+    CONFIRMING = "confirming"
+    DONE = "done"
+
+    def __init__(self, desired, nodes, now):
+        self.desired = set(desired)
+        self.reported = {node: set() for node in nodes}
+        self.phase = self.COLLECTING
+        self.queue = []
+        self.in_flight = None
+        self.pushed = 0
+        self.rounds = 0
+        self.started = now
+        self.last_report = now
+
+    def report(self, node, device_id, now):
+        """Record a device reported by a node, returning True if it acks a push."""
+        self.reported.setdefault(node, set()).add(device_id)
+        self.last_report = now
+        return device_id is not None and device_id == self.in_flight
+
+    def missing(self):
+        """Return the configured devices each node has not reported."""
+        return {node: self.desired - devices for node, devices in self.reported.items()}
+
+    def complete(self):
+        return bool(self.reported) and not any(self.missing().values())
+
+    def start_round(self):
+        self.phase = self.PUSHING
+        self.rounds += 1
+        if self.reported:
+            self.queue = sorted(set().union(*self.missing().values()))
+        else:
+            # no node reported anything, so every device has to be pushed
+            self.queue = sorted(self.desired)
+
+    def next_device(self):
+        self.in_flight = self.queue.pop(0) if self.queue else None
+        if self.in_flight is not None:
+            self.pushed += 1
+        return self.in_flight
+
+
+class HistoryRing:
+    """Fixed size history of one device at one location.
+
+    Three parallel arrays hold the sample time (uint32 epoch seconds), the
+    confidence (int8, -1 when unknown) and the RSSI (int16, -32768 when
+    unknown): 7 bytes per sample whatever the number of samples recorded.
+    """
+
+    NO_CONFIDENCE = -1
+    NO_RSSI = -32768
+
+    __slots__ = ["capacity", "timestamps", "confidence", "rssi", "next", "count"]
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = array("I", bytes(4 * capacity))
+        self.confidence = array("b", bytes(capacity))
+        self.rssi = array("h", bytes(2 * capacity))
+        self.next = 0
+        self.count = 0
+
+    def append(self, timestamp, confidence=None, rssi=None):
+        index = self.next
+        self.timestamps[index] = int(timestamp)
+        self.confidence[index] = (
+            self.NO_CONFIDENCE if confidence is None else min(max(confidence, 0), 100)
+        )
+        self.rssi[index] = self.NO_RSSI if rssi is None else max(rssi, -32767)
+        self.next = (index + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def indexes(self):
+        """Return the indexes of the samples held, oldest first."""
+        start = (self.next - self.count) % self.capacity
+        return [(start + offset) % self.capacity for offset in range(self.count)]
+
+    def since(self, timestamp):
+        """Yield the samples taken at or after ``timestamp``, newest first."""
+        for index in reversed(self.indexes()):
+            if self.timestamps[index] < timestamp:
+                return
+            yield self.timestamps[index], self.confidence[index], self.rssi[index]
+
+    def summary(self, timestamp):
+        """Return the number of samples and min/max/mean of confidence and RSSI."""
+        confidence = []
+        rssi = []
+        samples = 0
+        for _, sample_confidence, sample_rssi in self.since(timestamp):
+            samples += 1
+            if sample_confidence != self.NO_CONFIDENCE:
+                confidence.append(sample_confidence)
+            if sample_rssi != self.NO_RSSI:
+                rssi.append(sample_rssi)
+
+        summary = {"samples": samples}
+        for name, values in (("confidence", confidence), ("rssi", rssi)):
+            if values:
+                summary[name] = {
+                    "min": min(values),
+                    "max": max(values),
+                    "mean": round(sum(values) / len(values), 1),
+                }
+        return summary
+
+
+class DeviceHistory:
+    """Ring buffer history of every device at every location.
+
+    Memory is capacity × 7 bytes per device and location: with the default
+    capacity of 3600 samples (one hour at one sample per second) 50 devices
+    at 10 locations hold at most 500 × 25,200 bytes, about 12.6 MB.
+
+    The history is persisted as ``HPH\x01`` followed by a zlib compressed
+    body of, per ring, the key and its samples as packed arrays, oldest first.
+    """
+
+    MAGIC = b"HPH\x01"
+
+    def __init__(self, capacity=3600):
+        self.capacity = capacity
+        self.rings = dict()
+
+    def record(self, device, location, confidence=None, rssi=None, timestamp=None):
+        ring = self.rings.get((device, location))
+        if ring is None:
+            ring = self.rings[(device, location)] = HistoryRing(self.capacity)
+        ring.append(time.time() if timestamp is None else timestamp, confidence, rssi)
+
+    def remove(self, device):
+        for key in [key for key in self.rings if key[0] == device]:
+            del self.rings[key]
+
+    def query(self, device, location=None, minutes=10):
+        """Summarize the last ``minutes`` of a device, per location."""
+        since = time.time() - minutes * 60
+        return {
+            ring_location: ring.summary(since)
+            for (ring_device, ring_location), ring in self.rings.items()
+            if ring_device == device and location in (None, ring_location)
+        }
+
+    def dumps(self):
+        body = [struct.pack("<I", len(self.rings))]
+        for (device, location), ring in self.rings.items():
+            key = f"{device}|{location}".encode()
+            indexes = ring.indexes()
+            body.append(struct.pack("<HI", len(key), len(indexes)))
+            body.append(key)
+            for values in (ring.timestamps, ring.confidence, ring.rssi):
+                body.append(array(values.typecode, (values[i] for i in indexes)).tobytes())
+        return self.MAGIC + zlib.compress(b"".join(body), 1)
+
+    def loads(self, data):
+        """Restore the rings from ``dumps`` output, raising ValueError if invalid."""
+        if data[: len(self.MAGIC)] != self.MAGIC:
+            raise ValueError("Not a presence history file")
+        try:
+            body = memoryview(zlib.decompress(data[len(self.MAGIC) :]))
+            (rings,) = struct.unpack_from("<I", body)
+            offset = 4
+            for _ in range(rings):
+                key_size, count = struct.unpack_from("<HI", body, offset)
+                offset += 6
+                key = bytes(body[offset : offset + key_size]).decode()
+                device, location = key.split("|", 1)
+                offset += key_size
+
+                columns = []
+                for typecode in ("I", "b", "h"):
+                    column = array(typecode)
+                    size = column.itemsize * count
+                    column.frombytes(body[offset : offset + size])
+                    offset += size
+                    columns.append(column)
+
+                for timestamp, confidence, rssi in zip(*columns):
+                    self.record(
+                        device,
+                        location,
+                        None if confidence == HistoryRing.NO_CONFIDENCE else confidence,
+                        None if rssi == HistoryRing.NO_RSSI else rssi,
+                        timestamp,
+                    )
+        except (zlib.error, struct.error, UnicodeDecodeError) as error:
+            raise ValueError(f"Corrupt presence history file: {error}")
+
+
+class SensorCache:
+    """Authoritative in-memory copy of the HASS sensors the app writes.
+
+    A state change is reported so it can be written at once; attribute-only
+    changes mark the sensor dirty and are coalesced into one write per flush.
+    """
+
+    def __init__(self):
+        self.sensors = dict()
+        self.dirty = set()
+        self.updates = 0
+        self.writes = 0
+
+    def __contains__(self, sensor):
+        return sensor in self.sensors
+
+    @property
+    def avoided(self):
+        return self.updates - self.writes
+
+    def load(self, sensor, state, attributes):
+        """Seed the copy of a sensor from HASS or from the state just created."""
+        self.sensors[sensor] = {"state": state, "attributes": dict(attributes or {})}
+
+    def update(self, sensor, new_state=None, new_attr=None):
+        """Apply an update in memory, returning True if the state changed."""
+        self.updates += 1
+        cached = self.sensors[sensor]
+        state_changed = new_state is not None and cached["state"] != new_state
+        if state_changed:
+            cached["state"] = new_state
+
+        attributes = cached["attributes"]
+        if isinstance(new_attr, dict):
+            for key, value in new_attr.items():
+                if key not in attributes or attributes[key] != value:
+                    attributes[key] = value
+                    self.dirty.add(sensor)
+
+        if state_changed:
+            self.dirty.add(sensor)
+        return state_changed
+
+    def take(self, sensor):
+        """Return the state and attributes to write, clearing the dirty flag."""
+        self.dirty.discard(sensor)
+        self.writes += 1
+        cached = self.sensors[sensor]
+        return cached["state"], dict(cached["attributes"])
+
+    def discard(self, sensor):
+        self.sensors.pop(sensor, None)
+        self.dirty.discard(sensor)
+
+    def clear(self):
+        self.sensors.clear()
+        self.dirty.clear()
+
+
+class ProcessingStats:
+    """Message processing measured inside the app.
+
+    The handler time runs from a message reaching the app to its handler
+    returning. The latency runs from the ISO timestamp in a JSON payload to
+    the same point, so it covers the broker and AppDaemon queues as well.
+    Every HASS write of the app is counted, whatever path made it.
+    """
+
+    def __init__(self, size=1000):
+        self.reported_at = time.monotonic()
+        self.reported_messages = 0
+        self.messages = 0
+        self.handler_time = 0.0
+        self.handler_max = 0.0
+        self.latencies = deque(maxlen=size)
+        self.hass_writes = 0
+
+    def message(self, handler_time, latency=None):
+        self.messages += 1
+        self.handler_time += handler_time
+        self.handler_max = max(self.handler_max, handler_time)
+        if latency is not None:
+            self.latencies.append(latency)
+
+    @staticmethod
+    def latency(payload_json):
+        """Seconds since the timestamp of a payload, None if it has none."""
+        timestamp = payload_json.get("timestamp") if payload_json else None
+        try:
+            return time.time() - datetime.fromisoformat(timestamp).timestamp()
+        except (TypeError, ValueError):
+            return None
+
+    def attributes(self):
+        """The measurements, with the message rate since the last call."""
+        now = time.monotonic()
+        elapsed = now - self.reported_at
+        rate = (self.messages - self.reported_messages) / elapsed if elapsed else 0
+        self.reported_at = now
+        self.reported_messages = self.messages
+        attributes = {
+            "messages": self.messages,
+            "messages_per_second": round(rate, 1),
+            "handler_ms_mean": round(self.handler_time / self.messages * 1000, 3)
+            if self.messages
+            else 0,
+            "handler_ms_max": round(self.handler_max * 1000, 3),
+            "hass_writes": self.hass_writes,
+            "hass_writes_per_message": round(self.hass_writes / self.messages, 3)
+            if self.messages
+            else 0,
+        }
+        if self.latencies:
+            latencies = sorted(self.latencies)
+            attributes.update(
+                {
+                    "latency_ms_mean": round(sum(latencies) / len(latencies) * 1000, 1),
+                    "latency_ms_median": round(latencies[len(latencies) // 2] * 1000, 1),
+                    "latency_ms_max": round(latencies[-1] * 1000, 1),
+                }
+            )
+        return attributes
+
+
 # pylint: disable=attribute-defined-outside-init,unused-argument
 class HomePresenceApp(ad.ADBase):
     """Home Precence App Main Class."""
@@ -55,18 +1011,67 @@ class HomePresenceApp(ad.ADBase):
             p[0]: p[1].lower()
             for p in (b.split(" ", 1) for b in self.args.get("known_devices", []))
         }
+        self.known_device_entries = {
+            b.split(" ", 1)[0]: b for b in self.args.get("known_devices", [])
+        }
+
+        # Ack driven provisioning of the known devices on the nodes
+        self.provisioning = None
+        self.provisioning_timer = None
+        self.provision_settle = self.args.get("provision_settle", 3)
+        self.provision_ack_timeout = self.args.get("provision_ack_timeout", 2)
+        self.provision_confirm_timeout = self.args.get("provision_confirm_timeout", 15)
+        self.provision_rounds = self.args.get("provision_rounds", 3)
+        # Nodes that confirmed every known device, and the devices reported by
+        # reconnected nodes while their known devices are being checked
+        self.provisioned_nodes = set()
+        self.node_devices = dict()
+        self.node_device_timers = dict()
 
         # Support nested presence topics (e.g. "hass/monitor")
         self.topic_level = len(self.presence_topic.split("/"))
         self.presence_name = self.presence_topic.split("/")[-1]
 
         self.timeout = self.args.get("not_home_timeout", 30)
+
+        # Per device departure timeouts learned from short zero-confidence gaps
+        self.departure_gaps = dict()
+        self.departure_false_rate = self.args.get("departure_false_rate", 0.05)
+        self.departure_min_samples = self.args.get("departure_min_samples", 10)
+        self.departure_min_timeout = self.args.get("departure_min_timeout", 5)
+        self.departure_max_gap = self.args.get("departure_max_gap", 600)
         self.minimum_conf = self.args.get("minimum_confidence", 50)
         self.depart_check_time = self.args.get("depart_check_time", 30)
         self.system_timeout = self.args.get("system_timeout", 60)
         system_check = self.args.get("system_check", 30)
+        self.sensor_flush_interval = self.args.get("sensor_flush_interval", 1)
+
+        # Smoothed RSSI per device and location used to pick the nearest monitor
+        self.rssi_matrix = RssiMatrix(
+            smoothing=self.args.get("rssi_smoothing", 0.3),
+            hysteresis=self.args.get("rssi_hysteresis", 3),
+            max_age=self.args.get("rssi_max_age", 300),
+        )
+        self.nearest_monitors = dict()
+        self.conf_sensor_locations = dict()
+
+        # Confidence and RSSI history per device and location
+        self.history = DeviceHistory(self.args.get("history_size", 3600))
+        self.history_file = self.args.get(
+            "history_file",
+            os.path.join(self.AD.config_dir, f"{self.presence_name}_history.bin"),
+        )
+        self.load_history()
+
+        # Entities of every device id, used to clean up removed devices
+        self.device_index = DeviceIndex()
+
+        # Confidence of every device at every location, fed by confidence_updated
+        self.device_confidence = dict()
 
         self.all_users_sensors = []
+        self.occupancy = OccupancyModel()
+        self.occupancy_sensors = None
         self.not_home_timers = dict()
         self.location_timers = dict()
         self.confidence_handlers = dict()
@@ -74,10 +1079,45 @@ class HomePresenceApp(ad.ADBase):
         self.system_handle = dict()
         self.node_scheduled_reboot = dict()
         self.node_executing = dict()
+        self.ssh_pool = SSHConnectionPool(
+            keepalive=self.args.get("ssh_keepalive", 30),
+            idle_timeout=self.args.get("ssh_idle_timeout", 300),
+        )
+
+        # Compiled message router, every other action is a device confidence report
+        self.action_handlers = {
+            "status": self.handle_status_message,
+            "start": self.handle_scanning_message,
+            "end": self.handle_scanning_message,
+            "echo": self.handle_echo_message,
+            "reboot": self.handle_reboot_message,
+            "rssi": self.handle_rssi_message,
+        }
+        # Write-behind copy of the HASS sensors this app owns
+        self.sensor_cache = SensorCache()
+        self.sensor_flush_timer = None
+        self.sensor_cache_entity = f"{self.presence_name}.hass_sensor_writes"
+
+        # Message handling times and every HASS write, measured in the app
+        self.processing = ProcessingStats()
+        self.processing_interval = self.args.get("processing_stats", 0)
+        self.processing_entity = f"{self.presence_name}.processing"
+
+        self._device_records = lru_cache(maxsize=DEVICE_RECORD_CACHE_SIZE)(
+            self._build_device_record
+        )
 
         # Create a sensor to keep track of if the monitor is busy or not.
         self.monitor_entity = f"{self.presence_name}.monitor_state"
 
+        # Monitor and node states are forwarded to MQTT coalesced and deduplicated
+        self.forward_window = self.args.get("forward_window", 0.5)
+        self.forward_delta = self.args.get("forward_delta", False)
+        self.forward_pending = dict()
+        self.forward_fingerprints = dict()
+        self.forward_published = dict()
+        self.forward_timer = None
+
         self.mqtt.set_state(
             self.monitor_entity,
             state="idle",
@@ -103,15 +1143,20 @@ class HomePresenceApp(ad.ADBase):
             immediate=True,
         )
 
-        self.monitor_handlers = {self.monitor_entity: None}
+        # Scans wait in the queue until the scanner reports idle
+        self.scan_queue = ScanQueue()
+        self.scan_timer = None
+        self.scan_timer_due = None
+        self.scan_waiting = False
+        self.scan_start_latency = None
+        self.scan_queue_entity = f"{self.presence_name}.scan_queue"
+        self.mqtt.listen_state(self.scanner_idle, self.monitor_entity, new="idle")
 
         # Setup the Everybody Home/Not Home Group Sensors
         self.setup_global_sensors()
 
         # Initialize our timer variables
-        self.gateway_timer = None
         self.motion_timer = None
-        self.check_home_timer = None
 
         # Setup home gateway sensors
         if self.args.get("home_gateway_sensors") is not None:
@@ -159,14 +1204,10 @@ class HomePresenceApp(ad.ADBase):
 
         # Setup the system checks.
         if self.system_timeout > system_check:
-            topic = f"{self.presence_topic}/echo"
             self.adbase.run_every(
-                self.send_mqtt_message,
+                self.check_system,
                 self.adbase.datetime() + timedelta(seconds=1),
                 system_check,
-                topic=topic,
-                payload="",
-                scan_type="System",
             )
         else:
             self.adbase.log(
@@ -186,6 +1227,30 @@ class HomePresenceApp(ad.ADBase):
         # Listen for any HASS restarts
         self.hass.listen_event(self.hass_restarted, "plugin_restarted")
 
+        if self.processing_interval:
+            self.adbase.run_every(
+                self.publish_processing_stats,
+                self.adbase.datetime() + timedelta(seconds=self.processing_interval),
+                self.processing_interval,
+            )
+
+        # Persist the history so it survives restarts
+        history_interval = self.args.get("history_persist_interval", 300)
+        if self.history_file and history_interval:
+            self.adbase.run_every(
+                self.save_history,
+                self.adbase.datetime() + timedelta(seconds=history_interval),
+                history_interval,
+            )
+
+        # Close SSH connections to remote monitors that are no longer used
+        if self.args.get("remote_monitors") is not None:
+            self.adbase.run_every(
+                self.evict_ssh_connections,
+                self.adbase.datetime() + timedelta(seconds=60),
+                60,
+            )
+
         # Load the devices from the config.
         self.adbase.run_in(self.clean_devices, 0)  # clean old devices first
         self.setup_service()  # setup service
@@ -216,12 +1281,25 @@ class HomePresenceApp(ad.ADBase):
             "device_class": "presence",
         }
 
-        self.hass.set_state(
+        self.set_hass_state(
             f"binary_sensor.{sensor}", state="off", attributes=attributes
         )
 
     def presence_message(self, event_name, data, kwargs):
         """Process a message sent on the MQTT Topic."""
+        if not self.processing_interval:
+            self.process_message(data)
+            return
+
+        started = time.perf_counter()
+        message = self.process_message(data)
+        self.processing.message(
+            time.perf_counter() - started,
+            self.processing.latency(message.payload_json) if message else None,
+        )
+
+    def process_message(self, data):
+        """Hand a presence message to its handler, returning the parsed message."""
         topic = data.get("topic")
         payload = data.get("payload")
         self.adbase.log(f"{topic} payload: {payload}", level="DEBUG")
@@ -229,12 +1307,9 @@ class HomePresenceApp(ad.ADBase):
         topic_path = topic.split("/")
         action = topic_path[-1].lower()
 
-        # Process the payload as JSON if it is JSON
-        payload_json = {}
-        try:
-            payload_json = json.loads(payload)
-        except ValueError:
-            pass
+        # Miscellaneous Actions, Discard
+        if action in IGNORED_ACTIONS:
+            return
 
         # Handle request for immediate scan via MQTT
         # can be arrive/depart/rssi
@@ -245,6 +1320,18 @@ class HomePresenceApp(ad.ADBase):
             )
             return
 
+        # Presence System is Restarting
+        if action == "restart":
+            self.adbase.log("The Entire Presence System is Restarting", level="INFO")
+            return
+
+        # Process the payload as JSON if it is JSON
+        payload_json = {}
+        try:
+            payload_json = json.loads(payload)
+        except ValueError:
+            pass
+
         # Determine which scanner initiated the message
         location = "unknown"
         if isinstance(payload_json, dict) and "identity" in payload_json:
@@ -254,96 +1341,105 @@ class HomePresenceApp(ad.ADBase):
             location = topic_path[self.topic_level]
 
         location = location.replace(" ", "_").lower()
-        location_friendly = location.replace("_", " ").title()
+        message = PresenceMessage(topic, topic_path, action, payload, payload_json, location)
+
+        handler = self.action_handlers.get(action, self.handle_device_message)
+        handler(message)
+        return message
+
+    def handle_status_message(self, message):
+        """Status Message from the Presence System."""
+        self.handle_status(location=message.location, payload=message.payload.lower())
+
+    def handle_scanning_message(self, message):
+        """Scan start and end markers."""
+        self.handle_scanning(
+            action=message.action,
+            location=message.location,
+            scan_type=message.topic_path[self.topic_level + 1],
+        )
 
-        # Presence System is Restarting
-        if action == "restart":
-            self.adbase.log("The Entire Presence System is Restarting", level="INFO")
-            return
+    def handle_echo_message(self, message):
+        """Response to Echo Check of Scanner."""
+        self.handle_echo(location=message.location, payload=message.payload)
 
-        # Miscellaneous Actions, Discard
-        if action in [
-            "depart",
-            "arrive",
-            "state",
-            "known device states",
-            "add static device",
-            "delete static device",
-        ]:
-            return
+    def handle_reboot_message(self, message):
+        """Handle request for reboot of hardware."""
+        self.adbase.run_in(self.restart_device, 1, location=message.location)
 
-        # Status Message from the Presence System
-        if action == "status":
-            self.handle_status(location=location, payload=payload.lower())
-            return
+    def device_record(self, device_id, location):
+        """Return the cached entity ids and names for a device at a location."""
+        return self._device_records(device_id, location)
 
-        if action in ["start", "end"]:
-            self.handle_scanning(
-                action=action,
-                location=location,
-                scan_type=topic_path[self.topic_level + 1],
-            )
-            return
+    def _build_device_record(self, device_id, location):
+        # Handle Beacon Topics in MAC or iBeacon ID formats and make friendly.
+        device_name = self.known_beacons.get(device_id)
+        if device_name is None:
+            device_name = device_id.replace(":", "_").replace("-", "_")
 
-        # Response to Echo Check of Scanner
-        if action == "echo":
-            self.handle_echo(location=location, payload=payload)
-            return
+        return DeviceRecord(
+            self.presence_name, self.user_device_domain, device_name, location
+        )
 
-        # Handle request for reboot of hardware
-        if action == "reboot":
-            self.adbase.run_in(self.restart_device, 1, location=location)
+    def handle_rssi_message(self, message):
+        """RSSI Value for a Known Device."""
+        if message.topic == f"{self.presence_topic}/scan/rssi" or message.payload == "":
             return
 
-        device_name = topic_path[self.topic_level + 1]
-        # Handle Beacon Topics in MAC or iBeacon ID formats and make friendly.
-        if device_name in list(self.known_beacons.keys()):
-            device_name = self.known_beacons[device_name]
-        else:
-            device_name = device_name.replace(":", "_").replace("-", "_")
-
-        device_entity_id = f"{self.presence_name}_{device_name}"
-        device_state_sensor = f"{self.user_device_domain}.{device_entity_id}"
-        device_entity_prefix = f"{device_entity_id}_{location}"
-        device_conf_sensor = f"sensor.{device_entity_prefix}_conf"
-        device_local = f"{device_name}_{location}"
-        appdaemon_entity = f"{self.presence_name}.{device_local}"
-        friendly_name = device_name.strip().replace("_", " ").title()
-
-        # RSSI Value for a Known Device:
-        if action == "rssi":
-            if topic == f"{self.presence_topic}/scan/rssi" or payload == "":
-                return
+        payload = message.payload
+        record = self.device_record(
+            message.topic_path[self.topic_level + 1], message.location
+        )
+        attributes = {
+            "rssi": payload,
+            "last_reported_by": record.location_friendly,
+        }
+        self.adbase.log(
+            f"Recieved an RSSI of {payload} for {record.device_name} from {record.location_friendly}",
+            level="DEBUG",
+        )
 
-            attributes = {
-                "rssi": payload,
-                "last_reported_by": location.replace("_", " ").title(),
-            }
-            self.adbase.log(
-                f"Recieved an RSSI of {payload} for {device_name} from {location_friendly}",
-                level="DEBUG",
+        if (
+            self.hass.entity_exists(record.conf_sensor)
+            and self.hass.get_state(record.state_sensor, copy=False)
+            == self.state_true
+        ):
+            # unless it exists, and the device is home don't update RSSI
+            self.mqtt.set_state(record.appdaemon_entity, attributes=attributes)
+            self.update_hass_sensor(record.conf_sensor, new_attr={"rssi": payload})
+            self.record_rssi(record, payload)
+            self.history.record(
+                record.device_entity_id, record.location, rssi=as_int(payload)
             )
 
-            if (
-                self.hass.entity_exists(device_conf_sensor)
-                and self.hass.get_state(device_state_sensor, copy=False)
-                == self.state_true
-            ):
-                # unless it exists, and the device is home don't update RSSI
-                self.mqtt.set_state(appdaemon_entity, attributes=attributes)
-                self.update_hass_sensor(device_conf_sensor, new_attr={"rssi": payload})
-                self.update_nearest_monitor(device_name)
-            return
+    def handle_device_message(self, message):
+        """Confidence report for a device."""
+        payload_json = message.payload_json
+        location = message.location
+        record = self.device_record(message.topic_path[self.topic_level + 1], location)
+        device_name = record.device_name
+        device_entity_id = record.device_entity_id
+        device_state_sensor = record.state_sensor
+        device_conf_sensor = record.conf_sensor
+        appdaemon_entity = record.appdaemon_entity
+        friendly_name = record.friendly_name
+        location_friendly = record.location_friendly
 
         # Ignore invalid JSON responses
         if not payload_json:
             return
 
+        if location in self.node_devices:
+            self.node_devices[location].add(payload_json.get("id"))
+
+        if self.provisioning is not None:
+            self.provisioning_report(location, payload_json.get("id"))
+
         # Ignore unknown/bad types and unknown beacons
         if payload_json.get("type") not in [
             "KNOWN_MAC",
             "GENERIC_BEACON",
-        ] and payload_json.get("id") not in list(self.known_beacons.keys()):
+        ] and payload_json.get("id") not in self.known_beacons:
             self.adbase.log(
                 f"Ignoring Beacon {payload_json.get('id')} because it is not in the known_beacons list.",
                 level="DEBUG",
@@ -366,14 +1462,14 @@ class HomePresenceApp(ad.ADBase):
             self.adbase.log(
                 "Creating sensor {!r} for Confidence".format(device_conf_sensor)
             )
-            self.hass.set_state(
-                device_conf_sensor,
-                state=confidence,
-                attributes={
-                    "friendly_name": f"{friendly_name} {location_friendly} Confidence",
-                    "unit_of_measurement": "%",
-                },
+            attributes = {
+                "friendly_name": f"{friendly_name} {location_friendly} Confidence",
+                "unit_of_measurement": "%",
+            }
+            self.set_hass_state(
+                device_conf_sensor, state=confidence, attributes=attributes
             )
+            self.sensor_cache.load(device_conf_sensor, confidence, attributes)
 
         if not self.hass.entity_exists(device_state_sensor):
             # Device Home Presence Sensor Doesn't Exist Yet in Hass so create it
@@ -381,15 +1477,13 @@ class HomePresenceApp(ad.ADBase):
                 "Creating sensor {!r} for Home State".format(device_state_sensor),
                 level="DEBUG",
             )
-            self.hass.set_state(
-                device_state_sensor,
-                state=state,
-                attributes={
-                    "friendly_name": f"{friendly_name} Home",
-                    "type": payload_json.get("type", "UNKNOWN_TYPE"),
-                    "device_class": "presence",
-                },
-            )
+            attributes = {
+                "friendly_name": f"{friendly_name} Home",
+                "type": payload_json.get("type", "UNKNOWN_TYPE"),
+                "device_class": "presence",
+            }
+            self.set_hass_state(device_state_sensor, state=state, attributes=attributes)
+            self.sensor_cache.load(device_state_sensor, state, attributes)
 
         if not self.mqtt.entity_exists(device_state_sensor):
             # Device Home Presence Sensor Doesn't Exist Yet in default so create it
@@ -413,6 +1507,7 @@ class HomePresenceApp(ad.ADBase):
         # Add listeners to the conf sensors to update the main state sensor on change.
         if device_conf_sensor not in self.home_state_entities[device_entity_id]:
             self.home_state_entities[device_entity_id].append(device_conf_sensor)
+            self.conf_sensor_locations[device_conf_sensor] = location
             self.confidence_handlers[device_conf_sensor] = self.hass.listen_state(
                 self.confidence_updated,
                 device_conf_sensor,
@@ -425,12 +1520,31 @@ class HomePresenceApp(ad.ADBase):
         self.update_hass_sensor(device_conf_sensor, confidence, new_attr=payload_json)
         self.mqtt.set_state(appdaemon_entity, state=confidence, attributes=payload_json)
 
+        self.history.record(
+            device_entity_id,
+            location,
+            confidence=confidence,
+            rssi=as_int(payload_json.get("rssi")),
+        )
+
+        if "id" in payload_json:
+            self.device_index.add(
+                payload_json["id"],
+                device_name,
+                name=payload_json.get("name"),
+                ad_entity=appdaemon_entity,
+                hass_entity=device_conf_sensor,
+            )
+
         # Set the nearest monitor property if we have a new RSSI.
         if "rssi" in payload_json:
-            self.update_nearest_monitor(device_name)
+            self.record_rssi(record, payload_json["rssi"])
 
         if device_state_sensor not in self.all_users_sensors:
             self.all_users_sensors.append(device_state_sensor)
+            self.set_occupancy(
+                device_state_sensor, self.cached_sensor_state(device_state_sensor)
+            )
 
             # now listen to this sensor's state changes
             # used to check if the user was not home before, and if home run rssi immediately to determine closest monitor
@@ -482,8 +1596,14 @@ class HomePresenceApp(ad.ADBase):
                     "location": location_friendly,
                 }
             )
-            # Load devices for all locations:
-            self.adbase.run_in(self.load_known_devices, 30)
+
+        if payload == "online":
+            if location in self.provisioned_nodes:
+                # A node reconnected, only provision if it lost devices
+                self.check_node_devices(location)
+            else:
+                # A new node, make sure it knows every device
+                self.provision_known_devices({})
 
         self.mqtt.set_state(entity_id, state=payload, attributes=attributes)
 
@@ -528,6 +1648,43 @@ class HomePresenceApp(ad.ADBase):
             attributes=attributes,
         )
 
+    def check_system(self, kwargs):
+        """Send the echo every node answers, awaiting the first answer if possible."""
+        topic = f"{self.presence_topic}/echo"
+        if not hasattr(self.mqtt, "mqtt_request"):
+            self.mqtt.mqtt_publish(topic, "")
+            return
+
+        # Each answer still reaches handle_echo, the request only times the first one
+        self.AD.executor.submit(self.echo_request, topic)
+
+    def echo_request(self, topic):
+        """Runs on the executor, mqtt_request blocks until a node answers."""
+        started = time.monotonic()
+        try:
+            reply = self.mqtt.mqtt_request(
+                topic,
+                "",
+                response_topic=f"{self.presence_topic}/+/echo",
+                timeout=ECHO_TIMEOUT,
+            )
+        except REQUEST_TIMEOUT_ERRORS:
+            reply = None
+
+        latency = time.monotonic() - started if reply is not None else None
+        self.adbase.run_in(self.echo_answered, 0, latency=latency)
+
+    def echo_answered(self, kwargs):
+        latency = kwargs["latency"]
+        if latency is None:
+            self.adbase.log(
+                f"No monitor answered the echo within {ECHO_TIMEOUT} seconds",
+                level="WARNING",
+            )
+            return
+
+        self.mqtt.set_state(self.monitor_entity, echo_latency=round(latency, 3))
+
     def handle_echo(self, location, payload):
         """Handle an echo response from a scanner."""
         self.adbase.log(f"Echo received from {location}: {payload}", level="DEBUG")
@@ -580,42 +1737,43 @@ class HomePresenceApp(ad.ADBase):
 
         self.mqtt.set_state(self.monitor_entity, attributes=attributes)
 
+    def record_rssi(self, record, rssi):
+        """Add a reported RSSI to the matrix and refresh the nearest monitor."""
+        rssi = as_int(rssi)
+        if rssi is None:
+            return
+
+        self.rssi_matrix.update(record.device_entity_id, record.location, rssi)
+        self.update_nearest_monitor(record.device_name)
+
     def update_nearest_monitor(self, device_name):
         """Determine which monitor the device is closest to based on RSSI value."""
         device_entity_id = f"{self.presence_name}_{device_name}"
-        device_conf_sensors = self.home_state_entities.get(device_entity_id)
         device_state_sensor = f"{self.user_device_domain}.{device_entity_id}"
 
-        if device_conf_sensors is None:
+        if device_entity_id not in self.home_state_entities:
             self.adbase.log(
                 f"Got Confidence Value for {device_entity_id} but device"
                 " is not set up (no sensors found).",
                 level="WARNING",
             )
-            self.adbase.run_in(self.run_arrive_scan, 0)
+            self.request_scan(SCAN_ARRIVE)
             return
 
-        rssi_values = {
-            loc.replace(f"sensor.{device_entity_id}_", "").replace(
-                "_conf", ""
-            ): self.hass.get_state(loc, attribute="rssi")
-            for loc in device_conf_sensors
-        }
-
-        rssi_values = {
-            loc: int(rssi)
-            for loc, rssi in rssi_values.items()
-            if rssi is not None and rssi != "unknown"
-        }
-
-        nearest_monitor = "unknown"
-        if rssi_values:
-            nearest_monitor = max(rssi_values, key=rssi_values.get)
+        current = self.nearest_monitors.get(device_entity_id)
+        nearest_monitor = self.rssi_matrix.nearest(device_entity_id, current)
+        if nearest_monitor is None:
+            nearest_monitor = "unknown"
+        else:
             self.adbase.log(
-                f"{device_entity_id} is closest to {nearest_monitor} based on last reported RSSI values",
+                f"{device_entity_id} is closest to {nearest_monitor} based on smoothed RSSI values",
                 level="DEBUG",
             )
 
+        if nearest_monitor == current:
+            return
+
+        self.nearest_monitors[device_entity_id] = nearest_monitor
         nearest_monitor = nearest_monitor.replace("_", " ").title()
         self.mqtt.set_state(device_state_sensor, nearest_monitor=nearest_monitor)
         self.update_hass_sensor(
@@ -626,45 +1784,54 @@ class HomePresenceApp(ad.ADBase):
         """Respond to a monitor providing a new confidence value."""
         device_entity_id = kwargs["device_entity_id"]
         device_state_sensor = f"{self.user_device_domain}.{device_entity_id}"
-        device_state_sensor_value = self.hass.get_state(device_state_sensor, copy=False)
-        device_type = self.hass.get_state(entity, attribute="type", copy=False)
-        device_conf_sensors = self.home_state_entities.get(device_entity_id)
+        device_state_sensor_value = self.cached_sensor_state(device_state_sensor)
+        location = self.conf_sensor_locations.get(entity)
 
-        if device_conf_sensors is None:
+        if device_entity_id not in self.home_state_entities or location is None:
             self.adbase.log(
                 f"Got Confidence Value for {device_entity_id} but device"
                 " is not set up (no sensors found).",
                 level="WARNING",
             )
 
-            self.adbase.run_in(self.run_arrive_scan, 0)
+            self.request_scan(SCAN_ARRIVE)
+            return
+
+        confidence = self.device_confidence.get(device_entity_id)
+        if confidence is None:
+            confidence = self.device_confidence[device_entity_id] = ConfidenceVector(
+                self.minimum_conf
+            )
+
+        try:
+            new = int(float(new))
+        except (TypeError, ValueError):
+            # unknown values don't count towards the device being home or away
+            confidence.discard(location)
             return
 
-        if int(new) == 0:  # the confidence is 0, so rssi should be lower
+        confidence.set(location, new)
+        self.track_departure_gap(device_entity_id, device_state_sensor, confidence, new)
+
+        if new == 0:  # the confidence is 0, so rssi should be lower
             # unknown used just to ensure it doesn't clash with an active node
             appdaemon_conf_sensor = self.hass_conf_sensor_to_appdaemon_conf(entity)
             self.mqtt.set_state(appdaemon_conf_sensor, rssi="unknown")
             self.update_hass_sensor(entity, new_attr={"rssi": "unknown"})
-
-        sensor_res = list(
-            map(lambda x: self.hass.get_state(x, copy=False), device_conf_sensors)
-        )
-        sensor_res = [i for i in sensor_res if i is not None and i != "unknown"]
+            self.rssi_matrix.clear(device_entity_id, location)
 
         self.adbase.log(
-            "Device State: {}, User Device Sensor: {}, Device Type {}, New: {}, State: {}".format(
+            "Device State: {}, User Device Sensor: {}, Max Confidence {}, New: {}, State: {}".format(
                 device_entity_id,
                 device_state_sensor,
-                device_type,
+                confidence.max,
                 new,
                 device_state_sensor_value,
             ),
             level="DEBUG",
         )
 
-        if sensor_res != [] and any(
-            list(map(lambda x: int(x) >= self.minimum_conf, sensor_res))
-        ):
+        if confidence.home:
             # Cancel the running timer.
             if self.not_home_timers.get(device_entity_id) is not None:
                 self.adbase.cancel_timer(self.not_home_timers[device_entity_id])
@@ -673,37 +1840,67 @@ class HomePresenceApp(ad.ADBase):
             # update binary sensors for user
             self.mqtt.set_state(device_state_sensor, state=self.state_true)
             self.update_hass_sensor(device_state_sensor, self.state_true)
-
-            # now check how many ppl are home
-            count = self.count_persons_in_home()
-            self.update_hass_sensor(
-                self.somebody_is_home, "on", new_attr={"count": count}
-            )
-
-            if device_state_sensor in self.all_users_sensors:
-                self.update_hass_sensor(self.everyone_not_home, "off")
-                if self.check_home_timer is not None:
-                    self.adbase.cancel_timer(self.check_home_timer)
-
-                self.check_home_timer = self.adbase.run_in(
-                    self.check_home_state, 2, check_state="is_home"
-                )
+            self.set_occupancy(device_state_sensor, self.state_true)
             return
 
         if (
             self.not_home_timers.get(device_entity_id) is None
             and device_state_sensor_value not in ["off", "not_home"]
-            and int(new) == 0
+            and new == 0
         ):
             # if "BEACON" not in str(device_type):
             # Run another scan before declaring the user away as extra
             # check within the timeout time if this isn't a beacon
-            self.adbase.run_in(self.run_arrive_scan, 0)
+            self.request_scan(SCAN_ARRIVE)
 
+            timeout = self.departure_timeout(device_entity_id)
             self.not_home_timers[device_entity_id] = self.adbase.run_in(
-                self.not_home_func, self.timeout, device_entity_id=device_entity_id
+                self.not_home_func, timeout, device_entity_id=device_entity_id
+            )
+            self.adbase.log(
+                f"Timer Started for {device_entity_id} ({timeout}s)", level="DEBUG"
             )
-            self.adbase.log(f"Timer Started for {device_entity_id}", level="DEBUG")
+
+    def track_departure_gap(self, device_entity_id, device_state_sensor, confidence, new):
+        """Measure how long a device stays at zero confidence before it is back."""
+        gaps = self.departure_gaps.get(device_entity_id)
+        if gaps is None:
+            gaps = self.departure_gaps[device_entity_id] = DepartureGaps()
+
+        if not confidence.home:
+            # the gap starts where the not home timer would start
+            if new == 0:
+                gaps.start(time.monotonic())
+            return
+
+        if not gaps.end(time.monotonic(), self.departure_max_gap):
+            return
+
+        previous = gaps.timeout
+        timeout = gaps.learn(
+            self.departure_false_rate,
+            self.departure_min_samples,
+            self.departure_min_timeout,
+            # learning may only bring departures forward, never delay them
+            self.timeout,
+        )
+        if timeout is None or timeout == previous:
+            return
+
+        attributes = {
+            "departure_timeout": timeout,
+            # seconds a departure is now detected sooner than with not_home_timeout
+            "departure_latency_saved": round(self.timeout - timeout, 1),
+        }
+        self.mqtt.set_state(device_state_sensor, attributes=attributes)
+        self.update_hass_sensor(device_state_sensor, new_attr=attributes)
+
+    def departure_timeout(self, device_entity_id):
+        """Return the learned departure timeout, or not_home_timeout until learned."""
+        gaps = self.departure_gaps.get(device_entity_id)
+        if gaps is None or gaps.timeout is None:
+            return self.timeout
+        return gaps.timeout
 
     def device_state_changed(self, entity, attribute, old, new, kwargs):
         """Used to run RSSI scan in the event the device Left the house and re-entered"""
@@ -711,9 +1908,10 @@ class HomePresenceApp(ad.ADBase):
         device_name = kwargs["device_name"]
         device_entity_id = f"{self.presence_name}_{device_name}"
         if new == self.state_true:  # device now home
-            self.adbase.run_in(self.run_rssi_scan, 0)
+            self.request_scan(SCAN_RSSI)
 
         elif new == self.state_false:  # device is away
+            self.rssi_matrix.clear(device_entity_id)
             device_conf_sensors = self.home_state_entities[device_entity_id]
             # now set all of their sensor's rssi to unknown to indicate its way
             for sensor in device_conf_sensors:
@@ -727,19 +1925,14 @@ class HomePresenceApp(ad.ADBase):
         """Manage devices that are not home."""
         device_entity_id = kwargs.get("device_entity_id")
         device_state_sensor = f"{self.user_device_domain}.{device_entity_id}"
-        device_conf_sensors = self.home_state_entities[device_entity_id]
-        sensor_res = list(
-            map(lambda x: self.hass.get_state(x, copy=False), device_conf_sensors)
-        )
-
-        # Remove unknown values from list
-        sensor_res = [i for i in sensor_res if i is not None and i != "unknown"]
+        confidence = self.device_confidence.get(device_entity_id)
 
         self.adbase.log(
-            f"Device Not Home: {device_entity_id}, Sensors: {sensor_res}", level="DEBUG"
+            f"Device Not Home: {device_entity_id}, Max Confidence: {confidence and confidence.max}",
+            level="DEBUG",
         )
 
-        if all(list(map(lambda x: int(x) < self.minimum_conf, sensor_res))):
+        if confidence is None or not confidence.home:
             # Confirm for the last time
             self.mqtt.set_state(
                 device_state_sensor, state=self.state_false, nearest_monitor="unknown"
@@ -747,17 +1940,8 @@ class HomePresenceApp(ad.ADBase):
             self.update_hass_sensor(
                 device_state_sensor, self.state_false, {"nearest_monitor": "unknown"}
             )
-
-            if device_state_sensor in self.all_users_sensors:
-                # At least someone not home, set Everyone Home to off
-                self.update_hass_sensor(self.everyone_home, "off")
-
-                if self.check_home_timer is not None:
-                    self.adbase.cancel_timer(self.check_home_timer)
-
-                self.check_home_timer = self.adbase.run_in(
-                    self.check_home_state, 2, check_state="not_home"
-                )
+            self.nearest_monitors[device_entity_id] = "unknown"
+            self.set_occupancy(device_state_sensor, self.state_false)
 
         self.not_home_timers[device_entity_id] = None
 
@@ -765,27 +1949,6 @@ class HomePresenceApp(ad.ADBase):
         """Send a MQTT Message."""
         topic = kwargs.get("topic")
         payload = kwargs.get("payload")
-        if kwargs["scan_type"] == "Depart":
-            count = kwargs.get("count", 0)
-            # Last Gateway Based Timer
-            self.gateway_timer = None
-
-            if self.mqtt.get_state(self.monitor_entity) == "idle":
-                self.mqtt.mqtt_publish(topic, payload)
-                # Scan for departure times. 3 as default
-                if count <= self.args.get("depart_scans", 3):
-                    count = count + 1
-                    self.adbase.run_in(self.run_depart_scan, 0, count=count)
-                return
-            # Scanner busy, re-run timer for it to get idle before
-            # sending the message to start scan
-            self.adbase.run_in(self.run_depart_scan, 0, scan_delay=10, count=count)
-            return
-
-        # Perform Arrival Scan
-        if kwargs["scan_type"] == "Arrive":
-            self.mqtt.mqtt_publish(topic, payload)
-            return
 
         # System Command, Send the raw payload
         if kwargs["scan_type"] == "System":
@@ -793,33 +1956,87 @@ class HomePresenceApp(ad.ADBase):
             return
 
     def update_hass_sensor(self, sensor, new_state=None, new_attr=None):
-        """Update the hass sensor if it has changed."""
-        if not self.hass.entity_exists(sensor):
-            self.adbase.log(
-                f"Entity {sensor} does not exist, running arrival scan.", level="ERROR"
-            )
-            self.adbase.run_in(self.run_arrive_scan, 0)
-            return
+        """Update the hass sensor if it has changed.
 
-        sensor_state = self.hass.get_state(sensor, attribute="all")
-        state = sensor_state.get("state")
-        attributes = sensor_state.get("attributes", {})
-        if new_state is None:
-            update_needed = False
-            new_state = state
-        else:
-            update_needed = state != new_state
+        State changes are written immediately, attribute-only changes are
+        held in the sensor cache and written by the next flush.
+        """
+        if sensor not in self.sensor_cache:
+            if not self.hass.entity_exists(sensor):
+                self.adbase.log(
+                    f"Entity {sensor} does not exist, running arrival scan.",
+                    level="ERROR",
+                )
+                self.request_scan(SCAN_ARRIVE)
+                return
 
-        if isinstance(new_attr, dict):
-            attributes.update(new_attr)
-            update_needed = True
+            sensor_state = self.hass.get_state(sensor, attribute="all")
+            self.sensor_cache.load(
+                sensor, sensor_state.get("state"), sensor_state.get("attributes")
+            )
 
-        if update_needed:
-            self.adbase.log(
-                f"__function__: Entity_ID: {sensor}, new_state: {new_state}",
-                level="DEBUG",
+        if self.sensor_cache.update(sensor, new_state, new_attr):
+            self.write_hass_sensor(sensor)
+
+        elif sensor in self.sensor_cache.dirty and self.sensor_flush_timer is None:
+            self.sensor_flush_timer = self.adbase.run_in(
+                self.flush_hass_sensors, self.sensor_flush_interval
             )
-            self.hass.set_state(sensor, state=new_state, attributes=attributes)
+
+    def cached_sensor_state(self, sensor):
+        """Return the state of a sensor the app owns, reading HASS only once."""
+        cached = self.sensor_cache.sensors.get(sensor)
+        if cached is not None:
+            return cached["state"]
+        return self.hass.get_state(sensor, copy=False)
+
+    def set_hass_state(self, entity_id, **kwargs):
+        """Write a state to HASS, every HASS write of the app goes through here."""
+        self.processing.hass_writes += 1
+        self.hass.set_state(entity_id, **kwargs)
+
+    def remove_hass_entity(self, entity_id):
+        self.processing.hass_writes += 1
+        self.hass.remove_entity(entity_id)
+
+    def publish_processing_stats(self, kwargs):
+        """Publish the message processing measurements."""
+        attributes = self.processing.attributes()
+        attributes["friendly_name"] = "Presence Message Processing"
+        self.mqtt.set_state(
+            self.processing_entity,
+            state=attributes["messages_per_second"],
+            attributes=attributes,
+        )
+
+    def write_hass_sensor(self, sensor):
+        """Write the cached state of a sensor to HASS."""
+        state, attributes = self.sensor_cache.take(sensor)
+        self.adbase.log(
+            f"__function__: Entity_ID: {sensor}, new_state: {state}", level="DEBUG",
+        )
+        self.set_hass_state(sensor, state=state, attributes=attributes)
+
+    def flush_hass_sensors(self, kwargs):
+        """Write every sensor with pending attribute changes to HASS."""
+        self.sensor_flush_timer = None
+        for sensor in list(self.sensor_cache.dirty):
+            self.write_hass_sensor(sensor)
+
+        cache = self.sensor_cache
+        flush_rate = round(cache.avoided / cache.updates * 100, 1) if cache.updates else 0
+        self.mqtt.set_state(
+            self.sensor_cache_entity,
+            state=cache.writes,
+            attributes={
+                "updates": cache.updates,
+                "writes": cache.writes,
+                "avoided_writes": cache.avoided,
+                "avoided_percent": flush_rate,
+                "cached_sensors": len(cache.sensors),
+                "friendly_name": "HASS Sensor Writes",
+            },
+        )
 
     def gateway_opened(self, entity, attribute, old, new, kwargs):
         """Respond to a gateway device opening or closing."""
@@ -831,21 +2048,17 @@ class HomePresenceApp(ad.ADBase):
         if new not in (true_states + false_states):
             return
 
-        if self.gateway_timer is not None:
-            # Cancel Existing Timer
-            self.adbase.cancel_timer(self.gateway_timer)
-            self.gateway_timer = None
-
-        if self.hass.get_state(self.everyone_not_home, copy=False) == "on":
+        _, everyone_home, everyone_not_home = self.occupancy.sensors()
+        if everyone_not_home == "on":
             # No one at home
-            self.adbase.run_in(self.run_arrive_scan, 0)
+            self.request_scan(SCAN_ARRIVE)
 
-        elif self.hass.get_state(self.everyone_home, copy=False) == "on":
+        elif everyone_home == "on":
             # everyone at home
-            self.adbase.run_in(self.run_depart_scan, 0)
+            self.run_depart_scan({})
         else:
-            self.adbase.run_in(self.run_arrive_scan, 0)
-            self.adbase.run_in(self.run_depart_scan, 0)
+            self.request_scan(SCAN_ARRIVE)
+            self.run_depart_scan({})
 
     def motion_detected(self, entity, attribute, old, new, kwargs):
         """Respond to motion detected somewhere in the house.
@@ -864,31 +2077,29 @@ class HomePresenceApp(ad.ADBase):
             self.run_rssi_scan, self.args.get("rssi_timeout", 60)
         )
 
-    def check_home_state(self, kwargs):
-        """Check if a user is home based on multiple locations."""
-        check_state = kwargs["check_state"]
-        user_res = list(
-            map(lambda x: self.hass.get_state(x, copy=False), self.all_users_sensors)
-        )
-        user_res = [i for i in user_res if i is not None and i != "unknown"]
-        somebody_home = "on"
+    def set_occupancy(self, device_state_sensor, state):
+        """Record a device's home state and update the household sensors."""
+        if state == self.state_true:
+            self.occupancy.set(device_state_sensor, OccupancyModel.HOME)
+        elif state == self.state_false:
+            self.occupancy.set(device_state_sensor, OccupancyModel.AWAY)
+        else:
+            self.occupancy.set(device_state_sensor, OccupancyModel.UNKNOWN)
+        self.update_occupancy_sensors()
 
-        if check_state == "is_home" and all(
-            list(map(lambda x: x in ["on", "home"], user_res))
-        ):
-            # Someone is home, check if everyone is home.
-            self.update_hass_sensor(self.everyone_home, "on")
-        elif check_state == "not_home" and all(
-            list(map(lambda x: x in ["off", "not_home"], user_res))
-        ):
-            # Someone is not home, see if anyone is still home.
-            self.update_hass_sensor(self.everyone_not_home, "on")
-            somebody_home = "off"
+    def update_occupancy_sensors(self):
+        """Write the household sensors that changed since the last update."""
+        occupancy_sensors = self.occupancy.sensors() + (self.occupancy.home,)
+        if occupancy_sensors == self.occupancy_sensors:
+            return
 
-        count = self.count_persons_in_home()
-        new_attr = {"count": count}
-        self.update_hass_sensor(self.somebody_is_home, somebody_home, new_attr=new_attr)
-        self.check_home_timer = None
+        somebody_home, everyone_home, everyone_not_home, count = occupancy_sensors
+        self.update_hass_sensor(
+            self.somebody_is_home, somebody_home, new_attr={"count": count}
+        )
+        self.update_hass_sensor(self.everyone_home, everyone_home)
+        self.update_hass_sensor(self.everyone_not_home, everyone_not_home)
+        self.occupancy_sensors = occupancy_sensors
 
     def reload_device_state(self, kwargs):
         """Get the latest states from the scanners."""
@@ -897,94 +2108,210 @@ class HomePresenceApp(ad.ADBase):
             self.send_mqtt_message, 0, topic=topic, payload="", scan_type="System"
         )
 
-    def monitor_changed_state(self, entity, attribute, old, new, kwargs):
-        """Respond to a monitor location changing state."""
-        scan = kwargs["scan"]
-        topic = kwargs["topic"]
-        payload = kwargs["payload"]
-        self.adbase.run_in(
-            self.send_mqtt_message, 1, topic=topic, payload=payload, scan_type="Arrive"
-        )  # Send to scan for arrival of anyone
-        self.adbase.cancel_listen_state(self.monitor_handlers[scan])
-        self.monitor_handlers[scan] = None
-
     def forward_monitor_state(self, entity, attribute, old, new, kwargs):
         """Respond to any changes in the monitor system or each node"""
-        new_state = copy.deepcopy(new)
-        data = new_state["attributes"]
+        # Keep the latest state only, changes within the window are coalesced
+        self.forward_pending[entity] = new
+        if self.forward_timer is None:
+            self.forward_timer = self.adbase.run_in(
+                self.flush_monitor_state, self.forward_window
+            )
+
+    def flush_monitor_state(self, kwargs):
+        """Publish the monitor and node states that changed since last time."""
+        self.forward_timer = None
+        pending, self.forward_pending = self.forward_pending, dict()
+
+        for new_state in pending.values():
+            # clean the data, without touching the state AD handed us
+            data = {
+                key: value
+                for key, value in new_state["attributes"].items()
+                if key != "friendly_name"
+            }
+            data["state"] = new_state["state"]
+
+            if "location" not in data:  # it belongs to the overall monitor system
+                topic = f"{self.presence_topic}/state"
 
-        # clean the data
-        data.pop("friendly_name")
-        last_changed = new_state["last_changed"]
-        state = new_state["state"]
-        data.update({"last_changed": last_changed, "state": state})
+            else:  # it belongs to a node
+                location = data["location"].lower().replace(" ", "_")
+                topic = f"{self.presence_topic}/{location}/state"
 
-        if "location" not in data:  # it belongs to the overall monitor system
-            topic = f"{self.presence_topic}/state"
+            # last_changed alone moving is not a change worth forwarding
+            fingerprint = hash(json.dumps(data, sort_keys=True, default=str))
+            if self.forward_fingerprints.get(topic) == fingerprint:
+                continue
+            self.forward_fingerprints[topic] = fingerprint
 
-        else:  # it belongs to a node
-            location = data["location"].lower().replace(" ", "_")
-            topic = f"{self.presence_topic}/{location}/state"
+            data["last_changed"] = new_state["last_changed"]
+            self.mqtt.mqtt_publish(topic, json.dumps(data, default=str))
 
-        self.mqtt.mqtt_publish(topic, json.dumps(data))
+            if self.forward_delta:
+                published = self.forward_published.get(topic, {})
+                delta = {
+                    key: value
+                    for key, value in data.items()
+                    if key not in published or published[key] != value
+                }
+                delta.update({key: None for key in published if key not in data})
+                self.mqtt.mqtt_publish(f"{topic}/delta", json.dumps(delta, default=str))
+            self.forward_published[topic] = data
 
     def run_arrive_scan(self, kwargs):
         """Request an arrival scan.
 
-        Will wait for the scanner to be free and then sends the message.
+        The scan is sent once the scanner is free.
         """
-        topic = f"{self.presence_topic}/scan/arrive"
-        payload = ""
-        if self.mqtt.get_state(self.monitor_entity, copy=False) == "idle":
-            self.mqtt.mqtt_publish(topic, payload)
-            return
-
-        # Scanner busy. Wait for it to finish:
-        scan_type = self.mqtt.get_state(
-            self.monitor_entity, attribute="scan_type", copy=False
-        )
-        if self.monitor_handlers.get("Arrive Scan") is None and scan_type != "arrival":
-            self.monitor_handlers["Arrive Scan"] = self.mqtt.listen_state(
-                self.monitor_changed_state,
-                self.monitor_entity,
-                new="idle",
-                old="scanning",
-                scan="Arrive Scan",
-                topic=topic,
-                payload=payload,
-            )
+        self.request_scan(SCAN_ARRIVE, delay=kwargs.get("scan_delay", 0))
 
     def run_depart_scan(self, kwargs):
         """Request a departure scan.
 
-        Will wait for the scanner to be free and then sends the message.
+        The scan is sent after depart_check_time and once the scanner is free,
+        then repeated depart_scans times to confirm the departure.
         """
-        delay = kwargs.get("scan_delay", self.depart_check_time)
         count = kwargs.get("count", 1)
-
-        topic = f"{self.presence_topic}/scan/depart"
-        payload = ""
-
-        # Cancel any timers
-        if self.gateway_timer is not None:
-            self.adbase.cancel_timer(self.gateway_timer)
-
-        # Scan for departure of anyone
-        self.gateway_timer = self.adbase.run_in(
-            self.send_mqtt_message,
-            delay,
-            topic=topic,
-            payload=payload,
-            scan_type="Depart",
-            count=count,
+        self.request_scan(
+            SCAN_DEPART,
+            delay=kwargs.get("scan_delay", self.depart_check_time),
+            repeats=max(self.args.get("depart_scans", 3) + 1 - count, 0),
         )
 
     def run_rssi_scan(self, kwargs):
-        """Send a RSSI Scan Request."""
-        topic = f"{self.presence_topic}/scan/rssi"
-        payload = ""
-        self.mqtt.mqtt_publish(topic, payload)
+        """Request a RSSI Scan."""
         self.motion_timer = None
+        self.request_scan(SCAN_RSSI, delay=kwargs.get("scan_delay", 0))
+
+    def request_scan(self, scan_type, delay=0, repeats=0):
+        """Queue a scan, merging it with a matching scan already waiting."""
+        self.scan_queue.add(scan_type, delay, repeats)
+        self.schedule_scans()
+        self.update_scan_queue_entity()
+
+    def schedule_scans(self, delay=None):
+        """Make sure the dispatch timer fires when the next scan is due."""
+        if delay is None:
+            next_due = self.scan_queue.next_due()
+            if next_due is None:
+                return
+            delay = max(next_due - time.monotonic(), 0)
+
+        due = time.monotonic() + delay
+        if self.scan_timer is not None:
+            if self.scan_timer_due <= due:
+                return
+            self.adbase.cancel_timer(self.scan_timer)
+
+        self.scan_timer_due = due
+        self.scan_timer = self.adbase.run_in(self.dispatch_scans, delay)
+
+    def scanner_idle(self, entity, attribute, old, new, kwargs):
+        """The scanner finished, send the next waiting scan."""
+        if self.scan_queue:
+            self.schedule_scans(SCAN_SETTLE_TIME)
+
+    def dispatch_scans(self, kwargs):
+        """Send the most urgent due scan if the scanner is free."""
+        self.scan_timer = None
+        self.scan_timer_due = None
+
+        if self.scan_waiting:
+            # scan_started dispatches again once the last scan reported in
+            return
+
+        if self.mqtt.get_state(self.monitor_entity, copy=False) != "idle":
+            running = self.mqtt.get_state(
+                self.monitor_entity, attribute="scan_type", copy=False
+            )
+            for scan_type, running_types in SCAN_RUNNING_TYPES.items():
+                if running in running_types and scan_type != SCAN_DEPART:
+                    # the running scan answers the waiting request already
+                    self.scan_queue.discard(scan_type)
+
+            # Scanner busy, scanner_idle picks the queue up again
+            if self.scan_queue:
+                self.schedule_scans(SCAN_BUSY_RETRY)
+            self.update_scan_queue_entity()
+            return
+
+        request = self.scan_queue.pop()
+        if request is not None:
+            topic = f"{self.presence_topic}/scan/{request.scan_type}"
+            if request.repeats > 0:
+                self.scan_queue.add(
+                    request.scan_type, self.depart_check_time, request.repeats - 1,
+                )
+
+            if hasattr(self.mqtt, "mqtt_request"):
+                # Wait for a node to report the scan started instead of a fixed delay
+                self.scan_waiting = True
+                self.AD.executor.submit(self.scan_request, topic)
+                self.update_scan_queue_entity()
+                return
+
+            self.mqtt.mqtt_publish(topic, "")
+
+        if self.scan_queue:
+            # Give the scanner time to report busy before sending the next one
+            next_due = self.scan_queue.next_due() - time.monotonic()
+            self.schedule_scans(max(next_due, SCAN_SETTLE_TIME))
+        self.update_scan_queue_entity()
+
+    def scan_request(self, topic):
+        """Runs on the executor, mqtt_request blocks until a node starts scanning."""
+        started = time.monotonic()
+        try:
+            reply = self.mqtt.mqtt_request(
+                topic,
+                "",
+                response_topic=f"{self.presence_topic}/+/+/start",
+                timeout=SCAN_START_TIMEOUT,
+            )
+        except REQUEST_TIMEOUT_ERRORS:
+            reply = None
+
+        latency = time.monotonic() - started if reply is not None else None
+        self.adbase.run_in(self.scan_started, 0, topic=topic, latency=latency)
+
+    def scan_started(self, kwargs):
+        """A node reported the scan started, or none did in time."""
+        self.scan_waiting = False
+        if kwargs["latency"] is None:
+            self.adbase.log(
+                f"No monitor started scanning for {kwargs['topic']}"
+                f" within {SCAN_START_TIMEOUT} seconds",
+                level="DEBUG",
+            )
+        else:
+            self.scan_start_latency = kwargs["latency"]
+
+        if self.scan_queue:
+            # Busy scanners are picked up again by scanner_idle
+            self.schedule_scans(SCAN_SETTLE_TIME)
+        self.update_scan_queue_entity()
+
+    def update_scan_queue_entity(self):
+        """Publish the queue depth and scan latency."""
+        queue = self.scan_queue
+        mean_latency = queue.latency_total / queue.dispatched if queue.dispatched else 0
+        self.mqtt.set_state(
+            self.scan_queue_entity,
+            state=len(queue),
+            attributes={
+                "pending": sorted(queue.pending),
+                "requested": queue.requested,
+                "coalesced": queue.coalesced,
+                "dispatched": queue.dispatched,
+                "last_latency": round(queue.latency_last, 3),
+                "mean_latency": round(mean_latency, 3),
+                "max_latency": round(queue.latency_max, 3),
+                "start_latency": round(self.scan_start_latency, 3)
+                if self.scan_start_latency is not None
+                else None,
+                "friendly_name": "Monitor Scan Queue",
+            },
+        )
 
     def restart_device(self, kwargs):
         """Send a restart command to the monitor services."""
@@ -1040,21 +2367,7 @@ class HomePresenceApp(ad.ADBase):
                     self.mqtt.set_state(entity_id, reboot_scheduled="off")
 
                 try:
-                    # use executor here, as sometimes due to being unable to process it
-                    # as the node might be busy, could lead to AD hanging
-
-                    node_task = self.node_executing.get(node)
-                    if node_task is None or node_task.done() or node_task.cancelled():
-                        # meaning its either not running, or had completed or cancelled
-                        self.node_executing[node] = self.AD.executor.submit(
-                            self.restart_hardware, node
-                        )
-
-                    else:
-                        self.adbase.log(
-                            f"{location}'s node busy executing a command. So cannot execute this now",
-                            level="WARNING",
-                        )
+                    self.submit_node_task(node, self.restart_hardware, node)
 
                 except Exception as e:
                     self.adbase.error(
@@ -1086,7 +2399,7 @@ class HomePresenceApp(ad.ADBase):
         else:
             nodes = [node]
 
-        # now execute the command
+        # now execute the command on every node at once
         for node in nodes:
             if node not in self.args["remote_monitors"]:
                 self.adbase.log(
@@ -1095,18 +2408,34 @@ class HomePresenceApp(ad.ADBase):
 
                 continue
 
-            node_task = self.node_executing.get(node)
-            if node_task is None or node_task.done() or node_task.cancelled():
-                # meaning its either not running, or had completed or cancelled
-                self.node_executing[node] = self.AD.executor.submit(
-                    self.execute_command, node, cmd
-                )
+            self.submit_node_task(node, self.execute_command, node, cmd)
 
-            else:
-                self.adbase.log(
-                    f"{location}'s node busy executing a command. So cannot execute this now",
-                    level="WARNING",
-                )
+    def submit_node_task(self, node, func, *args):
+        """Run a node command on the executor unless the node is still busy.
+
+        The executor is used as an unresponsive node could otherwise hang AD.
+        Nodes run concurrently, each publishes its result once it completes.
+        """
+        node_task = self.node_executing.get(node)
+        if node_task is not None and not node_task.done():
+            self.adbase.log(
+                f"{node}'s node busy executing a command. So cannot execute this now",
+                level="WARNING",
+            )
+            return
+
+        node_task = self.node_executing[node] = self.AD.executor.submit(func, *args)
+        node_task.add_done_callback(lambda task: self.node_task_done(node, task))
+
+    def node_task_done(self, node, task):
+        """Clear the node's task, logging it if it failed."""
+        if self.node_executing.get(node) is task:
+            self.node_executing[node] = None
+
+        if not task.cancelled() and task.exception() is not None:
+            self.adbase.error(
+                f"Command on {node} failed: {task.exception()!r}", level="ERROR"
+            )
 
     def restart_hardware(self, node):
         """Used to Restart the Hardware Monitor running in"""
@@ -1120,7 +2449,8 @@ class HomePresenceApp(ad.ADBase):
 
         location = node.replace("_", " ").title()
         try:
-            result = self.execute_command(node, reboot_command)
+            # The node drops the connection while rebooting, so don't keep it
+            result = self.execute_command(node, reboot_command, reuse=False)
             self.adbase.log(
                 f"{node}'s Hardware reset completed with result {result}",
                 level="DEBUG",
@@ -1138,11 +2468,14 @@ class HomePresenceApp(ad.ADBase):
                 f"Could not restart {location} Monitor Hardware", level="ERROR",
             )
 
-    def execute_command(self, node, cmd):
-        """Used to Run command on a Monitor Node"""
+    def execute_command(self, node, cmd, reuse=True):
+        """Used to Run command on a Monitor Node.
+
+        Output lines are published to ``<monitor_topic>/<node>/command/output``
+        as they arrive and a summary to ``<monitor_topic>/<node>/command/result``.
+        """
 
         self.adbase.log(f"Running {cmd} on {node}'s Hardware")
-        import paramiko
 
         # get the node's credentials
 
@@ -1150,28 +2483,82 @@ class HomePresenceApp(ad.ADBase):
             raise ValueError(f"Given Node {node}, has no specified credentials")
 
         setting = self.args["remote_monitors"][node]
-        host = setting["host"]
-        username = setting["username"]
-        password = setting["password"]
-
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh.connect(
-            host,
-            username=username,
-            password=password,
-            timeout=float(self.system_timeout),
+        timeout = float(setting.get("command_timeout", self.system_timeout))
+        topic = f"{self.presence_topic}/{node}/command"
+
+        started = time.monotonic()
+        exit_status, completed = self.ssh_pool.run(
+            node,
+            setting,
+            cmd,
+            timeout,
+            on_line=lambda line: self.mqtt.mqtt_publish(f"{topic}/output", line),
+            reuse=reuse,
         )
-        stdin, stdout, stderr = ssh.exec_command(cmd)
-        completed = stdout.readlines()
-        ssh.close()
 
         self.adbase.log(completed, level="DEBUG")
-
-        # reset node task if completed
-        self.node_executing[node] = None
+        self.mqtt.mqtt_publish(
+            f"{topic}/result",
+            json.dumps(
+                {
+                    "command": cmd,
+                    "exit_status": exit_status,
+                    "output": completed,
+                    "duration": round(time.monotonic() - started, 3),
+                }
+            ),
+        )
         return completed
 
+    def load_history(self):
+        """Restore the history persisted by a previous run, if any."""
+        if not self.history_file or not os.path.exists(self.history_file):
+            return
+
+        try:
+            with open(self.history_file, "rb") as history_file:
+                self.history.loads(history_file.read())
+        except (OSError, ValueError) as error:
+            self.adbase.log(f"Could not load history: {error}", level="WARNING")
+
+    def save_history(self, kwargs):
+        """Write the history to disk, replacing the previous file atomically."""
+        if not self.history_file:
+            return
+
+        temporary = f"{self.history_file}.tmp"
+        try:
+            with open(temporary, "wb") as history_file:
+                history_file.write(self.history.dumps())
+            os.replace(temporary, self.history_file)
+        except OSError as error:
+            self.adbase.log(f"Could not save history: {error}", level="WARNING")
+
+    def query_history(self, kwargs):
+        """Summarize a device's confidence and RSSI over the last minutes."""
+        device = kwargs["device"].strip().replace(" ", "_").lower()
+        device_entity_id = f"{self.presence_name}_{device}"
+        minutes = float(kwargs.get("minutes", 10))
+        result = {
+            "device": device,
+            "minutes": minutes,
+            "locations": self.history.query(
+                device_entity_id, kwargs.get("location"), minutes
+            ),
+        }
+        self.mqtt.set_state(
+            f"{self.presence_name}.history_query",
+            state=device,
+            attributes=dict(result, friendly_name="Presence History Query"),
+        )
+        return result
+
+    def evict_ssh_connections(self, kwargs):
+        """Close SSH connections left idle for longer than ssh_idle_timeout."""
+        evicted = self.ssh_pool.evict()
+        if evicted:
+            self.adbase.log(f"Closed {evicted} idle SSH connections", level="DEBUG")
+
     def clear_location_entities(self, kwargs):
         """Clear sensors from an offline location.
 
@@ -1188,13 +2575,14 @@ class HomePresenceApp(ad.ADBase):
         for _, entity_list in self.home_state_entities.items():
             for sensor in entity_list:
                 if location in sensor:  # that sensor belongs to that location
-                    self.update_hass_sensor(sensor, 0)
+                    # set rssi to "unknown" since it had been cleared
+                    self.update_hass_sensor(sensor, 0, new_attr={"rssi": "unknown"})
                     appdaemon_conf_sensor = self.hass_conf_sensor_to_appdaemon_conf(
                         sensor
                     )
-                    # set to "unknown" since it had been cleared
                     self.mqtt.set_state(appdaemon_conf_sensor, state=0, rssi="unknown")
-                    self.update_hass_sensor(sensor, new_attr={"rssi": "unknown"})
+
+        self.rssi_matrix.clear_location(location)
 
         if location in self.location_timers:
             self.location_timers.pop(location)
@@ -1308,17 +2696,13 @@ class HomePresenceApp(ad.ADBase):
     def monitor_scan_now(self, entity, attribute, old, new, kwargs):
         """Request an immediate scan from the monitors."""
         scan_type = self.mqtt.get_state(entity, attribute="scan_type", copy=False)
-        locations = self.mqtt.get_state(entity, attribute="locations", copy=False)
-
-        if scan_type == "both":
-            self.adbase.run_in(self.run_arrive_scan, 0, location=locations)
-            self.adbase.run_in(self.run_depart_scan, 0, location=locations)
 
-        elif scan_type == "arrival":
-            self.adbase.run_in(self.run_arrive_scan, 0, location=locations)
+        # the monitors scan at every location, whatever locations were asked for
+        if scan_type in ("both", "arrival"):
+            self.run_arrive_scan({})
 
-        elif scan_type == "depart":
-            self.adbase.run_in(self.run_depart_scan, 0, location=locations)
+        if scan_type in ("both", "depart"):
+            self.run_depart_scan({})
 
         self.mqtt.set_state(entity, state="idle")
 
@@ -1326,6 +2710,17 @@ class HomePresenceApp(ad.ADBase):
         """Request all known devices in config to be added to monitors."""
         timer = 0
         if self.args.get("known_devices") is not None:
+            if hasattr(self.mqtt, "mqtt_publish_many"):
+                # the plugin paces the publishes itself, one device per second
+                self.mqtt.mqtt_publish_many(
+                    [
+                        (f"{self.presence_topic}/setup/ADD STATIC DEVICE", device)
+                        for device in self.args["known_devices"]
+                    ],
+                    rate=1,
+                )
+                return
+
             for device in self.args["known_devices"]:
                 self.adbase.run_in(
                     self.send_mqtt_message,
@@ -1336,133 +2731,312 @@ class HomePresenceApp(ad.ADBase):
                 )
                 timer += 1
 
-    def remove_known_device(self, kwargs):
-        """Request all known devices in config to be deleted from monitors."""
+    def build_device_index(self):
+        """Index the device entities left by earlier runs, once."""
+        if self.device_index.built:
+            return
 
-        device = kwargs["device"]
+        entities = self.mqtt.get_state(self.presence_name, copy=False, default={})
+        for entity, state in (entities or {}).items():
+            attributes = state.get("attributes", {})
+            device_id = attributes.get("id")
+            location = attributes.get("location")
+            if device_id is None or location is None:
+                continue
 
-        self.adbase.log(f"Removing device {device}", level="INFO")
+            node = location.replace(" ", "_").lower()
+            _, domain_device = self.mqtt.split_entity(entity)
+            self.device_index.add(
+                device_id,
+                domain_device.replace(f"_{node}", ""),
+                name=attributes.get("name", ""),
+                ad_entity=entity,
+            )
 
-        self.adbase.run_in(
-            self.send_mqtt_message,
-            0,
-            topic=f"{self.presence_topic}/setup/DELETE STATIC DEVICE",
-            payload=device,
-            scan_type="System",
-        )
+        entities = self.hass.get_state("sensor", copy=False, default={})
+        prefix = f"sensor.{self.presence_name}_"
+        for entity, state in (entities or {}).items():
+            device_id = state.get("attributes", {}).get("id")
+            if device_id is not None and entity.startswith(prefix):
+                self.device_index.add(
+                    device_id,
+                    self.conf_sensor_device_name(entity, state),
+                    hass_entity=entity,
+                )
 
-        # now remove the device from AD
-        entities = list(
-            self.mqtt.get_state(f"{self.presence_name}", copy=False, default={}).keys()
+        self.device_index.built = True
+
+    def conf_sensor_device_name(self, sensor, state):
+        """Recover the device name from a confidence sensor of an earlier run."""
+        location = state.get("attributes", {}).get("location", "")
+        node = location.replace(" ", "_").lower()
+        return sensor.replace(f"sensor.{self.presence_name}_", "").replace(
+            f"_{node}_conf", ""
         )
-        device_name = None
-        for entity in entities:
-            if device == self.mqtt.get_state(entity, attribute="id", copy=False):
-                location = self.mqtt.get_state(entity, attribute="location")
-                if location is None:
-                    continue
 
-                node = location.replace(" ", "_").lower()
+    def remove_known_device(self, kwargs):
+        """Request a known device to be deleted from monitors."""
+        self.remove_known_devices([kwargs["device"]])
+
+    def remove_known_devices(self, devices):
+        """Delete devices from the monitors, AD and HA in one pass."""
+        self.build_device_index()
+
+        messages = []
+        for device in devices:
+            self.adbase.log(f"Removing device {device}", level="INFO")
+            messages.append((f"{self.presence_topic}/setup/DELETE STATIC DEVICE", device))
+
+        if hasattr(self.mqtt, "mqtt_publish_many"):
+            # paced like the known device setup, the monitors handle one at a time
+            self.mqtt.mqtt_publish_many(messages, rate=1)
+        else:
+            for topic, payload in messages:
+                self.mqtt.mqtt_publish(topic, payload)
+
+        for device in devices:
+            device_names, ad_entities, hass_entities = self.device_index.pop(device)
+
+            # now remove the device from AD
+            for entity in ad_entities:
                 self.mqtt.remove_entity(entity)
-                if device_name is None:
-                    _, domain_device = self.mqtt.split_entity(entity)
-                    device_name = domain_device.replace(f"_{node}", "")
-
-        # now remove the device from HA
-        entities = list(self.hass.get_state("sensor", copy=False, default={}).keys())
-        for entity in entities:
-            if device == self.hass.get_state(entity, attribute="id", copy=False):
+
+            # now remove the device from HA
+            for entity in hass_entities:
                 # first cancel the handler if it exists
-                handler = self.confidence_handlers.get(entity)
+                handler = self.confidence_handlers.pop(entity, None)
                 if handler is not None:
                     self.hass.cancel_listen_state(handler)
 
-                self.hass.remove_entity(entity)
+                self.remove_hass_entity(entity)
+                self.sensor_cache.discard(entity)
+                self.conf_sensor_locations.pop(entity, None)
+
+            for device_name in device_names:
+                self.remove_device_state(device_name)
 
-        if device_name is not None:
-            device_entity_id = f"{self.presence_name}_{device_name}"
-            device_state_sensor = f"{self.user_device_domain}.{device_entity_id}"
+        self.update_occupancy_sensors()
 
-            if device_entity_id in self.home_state_entities:
-                del self.home_state_entities[device_entity_id]
+    def remove_device_state(self, device_name):
+        """Remove the home state sensor of a device and everything tracking it."""
+        device_entity_id = f"{self.presence_name}_{device_name}"
+        device_state_sensor = f"{self.user_device_domain}.{device_entity_id}"
+
+        if device_entity_id in self.home_state_entities:
+            del self.home_state_entities[device_entity_id]
+
+        self.rssi_matrix.remove(device_entity_id)
+        self.history.remove(device_entity_id)
+        self.device_confidence.pop(device_entity_id, None)
+        self.departure_gaps.pop(device_entity_id, None)
+        self.nearest_monitors.pop(device_entity_id, None)
 
-            if device_state_sensor in self.all_users_sensors:
-                self.all_users_sensors.remove(device_state_sensor)
+        if device_state_sensor in self.all_users_sensors:
+            self.all_users_sensors.remove(device_state_sensor)
 
-            # now remove for HA
-            self.hass.remove_entity(device_state_sensor)
+        self.occupancy.discard(device_state_sensor)
 
-            # now remove for AD
-            self.mqtt.remove_entity(device_state_sensor)
+        # now remove for HA
+        self.remove_hass_entity(device_state_sensor)
+        self.sensor_cache.discard(device_state_sensor)
+
+        # now remove for AD
+        self.mqtt.remove_entity(device_state_sensor)
 
     def clean_devices(self, kwargs):
         """Used to check for old devices, and remove them accordingly"""
 
         # search for them first
-        delay = 0
-        removed = []
-        known_device_names = [n.lower() for n in list(self.known_devices.values())]
+        known_device_names = {n.lower() for n in self.known_devices.values()}
+
+        self.build_device_index()
+        removed = [
+            mac_id
+            for mac_id in self.device_index
+            if mac_id not in self.known_devices
+            or (
+                mac_id in self.device_index.names
+                and self.device_index.names[mac_id] not in known_device_names
+            )
+        ]
 
-        for sensor in self.mqtt.get_state(self.presence_topic, copy=False, default={}):
-            mac_id = self.mqtt.get_state(sensor, attribute="id", copy=False)
-            if mac_id is None:
-                continue
+        if removed != []:
+            self.adbase.log("Cleaning out old Known Devices")
+            self.remove_known_devices(removed)
 
-            sensor_name = self.mqtt.get_state(
-                sensor, attribute="name", copy=False, default=""
-            ).lower()
-            if mac_id not in removed and (
-                mac_id not in self.known_devices
-                or sensor_name not in known_device_names
-            ):
-                # it should be removed
+            # re-load the scripts to clean properly, the nodes provision the
+            # known devices again when they report back online
+            self.adbase.run_in(self.restart_device, 5)
+            return
 
-                if removed == []:  # means haven't removed one yet
-                    self.adbase.log("Cleaning out old Known Devices")
+        self.provision_known_devices({})
 
-                self.adbase.run_in(self.remove_known_device, delay, device=mac_id)
-                removed.append(mac_id)  # indicate it has been removed
-                delay += 3  # should process later
+    def provision_known_devices(self, kwargs):
+        """Push the known devices the nodes are missing, paced by their reports."""
+        if not self.known_device_entries:
+            return
 
-        if removed != []:
-            delay += 5
-            # means some where removed, so needs to re-load the scripts to clean properly
-            self.adbase.run_in(self.restart_device, delay)
+        if (
+            self.provisioning is not None
+            and self.provisioning.phase != KnownDeviceProvisioning.DONE
+        ):
+            # already running, a new node is picked up from its reports
+            return
 
-        # now load up the known devices before state
-        delay += 45
-        self.adbase.run_in(self.load_known_devices, delay)
+        online_nodes = self.mqtt.get_state(
+            self.monitor_entity, attribute="online_nodes", copy=False, default=[]
+        )
+        self.provisioning = KnownDeviceProvisioning(
+            self.known_device_entries,
+            [node.replace(" ", "_").lower() for node in online_nodes or []],
+            time.monotonic(),
+        )
+        self.adbase.log("Provisioning known devices on the nodes", level="DEBUG")
+        self.reload_device_state({})
+        self.schedule_provisioning(self.provision_settle)
 
-        if removed != []:
-            delay += 15 + len(known_device_names)
-            self.adbase.run_in(self.run_arrive_scan, delay)
-            self.adbase.run_in(self.load_known_devices, delay + 120)
-
-        delay += 60
-        self.adbase.run_in(self.reload_device_state, delay)
-
-        # for some strange reasons, forces the app to run load_known_devices twice
-        # to get updated data on the cleaned out devices
-
-    def count_persons_in_home(self):
-        """Used to count the number of persons in the Home"""
-
-        user_devices = list(self.home_state_entities.keys())
-        sensors = list(
-            map(
-                lambda x: self.mqtt.get_state(
-                    f"{self.user_device_domain}.{x}", copy=False
-                ),
-                user_devices,
-            )
+    def check_node_devices(self, location):
+        """Ask for the device states and check a reconnected node still knows them all."""
+        if not self.known_device_entries:
+            return
+
+        if location in self.node_device_timers:
+            self.adbase.cancel_timer(self.node_device_timers[location])
+
+        self.node_devices[location] = set()
+        self.reload_device_state({})
+        self.node_device_timers[location] = self.adbase.run_in(
+            self.node_devices_checked, self.provision_confirm_timeout, location=location
+        )
+
+    def node_devices_checked(self, kwargs):
+        location = kwargs["location"]
+        self.node_device_timers.pop(location, None)
+        missing = set(self.known_device_entries) - self.node_devices.pop(location, set())
+        if not missing:
+            return
+
+        self.adbase.log(
+            f"{location} is missing {len(missing)} known devices after reconnecting",
+            level="DEBUG",
         )
-        sensors = [i for i in sensors if i == self.state_true]
+        self.provisioned_nodes.discard(location)
+        self.provision_known_devices({})
+
+    def schedule_provisioning(self, delay):
+        if self.provisioning_timer is not None:
+            self.adbase.cancel_timer(self.provisioning_timer)
+        self.provisioning_timer = self.adbase.run_in(self.provisioning_timeout, delay)
+
+    def provisioning_report(self, location, device_id):
+        """A node reported a device while provisioning is running."""
+        provisioning = self.provisioning
+        if provisioning.phase == KnownDeviceProvisioning.DONE:
+            return
 
-        return len(sensors)
+        acked = provisioning.report(location, device_id, time.monotonic())
+        if provisioning.phase == KnownDeviceProvisioning.PUSHING and acked:
+            self.push_next_device()
+
+        elif (
+            provisioning.phase == KnownDeviceProvisioning.CONFIRMING
+            and provisioning.complete()
+        ):
+            self.finish_provisioning()
+
+    def provisioning_timeout(self, kwargs):
+        """Move provisioning on when the nodes went quiet or did not ack."""
+        self.provisioning_timer = None
+        provisioning = self.provisioning
+
+        if provisioning.phase == KnownDeviceProvisioning.COLLECTING:
+            quiet = time.monotonic() - provisioning.last_report
+            if quiet < self.provision_settle:
+                # reports are still coming in
+                self.schedule_provisioning(self.provision_settle - quiet)
+                return
+            self.push_missing_devices()
+
+        elif provisioning.phase == KnownDeviceProvisioning.PUSHING:
+            # no ack, the device may only show up with the next states report
+            self.push_next_device()
+
+        elif provisioning.phase == KnownDeviceProvisioning.CONFIRMING:
+            if provisioning.complete() or provisioning.rounds >= self.provision_rounds:
+                self.finish_provisioning()
+            else:
+                self.push_missing_devices()
+
+    def push_missing_devices(self):
+        if self.provisioning.complete():
+            self.finish_provisioning()
+            return
+
+        self.provisioning.start_round()
+        self.push_next_device()
+
+    def push_next_device(self):
+        """Send the next missing device, or confirm once all were sent."""
+        provisioning = self.provisioning
+        device = provisioning.next_device()
+        if device is None:
+            provisioning.phase = KnownDeviceProvisioning.CONFIRMING
+            self.reload_device_state({})
+            self.schedule_provisioning(self.provision_confirm_timeout)
+            return
+
+        self.mqtt.mqtt_publish(
+            f"{self.presence_topic}/setup/ADD STATIC DEVICE",
+            self.known_device_entries[device],
+        )
+        self.schedule_provisioning(self.provision_ack_timeout)
+
+    def finish_provisioning(self):
+        """Publish the outcome of the provisioning run."""
+        provisioning = self.provisioning
+        provisioning.phase = KnownDeviceProvisioning.DONE
+        if self.provisioning_timer is not None:
+            self.adbase.cancel_timer(self.provisioning_timer)
+            self.provisioning_timer = None
+
+        missing = {
+            node: sorted(devices)
+            for node, devices in provisioning.missing().items()
+            if devices
+        }
+        for node in provisioning.reported:
+            if node in missing:
+                self.provisioned_nodes.discard(node)
+            else:
+                self.provisioned_nodes.add(node)
+        duration = round(time.monotonic() - provisioning.started, 1)
+        self.adbase.log(
+            f"Known devices provisioned in {duration}s, {provisioning.pushed} pushed",
+            level="INFO" if not missing else "WARNING",
+        )
+        self.mqtt.set_state(
+            f"{self.presence_name}.known_devices",
+            state="complete" if not missing else "incomplete",
+            attributes={
+                "nodes": sorted(provisioning.reported),
+                "pushed": provisioning.pushed,
+                "rounds": provisioning.rounds,
+                "duration": duration,
+                "missing": missing,
+                "friendly_name": "Known Devices Provisioning",
+            },
+        )
+
+        # the device states are current now, look for anyone that arrived
+        self.request_scan(SCAN_ARRIVE)
 
     def hass_restarted(self, event_name, data, kwargs):
         """Respond to a HASS Restart."""
+        # HASS lost the sensors, they are read back or recreated on next update
+        self.sensor_cache.clear()
         self.setup_global_sensors()
+        self.occupancy_sensors = None
+        self.update_occupancy_sensors()
         # self.adbase.run_in(self.reload_device_state, 10)
         self.adbase.run_in(self.restart_device, 5)
 
@@ -1492,6 +3066,12 @@ class HomePresenceApp(ad.ADBase):
         self.mqtt.register_service(
             f"{self.presence_name}/load_known_devices", self.presense_services
         )
+        self.mqtt.register_service(
+            f"{self.presence_name}/provision_known_devices", self.presense_services
+        )
+        self.mqtt.register_service(
+            f"{self.presence_name}/query_history", self.presense_services
+        )
         self.mqtt.register_service(
             f"{self.presence_name}/clear_location_entities", self.presense_services
         )
@@ -1517,6 +3097,18 @@ class HomePresenceApp(ad.ADBase):
             )
             return
 
+        elif service == "query_history":
+            if "device" not in kwargs:
+                self.adbase.log(
+                    "Could not Query History as no Device provided", level="WARNING"
+                )
+                return
+
+            # answered straight away, so the caller gets the summary back
+            if "location" in kwargs:
+                kwargs["location"] = kwargs["location"].replace(" ", "_").lower()
+            return func(kwargs)
+
         elif service == "clear_location_entities" and "location" not in kwargs:
             self.adbase.log(
                 "Could not Clear Location Entities as no Location provided",
@@ -1534,6 +3126,12 @@ class HomePresenceApp(ad.ADBase):
         self.adbase.run_in(func, 0, **kwargs)
 
     def terminate(self):
+        self.scan_queue.clear()
+        self.save_history({})
+
+        for sensor in list(self.sensor_cache.dirty):
+            self.write_hass_sensor(sensor)
+
         for node in self.node_executing:
             if self.node_executing[node] is not None:
                 if (
@@ -1542,3 +3140,5 @@ class HomePresenceApp(ad.ADBase):
                 ):
                     # this means its still running, so cancel the task
                     self.node_executing[node].cancel()
+
+        self.ssh_pool.close()
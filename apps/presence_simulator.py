@@ -0,0 +1,252 @@
+"""AppDaemon App impersonating Monitor presence nodes to load test HomePresenceApp.
+
+Publishes what monitor.sh nodes publish (status, echo replies, scan start/end
+markers, JSON confidence reports and RSSI values) for a set of simulated
+devices, answers the scan and KNOWN DEVICE STATES requests of the presence
+app and plays a scripted arrive/depart scenario. Point both apps at the same
+MQTT broker, benchmarks/mqtt_broker.py is enough when no broker is at hand.
+
+apps.yaml parameters:
+| - monitor_topic (default 'monitor'): MQTT Topic the presence app listens to
+| - mqtt_event (default 'MQTT_MESSAGE'): MQTT event name as specified in the plugin setting
+| - user_device_domain (default 'binary_sensor'): Domain the presence app uses
+| - nodes (default 3): Number of simulated nodes, or a list of node names
+| - devices (default 5): Number of simulated devices, or a list of "MAC name"
+| - scan_time (default 2s): Time a simulated scan takes
+| - load_rate (default 0): Extra confidence reports per second to publish
+| - scenario: List of steps, each with 'at' (seconds from start), 'event'
+|   ('arrive' or 'depart'), 'device' (index or MAC) and optional 'nodes'
+|
+| Results are published on <presence_name>.simulator: the detection latency from
+| a scripted event to the device sensor flipping, measured here, and the message
+| rate, handler time, publish to handled latency and HASS writes per message,
+| measured by the presence app. Set its processing_stats interval for those.
+"""
+import json
+import adbase as ad
+from datetime import datetime, timedelta
+import random
+import time
+
+
+DEFAULT_SCENARIO = [
+    {"at": 5, "event": "arrive", "device": 0},
+    {"at": 10, "event": "arrive", "device": 1},
+    {"at": 40, "event": "depart", "device": 0},
+    {"at": 60, "event": "arrive", "device": 0},
+    {"at": 90, "event": "depart", "device": 1},
+]
+
+
+# pylint: disable=attribute-defined-outside-init,unused-argument
+class PresenceSimulator(ad.ADBase):
+    """Simulated Monitor Nodes."""
+
+    def initialize(self):
+        """Initialize AppDaemon App."""
+        self.adbase = self.get_ad_api()
+        self.mqtt = self.get_plugin_api("MQTT")
+
+        self.presence_topic = self.args.get("monitor_topic", "monitor")
+        self.presence_name = self.presence_topic.split("/")[-1]
+        self.user_device_domain = self.args.get("user_device_domain", "binary_sensor")
+        self.state_true = "on" if self.user_device_domain == "binary_sensor" else "home"
+        self.scan_time = self.args.get("scan_time", 2)
+
+        nodes = self.args.get("nodes", 3)
+        if isinstance(nodes, int):
+            nodes = [f"node_{index}" for index in range(nodes)]
+        self.nodes = [node.replace(" ", "_").lower() for node in nodes]
+
+        devices = self.args.get("devices", 5)
+        if isinstance(devices, int):
+            devices = [
+                "00:11:22:33:{:02X}:{:02X} sim_{}".format(index // 256, index % 256, index)
+                for index in range(devices)
+            ]
+        self.devices = {}
+        for device in devices:
+            mac_id, name = device.split(" ", 1)
+            self.devices[mac_id] = name.lower()
+        self.device_ids = list(self.devices)
+
+        # Which nodes currently see each device
+        self.present = {mac_id: set() for mac_id in self.devices}
+        self.scanning = {}
+
+        # Measurements
+        self.started = time.monotonic()
+        self.published = 0
+        self.events = {}
+        self.latencies = []
+
+        for mac_id, name in self.devices.items():
+            sensor = f"{self.user_device_domain}.{self.presence_name}_{name}"
+            self.mqtt.listen_state(self.device_flipped, sensor, mac_id=mac_id)
+
+        self.mqtt.listen_event(
+            self.request_received,
+            self.args.get("mqtt_event", "MQTT_MESSAGE"),
+            wildcard=f"{self.presence_topic}/#",
+        )
+
+        for node in self.nodes:
+            self.publish(f"{self.presence_topic}/{node}/status", "online")
+
+        for step in self.args.get("scenario", DEFAULT_SCENARIO):
+            self.adbase.run_in(self.play_step, step["at"], step=step)
+
+        load_rate = self.args.get("load_rate", 0)
+        if load_rate:
+            self.adbase.run_every(
+                self.publish_load,
+                self.adbase.datetime() + timedelta(seconds=1),
+                1,
+                count=load_rate,
+            )
+
+        self.adbase.run_every(
+            self.publish_results, self.adbase.datetime() + timedelta(seconds=10), 10
+        )
+
+    def publish(self, topic, payload):
+        self.mqtt.mqtt_publish(topic, payload)
+        self.published += 1
+
+    def device_id(self, device):
+        if isinstance(device, int):
+            return self.device_ids[device]
+        return device
+
+    def request_received(self, event_name, data, kwargs):
+        """Answer the requests the presence app sends to the nodes."""
+        topic = data.get("topic", "")
+        action = topic[len(self.presence_topic) + 1 :]
+
+        if action == "echo":
+            for node in self.nodes:
+                self.publish(f"{self.presence_topic}/{node}/echo", "ok")
+
+        elif action == "KNOWN DEVICE STATES":
+            for node in self.nodes:
+                for mac_id in self.devices:
+                    self.report(node, mac_id)
+
+        elif action.startswith("scan/") and action[5:] in ("arrive", "depart", "rssi"):
+            self.run_scan(action[5:])
+
+    def run_scan(self, scan_type):
+        """Scan on every idle node, reporting when the scan time is over."""
+        for node in self.nodes:
+            if self.scanning.get(node):
+                continue
+
+            self.scanning[node] = True
+            self.publish(f"{self.presence_topic}/{node}/{scan_type}/start", "")
+            self.adbase.run_in(
+                self.finish_scan, self.scan_time, node=node, scan_type=scan_type
+            )
+
+    def finish_scan(self, kwargs):
+        node = kwargs["node"]
+        scan_type = kwargs["scan_type"]
+
+        for mac_id in self.devices:
+            seen = node in self.present[mac_id]
+            if scan_type == "rssi":
+                if seen:
+                    self.publish(
+                        f"{self.presence_topic}/{node}/{mac_id}/rssi",
+                        str(random.randint(-90, -40)),
+                    )
+            elif (scan_type == "arrive") == seen:
+                # arrive scans find new devices, depart scans miss gone ones
+                self.report(node, mac_id)
+
+        self.publish(f"{self.presence_topic}/{node}/{scan_type}/end", "")
+        self.scanning[node] = False
+
+    def report(self, node, mac_id):
+        """Publish a node's confidence report for a device."""
+        seen = node in self.present[mac_id]
+        payload = {
+            "id": mac_id,
+            "confidence": "100" if seen else "0",
+            "name": self.devices[mac_id],
+            "manufacturer": "Simulated",
+            "type": "KNOWN_MAC",
+            "retained": "false",
+            # wall clock, the presence app measures its latency from it
+            "timestamp": datetime.now().astimezone().isoformat(),
+            "version": "simulator",
+        }
+        if seen:
+            payload["rssi"] = str(random.randint(-90, -40))
+        self.publish(f"{self.presence_topic}/{node}/{mac_id}", json.dumps(payload))
+
+    def play_step(self, kwargs):
+        """Make a device arrive at or depart from some nodes."""
+        step = kwargs["step"]
+        mac_id = self.device_id(step["device"])
+        nodes = step.get("nodes", self.nodes)
+
+        if step["event"] == "arrive":
+            self.present[mac_id].update(nodes)
+        else:
+            self.present[mac_id].difference_update(nodes)
+
+        self.events[mac_id] = (step["event"], time.monotonic())
+        self.adbase.log(f"Simulated {step['event']} of {mac_id}", level="DEBUG")
+
+    def device_flipped(self, entity, attribute, old, new, kwargs):
+        """Measure the time from a scripted event to the presence app noticing."""
+        event = self.events.get(kwargs["mac_id"])
+        if event is None or old == new:
+            return
+
+        if (event[0] == "arrive") != (new == self.state_true):
+            return
+
+        del self.events[kwargs["mac_id"]]
+        self.latencies.append(time.monotonic() - event[1])
+
+    def publish_load(self, kwargs):
+        """Extra confidence reports to measure throughput."""
+        for _ in range(kwargs["count"]):
+            self.report(random.choice(self.nodes), random.choice(self.device_ids))
+
+    def publish_results(self, kwargs):
+        """Publish the measurements so far."""
+        elapsed = time.monotonic() - self.started
+        latencies = sorted(self.latencies)
+        processing = self.mqtt.get_state(
+            f"{self.presence_name}.processing", attribute="all", default=None
+        )
+        attributes = {
+            "nodes": len(self.nodes),
+            "devices": len(self.devices),
+            "published": self.published,
+            "published_per_second": round(self.published / elapsed, 1),
+            "detections": len(latencies),
+            "friendly_name": "Presence Simulator",
+        }
+        if latencies:
+            attributes.update(
+                {
+                    "detection_mean": round(sum(latencies) / len(latencies), 2),
+                    "detection_median": round(latencies[len(latencies) // 2], 2),
+                    "detection_max": round(latencies[-1], 2),
+                }
+            )
+        if processing:
+            # measured by the presence app as it handles the messages
+            attributes.update(
+                {
+                    key: value
+                    for key, value in processing["attributes"].items()
+                    if key != "friendly_name"
+                }
+            )
+        self.mqtt.set_state(
+            f"{self.presence_name}.simulator", state=self.published, attributes=attributes
+        )
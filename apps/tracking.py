@@ -1,11 +1,12 @@
+import collections
 import copy
-import json
 import logging
+import math
 
 import voluptuous as vol
 from appdaemon import utils
 
-from common.base_app import BaseApp, ATTR_EVENT_TYPE, ATTR_EVENT_DATA
+from common.base_app import BaseApp
 from common.const import (
     ARG_ENTITY_ID,
     ARG_GROUPS,
@@ -40,6 +41,15 @@ SOURCE_TYPE_ROUTER = 'router'
 
 DEFAULT_DISTANCE = 300.0
 DEFAULT_MINUTES_BEFORE_ASSUME = 40
+# Centroid movement in miles worth publishing, unless output_deadband is set
+DEFAULT_CENTROID_DEADBAND = 0.01
+# Fewest miles per degree of latitude, and miles per degree of longitude at the equator
+MILES_PER_DEGREE_LATITUDE = 68.7
+MILES_PER_DEGREE_LONGITUDE = 69.17
+# Nearby trackers from which one batch distance call beats a call per tracker
+BATCH_DISTANCE_MIN = 64
+
+STATE_TOPIC = 'states/slaves/rules/entity_id'
 
 SCHEMA_GROUP = vol.Schema({
     vol.Required(ARG_GROUP_NAME): vol.All(str, vol.Lower),
@@ -58,6 +68,181 @@ def get_home_gps(hass_config):
     )
 
 
+class ProximityClusters:
+    """Groups of trackers linked by being within ``max_distance`` miles of each other.
+
+    Positions are bucketed in a grid of cells at least ``max_distance`` high, so
+    moving a tracker only measures the distance to the trackers in the cells
+    around it. The groups are the connected components of the resulting
+    neighbour graph, kept in a union-find whose roots are component ids rather
+    than trackers. Gaining neighbours only merges components. Losing some may
+    split the component, which ``_split`` finds by searching from the tracker
+    and the neighbours it lost in turn, stopping as soon as the searches still
+    running have all met. Only the parts that came off are renumbered, so the
+    cost follows the smaller parts rather than the whole component.
+    """
+
+    def __init__(self, max_distance, distance):
+        self.max_distance = max_distance
+        self._distance = distance
+        self._step = max(max_distance / MILES_PER_DEGREE_LATITUDE, 1e-6)
+        self._positions = {}
+        self._cells = {}
+        self._neighbours = {}
+        self._parent = {}
+        self._members = {}
+
+    def _cell(self, gps):
+        return math.floor(gps[0] / self._step), math.floor(gps[1] / self._step)
+
+    def _nearby(self, gps):
+        """Trackers in the cells that may hold a tracker within ``max_distance``."""
+        row, _ = self._cell(gps)
+        # Degrees of longitude shrink towards the poles, so more columns may be needed
+        latitude = min(abs(gps[0]) + self._step, 89.9)
+        width = self.max_distance / (MILES_PER_DEGREE_LONGITUDE * math.cos(math.radians(latitude)))
+        first = math.floor((gps[1] - width) / self._step)
+        last = math.floor((gps[1] + width) / self._step)
+        for cell_row in range(row - 1, row + 2):
+            for column in range(first, last + 1):
+                yield from self._cells.get((cell_row, column), ())
+
+    def _find(self, entity):
+        root = entity
+        while self._parent[root] != root:
+            root = self._parent[root]
+        while self._parent[entity] != root:
+            self._parent[entity], entity = root, self._parent[entity]
+        return root
+
+    def _component(self, members):
+        # A fresh object, so it can never be mistaken for a tracker
+        component = object()
+        self._parent[component] = component
+        self._members[component] = members
+        for entity in members:
+            self._parent[entity] = component
+        return component
+
+    def _union(self, entity1, entity2):
+        root1 = self._find(entity1)
+        root2 = self._find(entity2)
+        if root1 == root2:
+            return
+        if len(self._members[root1]) < len(self._members[root2]):
+            root1, root2 = root2, root1
+        self._parent[root2] = root1
+        self._members[root1] |= self._members.pop(root2)
+
+    def _split(self, sources):
+        """Split off the parts of the component of ``sources`` no longer linked to the rest.
+
+        One breadth-first search starts from every source and they advance a
+        tracker at a time in turn. Searches that meet are merged. A search that
+        runs out of trackers has found a whole part that came off. Once a single
+        search is left running, everything it has not reached is linked to it.
+        """
+        root = self._find(sources[0])
+        owner = {}
+        searches = {}
+        merged = {}
+
+        def search_of(index):
+            while merged.get(index, index) != index:
+                index = merged[index]
+            return index
+
+        for index, source in enumerate(sources):
+            if source in owner:
+                continue
+            owner[source] = index
+            searches[index] = (collections.deque([source]), [source])
+
+        while len(searches) > 1:
+            for index in list(searches):
+                if index not in searches:
+                    continue
+                queue, reached = searches[index]
+                if not queue:
+                    # A whole part came off, it keeps only the trackers it reached
+                    del searches[index]
+                    self._members[root].difference_update(reached)
+                    self._component(set(reached))
+                    if len(searches) == 1:
+                        break
+                    continue
+
+                entity = queue.popleft()
+                for neighbour in self._neighbours[entity]:
+                    other = owner.get(neighbour)
+                    if other is None:
+                        owner[neighbour] = index
+                        queue.append(neighbour)
+                        reached.append(neighbour)
+                        continue
+                    other = search_of(other)
+                    if other == index:
+                        continue
+                    # The searches met, continue them as one
+                    other_queue, other_reached = searches.pop(other)
+                    queue.extend(other_queue)
+                    reached.extend(other_reached)
+                    merged[other] = index
+                    if len(searches) == 1:
+                        break
+                if len(searches) == 1:
+                    break
+
+    def move(self, entity, gps):
+        """Place a tracker at ``gps``, updating only its neighbourhood."""
+        old_neighbours = self._neighbours.get(entity, set())
+        nearby = [other for other in self._nearby(gps) if other != entity]
+        matrix = getattr(self._distance, 'matrix', None)
+        if matrix is not None and len(nearby) >= BATCH_DISTANCE_MIN:
+            # Only pays off with NumPy and enough trackers to amortize the call
+            distances = matrix([gps], [self._positions[other] for other in nearby])[0]
+        else:
+            distances = [self._distance(gps, self._positions[other]) for other in nearby]
+        neighbours = {other for other, distance in zip(nearby, distances)
+                      if distance <= self.max_distance}
+
+        if entity in self._positions:
+            old_cell = self._cell(self._positions[entity])
+            self._cells[old_cell].discard(entity)
+            if not self._cells[old_cell]:
+                del self._cells[old_cell]
+            lost = old_neighbours - neighbours
+            for neighbour in lost:
+                self._neighbours[neighbour].discard(entity)
+            self._neighbours[entity] = old_neighbours & neighbours
+            if lost:
+                self._split([entity, *lost])
+        else:
+            self._neighbours[entity] = set()
+            self._component({entity})
+
+        self._positions[entity] = gps
+        self._cells.setdefault(self._cell(gps), set()).add(entity)
+        for neighbour in neighbours - old_neighbours:
+            self._neighbours[entity].add(neighbour)
+            self._neighbours[neighbour].add(entity)
+            self._union(entity, neighbour)
+
+    def components(self):
+        return list(self._members.values())
+
+    def grouped(self):
+        """Every tracker within ``max_distance`` of at least one other tracker."""
+        grouped = set()
+        for members in self._members.values():
+            if len(members) > 1:
+                grouped |= members
+        return grouped
+
+    def position(self, entity):
+        return self._positions[entity]
+
+
 class CloseEnoughToHome(BaseApp):
 
     async def initialize_app(self):
@@ -138,7 +323,7 @@ class CloseEnoughToHome(BaseApp):
         self.publish_event(
             EVENT_STATE_CHANGED,
             {
-                ATTR_ENTITY_ID: entity_id,
+                ATTR_ENTITY_ID: entity,
                 ATTR_OLD_STATE: old_state,
                 ATTR_NEW_STATE: new_state
             }
@@ -147,8 +332,7 @@ class CloseEnoughToHome(BaseApp):
 
 class TrackerGroup(BaseApp):
     async def initialize_app(self):
-        self._entity_last_gps = {}
-        self._group_entities = {}
+        self._clusters = {}
         self._group_states = {}
         self._get_distance = get_distance_helper(unit=Unit.MILES)
         self._home_gps = (
@@ -158,11 +342,10 @@ class TrackerGroup(BaseApp):
 
         for group in self.configs[ARG_GROUPS]:
             group_name = group[ARG_GROUP_NAME]
-            self._entity_last_gps[group_name] = {}
-            self._group_entities[group_name] = []
             self._group_states[group_name] = None
             max_distance = group.get(ARG_MAX_DISTANCE,
                                      self.configs[ARG_MAX_DISTANCE])
+            self._clusters[group_name] = ProximityClusters(max_distance, self._get_distance)
             callback_args = {
                 ATTR_GROUP_NAME: group_name,
                 ATTR_GROUP_MEMBERS: group[ARG_ENTITY_ID],
@@ -170,8 +353,8 @@ class TrackerGroup(BaseApp):
             }
 
             for entity in group[ARG_ENTITY_ID]:
-                self._entity_last_gps[group_name][entity] = self._home_gps
-                self._group_entities[group_name].append(entity)
+                if None not in self._home_gps:
+                    self._clusters[group_name].move(entity, self._home_gps)
                 await self.listen_state(self._handle_tracker_update,
                                         entity=entity,
                                         attribute='all',
@@ -196,16 +379,32 @@ class TrackerGroup(BaseApp):
         if None in gps:
             return
         group_name = kwargs[ATTR_GROUP_NAME]
-        self._entity_last_gps[group_name][entity] = gps
-        self._calculate_group_members(group_name, kwargs[ATTR_MAX_DISTANCE])
+        self._clusters[group_name].move(entity, gps)
+        await self._calculate_group_members(group_name)
+
+    def _group_difference(self, old, new):
+        """How far the centroid moved, infinite when the membership changed."""
+        old_members, old_lat, old_long = old
+        new_members, new_lat, new_long = new
+        if old_members != new_members:
+            return math.inf
+        return self._get_distance((old_lat, old_long), (new_lat, new_long))
 
     async def _set_group_state(self, group_name, members=None, lat_avg=0.0, long_avg=0.0):
+        await self.publish_derived(
+            group_name,
+            (frozenset(members or []), lat_avg, long_avg),
+            lambda group: self._write_group_state(group_name, *group),
+            deadband=DEFAULT_CENTROID_DEADBAND,
+            difference=self._group_difference)
+
+    async def _write_group_state(self, group_name, members, lat_avg, long_avg):
         entity = 'device_tracker.group_%s' % group_name
         new_state = {
             ARG_ENTITY_ID: entity,
             ATTR_STATE: 'tracking',
             ATTR_ATTRIBUTES: {
-                ATTR_GROUP_MEMBERS: members or [],
+                ATTR_GROUP_MEMBERS: sorted(members),
                 ATTR_LATITUDE: lat_avg,
                 ATTR_LONGITUDE: long_avg
             }
@@ -213,59 +412,23 @@ class TrackerGroup(BaseApp):
         old_state = self._group_states[group_name]
         self._group_states[group_name] = new_state
 
-        payload = {
-            ATTR_EVENT_TYPE: EVENT_STATE_CHANGED,
-            ATTR_EVENT_DATA: {
-                ARG_ENTITY_ID: entity,
-                'new_state': new_state
-            },
-            ATTR_SOURCE: self.name
-        }
+        await self.publish_state(STATE_TOPIC, entity, new_state, old_state=old_state)
 
-        if old_state is not None:
-            payload[ATTR_EVENT_DATA]['old_state'] = old_state
+    async def _calculate_group_members(self, group_name):
+        clusters = self._clusters[group_name]
+        members = clusters.grouped()
+        if len(members) == 0:
+            await self._set_group_state(group_name)
+            return
 
-        return self.mqtt_publish(
-            'states/slaves/rules/entity_id',
-            payload=json.dumps(payload),
-            qos=1,
-            retain=True,
-            namespace='default'
+        positions = [clusters.position(entity) for entity in members]
+        await self._set_group_state(
+            group_name,
+            members=list(members),
+            lat_avg=sum(gps[0] for gps in positions) / len(positions),
+            long_avg=sum(gps[1] for gps in positions) / len(positions)
         )
 
-    def _calculate_group_members(self, group_name, max_distance):
-        avg_lat = 0
-        avg_long = 0
-        members = set()
-        for entity1 in self._group_entities[group_name]:
-            if None in self._entity_last_gps[group_name][entity1]:
-                continue
-            for entity2 in [entity2 for entity2 in self._group_entities[group_name] if
-                            entity1 != entity2 and
-                            None not in self._entity_last_gps[group_name][entity2] and
-                            entity2 not in members]:
-                distance = self._get_distance(
-                    self._entity_last_gps[group_name][entity1],
-                    self._entity_last_gps[group_name][entity2])
-                if distance > max_distance:
-                    continue
-                members.add(entity1)
-                members.add(entity2)
-                avg_lat += self._entity_last_gps[group_name][entity1][0]
-                avg_long += self._entity_last_gps[group_name][entity1][1]
-                avg_lat += self._entity_last_gps[group_name][entity2][0]
-                avg_long += self._entity_last_gps[group_name][entity2][1]
-
-        if len(members) == 0:
-            self._set_group_state(group_name)
-        else:
-            self._set_group_state(
-                group_name,
-                members=list(members),
-                lat_avg=avg_lat / len(members),
-                long_avg=avg_long / len(members)
-            )
-
     async def _get_gps(self, state):
         if state.get(ATTR_SOURCE_TYPE, None) == SOURCE_TYPE_ROUTER:
             return self._home_gps
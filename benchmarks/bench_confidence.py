@@ -0,0 +1,114 @@
+"""Confidence events per second, incremental vectors against reading every sensor.
+
+Each event is a new confidence value for one device at one location and ends
+with the home or not home decision. The old path read the device state, its
+type and every confidence sensor of the device back from HASS, the new one
+folds the value into the device's ``ConfidenceVector``. ``--read-cost`` adds
+a busy wait per HASS read, a sync ``get_state`` from an app thread is a round
+trip through the AppDaemon loop rather than a dict lookup.
+
+    python benchmarks/bench_confidence.py --locations 2 6 20 100 --read-cost 20
+"""
+import argparse
+import random
+import time
+
+from harness import FakeAPI, Timers
+
+from home_presence import ConfidenceVector
+
+MINIMUM_CONFIDENCE = 50
+
+
+class SlowReads(FakeAPI):
+
+    def __init__(self, timers, read_cost):
+        super().__init__(timers)
+        self.read_cost = read_cost
+
+    def get_state(self, *args, **kwargs):
+        if self.read_cost:
+            until = time.perf_counter() + self.read_cost
+            while time.perf_counter() < until:
+                pass
+        return super().get_state(*args, **kwargs)
+
+
+def old_path(hass, entity, new, device_state_sensor, device_conf_sensors):
+    hass.set_state(entity, state=new)
+    hass.get_state(device_state_sensor, copy=False)
+    hass.get_state(entity, attribute='type', copy=False)
+    sensor_res = list(map(lambda x: hass.get_state(x, copy=False), device_conf_sensors))
+    sensor_res = [i for i in sensor_res if i is not None and i != 'unknown']
+    return sensor_res != [] and any(list(map(lambda x: int(x) >= MINIMUM_CONFIDENCE, sensor_res)))
+
+
+def new_path(hass, cache, vectors, entity, new, device_entity_id, location):
+    hass.set_state(entity, state=new)
+    cache.get(device_entity_id)
+    vector = vectors[device_entity_id]
+    vector.set(location, int(float(new)))
+    return vector.home
+
+
+def run(devices, locations, events, read_cost):
+    hass = SlowReads(Timers(), read_cost)
+    conf_sensors = {
+        device: [f'sensor.{device}_{location}_conf' for location in range(locations)]
+        for device in range(devices)
+    }
+    for device, sensors in conf_sensors.items():
+        hass.set_state(f'binary_sensor.{device}', state='on')
+        for sensor in sensors:
+            hass.set_state(sensor, state='0', attributes={'type': 'KNOWN_MAC'})
+
+    vectors = {device: ConfidenceVector(MINIMUM_CONFIDENCE) for device in conf_sensors}
+    cache = {device: 'on' for device in conf_sensors}
+    stream = [
+        (random.randrange(devices), random.randrange(locations), str(random.choice((0, 0, 50, 100))))
+        for _ in range(events)
+    ]
+
+    results = {}
+    for name in ('old', 'new'):
+        reads = hass.reads
+        started = time.perf_counter()
+        decisions = []
+        for device, location, value in stream:
+            entity = conf_sensors[device][location]
+            if name == 'old':
+                decisions.append(old_path(hass, entity, value, f'binary_sensor.{device}',
+                                          conf_sensors[device]))
+            else:
+                decisions.append(new_path(hass, cache, vectors, entity, value, device, location))
+        elapsed = time.perf_counter() - started
+        results[name] = (events / elapsed, (hass.reads - reads) / events, decisions)
+
+    # both paths have to agree on every decision
+    assert results['old'][2] == results['new'][2]
+    return results
+
+
+def main(args):
+    random.seed(args.seed)
+    read_cost = args.read_cost / 1e6
+    print(f'{args.devices} devices, {args.events} events, HASS read cost {args.read_cost} us')
+    print(f'{"locations":>9} {"old events/s":>14} {"reads/event":>12} {"new events/s":>14} '
+          f'{"reads/event":>12} {"speedup":>8}')
+    for locations in args.locations:
+        results = run(args.devices, locations, args.events, read_cost)
+        old_rate, old_reads, _ = results['old']
+        new_rate, new_reads, _ = results['new']
+        print(f'{locations:>9} {old_rate:>14,.0f} {old_reads:>12.1f} {new_rate:>14,.0f} '
+              f'{new_reads:>12.1f} {new_rate / old_rate:>7.1f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--devices', type=int, default=20)
+    parser.add_argument('--locations', type=int, nargs='+', default=[2, 6, 20, 100])
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--read-cost', type=float, default=0.0,
+                        help='microseconds added to every HASS read')
+    parser.add_argument('--seed', type=int, default=1)
+    main(parser.parse_args())
@@ -0,0 +1,71 @@
+"""Accuracy and throughput of the batch Haversine distances against the scalar one.
+
+For each size N, ``matrix`` computes N x N distances and ``paired`` N
+distances between random points. Both are compared with calling the scalar
+``Haversine`` once per pair. The error columns are the largest absolute
+difference to the scalar result, in kilometres. Without NumPy the batch
+methods fall back to the scalar loop, which this reports as well.
+
+    python benchmarks/bench_haversine.py --sizes 10 100 1000
+"""
+import argparse
+import random
+import time
+
+import harness  # noqa: F401, puts the apps on the path
+
+from common.helpers import Unit, get_distance_helper, numpy
+
+
+def timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def max_error(result, expected):
+    return max(abs(float(value) - reference) for value, reference in zip(result, expected))
+
+
+def run(size, distance):
+    points1 = [(random.uniform(-80, 80), random.uniform(-180, 180)) for _ in range(size)]
+    points2 = [(random.uniform(-80, 80), random.uniform(-180, 180)) for _ in range(size)]
+
+    scalar, scalar_time = timed(lambda: [[distance(p1, p2) for p2 in points2] for p1 in points1])
+    matrix, matrix_time = timed(distance.matrix, points1, points2)
+    matrix32, _ = timed(distance.matrix, points1, points2, float32=True)
+    paired, paired_time = timed(distance.paired, points1, points2)
+
+    flat_scalar = [value for row in scalar for value in row]
+    flat_matrix = [value for row in matrix for value in row]
+    flat_matrix32 = [value for row in matrix32 for value in row]
+    diagonal = [scalar[index][index] for index in range(size)]
+    return {
+        'pairs/s scalar': size * size / scalar_time,
+        'pairs/s matrix': size * size / matrix_time,
+        'pairs/s paired': size / paired_time,
+        'error matrix': max_error(flat_matrix, flat_scalar),
+        'error float32': max_error(flat_matrix32, flat_scalar),
+        'error paired': max_error(paired, diagonal),
+    }
+
+
+def main(args):
+    random.seed(args.seed)
+    distance = get_distance_helper(unit=Unit.KILOMETERS)
+    print('NumPy', numpy.__version__ if numpy is not None else 'not installed, scalar fallback')
+    columns = ['pairs/s scalar', 'pairs/s matrix', 'pairs/s paired',
+               'error matrix', 'error float32', 'error paired']
+    print(f'{"N":>6} ' + ' '.join(f'{column:>15}' for column in columns))
+    for size in args.sizes:
+        results = run(size, distance)
+        rates = ' '.join(f'{results[column]:>15,.0f}' for column in columns[:3])
+        errors = ' '.join(f'{results[column]:>15.1e}' for column in columns[3:])
+        print(f'{size:>6} {rates} {errors}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--seed', type=int, default=1)
+    main(parser.parse_args())
@@ -0,0 +1,164 @@
+"""Memory and CPU of mirroring every state against tombstoning the unobserved ones.
+
+The plugin mirrors ``--entities`` entities of which apps listen to
+``--observed``. With ``lazy_unobserved_states`` only the observed entities are
+written to the namespace, the others are kept as ``(state, attributes)``
+tombstones. The stand-in state store does what AppDaemon's ``set_state`` does
+with a state, short of processing the ``state_changed`` event it builds, so the
+eager CPU column is a lower bound. Memory is what tracemalloc sees still
+allocated once every entity got a first state, its attributes included.
+``interest scan`` is the cost of the plugin's once a second ``refresh_interest``
+against ``--callbacks`` registered callbacks.
+
+    python benchmarks/bench_lazy_states.py --entities 5000 --observed 50
+"""
+import argparse
+import asyncio
+import copy
+import logging
+import random
+import threading
+import time
+import tracemalloc
+import types
+from datetime import datetime
+
+import harness  # noqa: F401, puts the plugin on the path
+
+from hassmqttmetrics import HassmqttMetrics
+from hassmqttplugin import HassmqttPlugin
+
+NAMESPACE = 'hass'
+DOMAINS = ['sensor', 'binary_sensor', 'light', 'switch', 'device_tracker']
+
+
+class StandInState:
+
+    def __init__(self):
+        self.state = {NAMESPACE: {}}
+
+    async def set_state(self, name, namespace, entity_id, state=None, attributes=None,
+                        replace=False):
+        old_state = copy.deepcopy(self.state[namespace].get(entity_id, {'state': None}))
+        new_state = {
+            'entity_id': entity_id,
+            'state': state,
+            'attributes': attributes,
+            'last_changed': datetime.now().replace(microsecond=0).isoformat(),
+        }
+        self.state[namespace][entity_id] = new_state
+        return {'event_type': 'state_changed',
+                'data': {'entity_id': entity_id, 'new_state': new_state, 'old_state': old_state}}
+
+
+def make_plugin(loop, lazy, callbacks):
+    plugin = HassmqttPlugin.__new__(HassmqttPlugin)
+    plugin.AD = types.SimpleNamespace(
+        loop=loop,
+        callbacks=types.SimpleNamespace(callbacks_lock=threading.Lock(), callbacks=callbacks))
+    plugin.loop = loop
+    plugin.logger = logging.getLogger(__name__)
+    plugin.metrics = HassmqttMetrics()
+    plugin.name = 'HASSMQTT'
+    plugin.namespace = NAMESPACE
+    plugin.state = StandInState()
+    plugin.lazy_states = lazy
+    plugin.tombstones = {}
+    plugin.batch_attributes = {}
+    plugin.declared_interest = set()
+    plugin.observed_interest = set()
+    plugin.observed_entities = set()
+    plugin.observed_domains = set()
+    plugin.observe_all = not lazy
+    return plugin
+
+
+def attributes(entity_id):
+    return {
+        'friendly_name': entity_id.partition('.')[2].replace('_', ' ').title(),
+        'unit_of_measurement': '%',
+        'battery_level': random.randint(0, 100),
+        'linkquality': random.randint(0, 255),
+    }
+
+
+async def drain(loop):
+    # apply_state is scheduled as a task per entity, let all of them run
+    while len(asyncio.all_tasks(loop)) > 1:
+        await asyncio.sleep(0)
+
+
+async def run(lazy, entities, observed, callback_count, updates):
+    loop = asyncio.get_running_loop()
+    names = [f'{DOMAINS[index % len(DOMAINS)]}.entity_{index}' for index in range(entities)]
+    callbacks = {}
+    for index in range(callback_count):
+        if index < observed:
+            callback = {'type': 'state', 'namespace': NAMESPACE, 'entity': names[index]}
+        else:
+            callback = {'type': 'event', 'namespace': NAMESPACE, 'event': 'MQTT_MESSAGE'}
+        callbacks.setdefault(f'app_{index % 20}', {})[index] = callback
+    plugin = make_plugin(loop, lazy, callbacks)
+    if lazy:
+        plugin.refresh_interest()
+
+    stream = [(name, str(random.randint(0, 100)), attributes(name))
+              for name in random.choices(names, k=updates)]
+
+    # the first states are decoded under tracemalloc, what the plugin keeps of them counts
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    for entity_id in names:
+        plugin.store_state(entity_id, str(random.randint(0, 100)), attributes(entity_id))
+    await drain(loop)
+    memory = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+
+    started = time.process_time()
+    for entity_id, state, attrs in stream:
+        plugin.store_state(entity_id, state, attrs)
+    await drain(loop)
+    update_cost = (time.process_time() - started) / updates
+
+    # the plugin only scans for interest with lazy states
+    scan_cost = None
+    if lazy:
+        scans = 100
+        started = time.process_time()
+        for _ in range(scans):
+            plugin.refresh_interest()
+        scan_cost = (time.process_time() - started) / scans
+
+    return {
+        'written': len(plugin.state.state[NAMESPACE]),
+        'tombstones': len(plugin.tombstones),
+        'memory': memory,
+        'update': update_cost,
+        'scan': scan_cost,
+    }
+
+
+def main(args):
+    random.seed(args.seed)
+    print(f'{args.entities} entities, {args.observed} observed, {args.callbacks} callbacks, '
+          f'{args.updates} updates')
+    print(f'{"mode":>6} {"namespace":>10} {"tombstones":>11} {"memory MiB":>11} '
+          f'{"us/update":>10} {"interest scan us":>17}')
+    for lazy in (False, True):
+        results = asyncio.run(run(lazy, args.entities, args.observed, args.callbacks,
+                                  args.updates))
+        scan = f'{results["scan"] * 1e6:.1f}' if results['scan'] is not None else '-'
+        print(f'{"lazy" if lazy else "eager":>6} {results["written"]:>10} '
+              f'{results["tombstones"]:>11} {results["memory"] / 2 ** 20:>11.2f} '
+              f'{results["update"] * 1e6:>10.2f} {scan:>17}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entities', type=int, default=5000)
+    parser.add_argument('--observed', type=int, default=50)
+    parser.add_argument('--callbacks', type=int, default=200,
+                        help='registered callbacks, the first --observed ones listen to states')
+    parser.add_argument('--updates', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=1)
+    main(parser.parse_args())
@@ -0,0 +1,101 @@
+"""Messages per second through HomePresenceApp.presence_message.
+
+Synthetic monitor traffic for 20 devices seen by 6 locations by default:
+mostly JSON confidence reports, with RSSI values and scan start/end markers
+mixed in. Every device is reported once from every location before timing,
+so the sensors exist and the run measures the steady state.
+
+    python benchmarks/bench_presence_messages.py --devices 20 --locations 6
+"""
+import argparse
+import json
+import random
+import time
+
+from harness import make_app
+
+from home_presence import HomePresenceApp
+
+TOPIC = 'monitor'
+
+
+def device_report(mac_id, name, location, confidence):
+    payload = {
+        'id': mac_id,
+        'confidence': str(confidence),
+        'name': name,
+        'manufacturer': 'Benchmark',
+        'type': 'KNOWN_MAC',
+        'retained': 'false',
+        'timestamp': 'Mon Oct 19 2026 12:00:00 GMT+0000 (UTC)',
+        'version': '0.2.200',
+    }
+    if confidence:
+        payload['rssi'] = str(random.randint(-90, -40))
+    return {'topic': f'{TOPIC}/{location}/{mac_id}', 'payload': json.dumps(payload)}
+
+
+def traffic(devices, locations, count):
+    messages = []
+    for _ in range(count):
+        mac_id, name = random.choice(devices)
+        location = random.choice(locations)
+        kind = random.random()
+        if kind < 0.75:
+            messages.append(device_report(mac_id, name, location, random.choice((0, 0, 50, 100))))
+        elif kind < 0.95:
+            messages.append({'topic': f'{TOPIC}/{location}/{mac_id}/rssi',
+                             'payload': str(random.randint(-90, -40))})
+        else:
+            marker = random.choice(('start', 'end'))
+            messages.append({'topic': f'{TOPIC}/{location}/arrive/{marker}', 'payload': ''})
+    return messages
+
+
+def main(args):
+    random.seed(args.seed)
+    devices = [('00:11:22:33:44:{:02X}'.format(index), f'device_{index}')
+               for index in range(args.devices)]
+    locations = [f'location_{index}' for index in range(args.locations)]
+
+    app, apis, timers = make_app(HomePresenceApp, {
+        'monitor_topic': TOPIC,
+        'known_devices': [f'{mac_id} {name}' for mac_id, name in devices],
+        'home_gateway_sensors': ['binary_sensor.front_door'],
+        'history_file': '',
+    })
+    hass = apis['HASS']
+
+    for location in locations:
+        app.presence_message('MQTT_MESSAGE', {'topic': f'{TOPIC}/{location}/status',
+                                              'payload': 'online'}, {})
+        for mac_id, name in devices:
+            app.presence_message('MQTT_MESSAGE', device_report(mac_id, name, location, 100), {})
+    timers.run_due()
+
+    messages = traffic(devices, locations, args.messages)
+    reads, writes = hass.reads, hass.writes
+    started = time.perf_counter()
+    for index, data in enumerate(messages, 1):
+        app.presence_message('MQTT_MESSAGE', data, {})
+        if index % args.timer_every == 0:
+            # the timers a real run would have fired in the meantime
+            timers.run_due()
+    timers.run_due()
+    elapsed = time.perf_counter() - started
+
+    print(f'{args.devices} devices x {args.locations} locations, {len(messages)} messages')
+    print(f'{len(messages) / elapsed:,.0f} messages/s, {elapsed / len(messages) * 1e6:.1f} us/message')
+    print(f'HASS reads/message {(hass.reads - reads) / len(messages):.2f}, '
+          f'HASS writes/message {(hass.writes - writes) / len(messages):.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--devices', type=int, default=20)
+    parser.add_argument('--locations', type=int, default=6)
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--timer-every', type=int, default=100,
+                        help='messages between runs of the pending timers')
+    parser.add_argument('--seed', type=int, default=1)
+    main(parser.parse_args())
@@ -0,0 +1,125 @@
+"""Bandwidth and parse CPU of state batches against a message per state change.
+
+Replays ``--updates`` state changes over ``--entities`` entities whose
+attributes mostly stay the same, the way ``BaseApp.publish_state`` sends them:
+one ``state_changed`` document per change, or coalesced into batches of
+``--batch-sizes`` changes. Batches are published as deltas, or as keyframes
+when retained. A batch keeps the latest change per entity, as the encoder
+does, so large batches carry fewer states than there were changes. Bytes are
+whole MQTT PUBLISH packets per state change. Parse is the plugin's receive
+side per state change, decoding the payload and JSON for a single message and
+``decode_state_batch`` plus resolving the deltas for a batch. zstd rows need
+the zstandard package.
+
+    python benchmarks/bench_state_batches.py --entities 200 --batch-sizes 1 10 50 200
+"""
+import argparse
+import json
+import logging
+import random
+import time
+
+import harness  # noqa: F401, puts the apps and the plugin on the path
+
+from common.state_batch import (CODEC_ZLIB, CODEC_ZSTD, STATE_BATCH_SUFFIX, StateBatchEncoder,
+                                zstandard)
+from hassmqttbatch import decode_state_batch
+from mqtt_broker import publish_packet
+
+TOPIC = 'appdaemon/states'
+SOURCE = 'monitor'
+LOGGER = logging.getLogger(__name__)
+
+
+def changes(entities, updates):
+    names = [f'sensor.device_{index}_confidence' for index in range(entities)]
+    current = {
+        name: {
+            'friendly_name': name.partition('.')[2].replace('_', ' ').title(),
+            'unit_of_measurement': '%',
+            'type': 'KNOWN_MAC',
+            'location': random.choice(['kitchen', 'living room', 'garage']),
+            'rssi': -60,
+            'last_seen': 0,
+        }
+        for name in names
+    }
+    stream = []
+    for tick in range(updates):
+        name = random.choice(names)
+        attributes = dict(current[name], rssi=random.randint(-90, -40), last_seen=tick)
+        current[name] = attributes
+        stream.append((name, {'state': str(random.choice((0, 50, 100))), 'attributes': attributes}))
+    return stream
+
+
+def single_messages(stream):
+    packets = []
+    for entity, new_state in stream:
+        payload = json.dumps({
+            'event_type': 'state_changed',
+            'data': {'entity_id': entity, 'new_state': new_state},
+            'source': SOURCE,
+        }).encode()
+        packets.append((len(publish_packet(TOPIC, payload)), payload))
+    return packets
+
+
+def parse_single(packets):
+    for _, payload in packets:
+        payload_dict = json.loads(payload.decode())
+        if isinstance(payload_dict, dict):
+            payload_dict.get('data', {}).get('new_state', {})
+
+
+def batches(stream, size, codec, keyframe):
+    encoder = StateBatchEncoder(SOURCE, codec=codec)
+    topic = f'{TOPIC}/{STATE_BATCH_SUFFIX}'
+    packets = []
+    for start in range(0, len(stream), size):
+        for entity, new_state in stream[start:start + size]:
+            encoder.add(entity, new_state)
+        payload = encoder.encode(keyframe=keyframe)
+        packets.append((len(publish_packet(topic, payload)), payload))
+    return packets
+
+
+def parse_batches(packets):
+    attributes = {}
+    for _, payload in packets:
+        for change in decode_state_batch(payload, LOGGER).changes:
+            attributes[change.entity_id] = change.resolve(attributes.get(change.entity_id))
+
+
+def measure(packets, parse, updates):
+    started = time.process_time()
+    parse(packets)
+    parse_time = time.process_time() - started
+    return sum(size for size, _ in packets) / updates, parse_time / updates
+
+
+def main(args):
+    random.seed(args.seed)
+    stream = changes(args.entities, args.updates)
+    codecs = [CODEC_ZLIB] + ([CODEC_ZSTD] if zstandard is not None else [])
+
+    print(f'{args.entities} entities, {args.updates} state changes')
+    print(f'{"format":>22} {"batch":>6} {"bytes/change":>13} {"parse us/change":>16}')
+    size, parse = measure(single_messages(stream), parse_single, args.updates)
+    print(f'{"single message":>22} {1:>6} {size:>13.1f} {parse * 1e6:>16.2f}')
+    for codec in codecs:
+        for keyframe in (False, True):
+            name = f'{codec} {"keyframes" if keyframe else "deltas"}'
+            for batch_size in args.batch_sizes:
+                packets = batches(stream, batch_size, codec, keyframe)
+                size, parse = measure(packets, parse_batches, args.updates)
+                print(f'{name:>22} {batch_size:>6} {size:>13.1f} {parse * 1e6:>16.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entities', type=int, default=200)
+    parser.add_argument('--updates', type=int, default=20000)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 10, 50, 200])
+    parser.add_argument('--seed', type=int, default=1)
+    main(parser.parse_args())
@@ -0,0 +1,68 @@
+"""Cost of a tracker update in TrackerGroup's ProximityClusters.
+
+Every tracker starts at home, as TrackerGroup seeds them, so the first ones
+to leave split a component holding everybody. Then random trackers move to
+random places within ``--radius`` miles of home or come back home. Reports
+the mean and worst time per ``move`` plus the time to read the grouped
+trackers, for 10, 100 and 1000 trackers by default.
+
+    python benchmarks/bench_tracker_groups.py --trackers 10 100 1000
+"""
+import argparse
+import random
+import time
+
+import harness  # noqa: F401, puts the apps on the path
+
+from common.helpers import Unit, get_distance_helper
+from tracking import MILES_PER_DEGREE_LATITUDE, ProximityClusters
+
+HOME = (52.37, 4.89)
+
+
+def run(trackers, updates, max_distance, radius):
+    distance = get_distance_helper(unit=Unit.MILES)
+    clusters = ProximityClusters(max_distance, distance)
+    names = [f'device_tracker.tracker_{index}' for index in range(trackers)]
+    for name in names:
+        clusters.move(name, HOME)
+
+    spread = radius / MILES_PER_DEGREE_LATITUDE
+    moves = []
+    for _ in range(updates):
+        if random.random() < 0.3:
+            gps = HOME
+        else:
+            gps = (HOME[0] + random.uniform(-spread, spread), HOME[1] + random.uniform(-spread, spread))
+        moves.append((random.choice(names), gps))
+
+    times = []
+    grouped_time = 0.0
+    for name, gps in moves:
+        started = time.perf_counter()
+        clusters.move(name, gps)
+        moved = time.perf_counter()
+        clusters.grouped()
+        times.append(moved - started)
+        grouped_time += time.perf_counter() - moved
+    return sum(times) / len(times), max(times), grouped_time / len(moves)
+
+
+def main(args):
+    random.seed(args.seed)
+    print(f'{args.updates} updates, max distance {args.max_distance} mi, radius {args.radius} mi')
+    print(f'{"trackers":>8} {"move ms mean":>13} {"move ms max":>12} {"grouped ms":>11}')
+    for trackers in args.trackers:
+        mean, worst, grouped = run(trackers, args.updates, args.max_distance, args.radius)
+        print(f'{trackers:>8} {mean * 1e3:>13.3f} {worst * 1e3:>12.3f} {grouped * 1e3:>11.3f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--trackers', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--max-distance', type=float, default=1.0)
+    parser.add_argument('--radius', type=float, default=20.0,
+                        help='miles from home the trackers move within')
+    parser.add_argument('--seed', type=int, default=1)
+    main(parser.parse_args())
@@ -0,0 +1,93 @@
+"""Per-event cost of the weighted climate average against room size.
+
+Every event changes the value or the weight of one sensor and reads the
+average, as WeightedAveragedClimate does on a temperature or trigger change.
+``WeightedAverage`` adjusts its running sums, the old path summed every
+sensor again. The cost per event of the running sums should stay flat as the
+room grows, apart from the exact recomputation every ``RECOMPUTE_INTERVAL``
+updates that adds sensors / interval additions per event. The old cost grows
+with the number of sensors. The error column is the drift of the running sums
+from an exact recomputation at the end of the run.
+
+    python benchmarks/bench_weighted_average.py --sensors 10 100 1000 10000
+"""
+import argparse
+import random
+import time
+
+import harness  # noqa: F401, puts the apps on the path
+
+# base_app has to be imported ahead of the apps that use common.validation
+import common.base_app  # noqa: F401
+from averaging import WeightedAverage, WeightedValue
+
+
+def old_average(values):
+    if values is None or len(values) == 0:
+        return 0.0
+    total_weight = float(sum([val.weight for _, val in values.items() if val.is_valid]))
+    total_value = float(sum([val.weight * val.value for _, val in values.items() if val.is_valid]))
+    if total_weight == 0:
+        return None
+    return total_value / total_weight
+
+
+def events(sensors, count):
+    stream = []
+    for _ in range(count):
+        if random.random() < 0.9:
+            stream.append((random.randrange(sensors), random.uniform(15.0, 25.0), None))
+        else:
+            stream.append((random.randrange(sensors), None, random.choice((0.0, 0.5, 1.0, 2.0))))
+    return stream
+
+
+def run(sensors, count):
+    stream = events(sensors, count)
+
+    engine = WeightedAverage()
+    old_values = {}
+    for sensor in range(sensors):
+        engine.update(sensor, 20.0, 1.0)
+        old_values[sensor] = WeightedValue(20.0, 1.0)
+
+    started = time.perf_counter()
+    for sensor, value, weight in stream:
+        engine.update(sensor, value, weight)
+        engine.average
+    new_cost = (time.perf_counter() - started) / count
+
+    # the old path is too slow to replay everything on large rooms
+    old_count = min(count, max(1000, count * 100 // sensors))
+    started = time.perf_counter()
+    for sensor, value, weight in stream[:old_count]:
+        weighted = old_values[sensor]
+        if value is not None:
+            weighted.value = value
+        if weight is not None:
+            weighted.weight = weight
+        old_average(old_values)
+    old_cost = (time.perf_counter() - started) / old_count
+
+    average = engine.average
+    engine.recompute()
+    exact = engine.average
+    error = abs(average - exact) if average is not None and exact is not None else 0.0
+    return new_cost, old_cost, error
+
+
+def main(args):
+    random.seed(args.seed)
+    print(f'{args.events} events per room size')
+    print(f'{"sensors":>8} {"running sums us/event":>22} {"full sums us/event":>19} {"error":>9}')
+    for sensors in args.sensors:
+        new_cost, old_cost, error = run(sensors, args.events)
+        print(f'{sensors:>8} {new_cost * 1e6:>22.2f} {old_cost * 1e6:>19.2f} {error:>9.1e}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sensors', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=1)
+    main(parser.parse_args())
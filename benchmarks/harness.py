@@ -0,0 +1,207 @@
+"""In-memory stand-ins for the AppDaemon APIs, to drive apps from a benchmark.
+
+``make_app`` builds an ``ad.ADBase`` app around ``FakeAPI`` objects instead of
+a running AppDaemon. States live in a dict per namespace, ``set_state`` fires
+the matching ``listen_state`` callbacks synchronously and one-shot timers only
+run when ``Timers.run_due`` is called, as if their delay had passed. Reads and writes are
+counted per namespace. AppDaemon itself still has to be installed, the apps
+import it.
+"""
+import concurrent.futures
+import importlib
+import itertools
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'apps'))
+sys.path.insert(0, os.path.join(ROOT, 'custom_plugins', 'hassmqtt'))
+# AppDaemon puts its package directory on the path for the apps' `import adbase`, here
+# that would shadow the standard threading and logging modules with AppDaemon's own
+sys.modules.setdefault('adbase', importlib.import_module('appdaemon.adbase'))
+
+
+class ImmediateExecutor:
+    """Runs submitted work on the calling thread."""
+
+    def submit(self, fn, *args, **kwargs):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as error:
+            future.set_exception(error)
+        return future
+
+
+class FakeAD:
+
+    def __init__(self):
+        self.config_dir = tempfile.mkdtemp()
+        self.executor = ImmediateExecutor()
+
+
+class Timers:
+
+    def __init__(self):
+        self.handles = itertools.count(1)
+        self.pending = {}
+
+    def run_due(self):
+        """Run the pending one-shot timers, those they schedule wait for the next call."""
+        pending, self.pending = self.pending, {}
+        for callback, kwargs in pending.values():
+            callback(kwargs)
+        return len(pending)
+
+
+class FakeAPI:
+    """The subset of the AppDaemon and plugin APIs the apps use."""
+
+    def __init__(self, timers):
+        self.timers = timers
+        self.states = {}
+        self.listeners = {}
+        self.reads = 0
+        self.writes = 0
+        self.published = 0
+
+    # logging and time
+
+    def log(self, msg, *args, **kwargs):
+        pass
+
+    error = log
+
+    def datetime(self, aware=False):
+        return datetime.now()
+
+    def date(self):
+        return datetime.now().date()
+
+    def parse_time(self, value, **kwargs):
+        return datetime.strptime(value, '%H:%M:%S').time()
+
+    # scheduler
+
+    def run_in(self, callback, delay, **kwargs):
+        handle = next(self.timers.handles)
+        self.timers.pending[handle] = (callback, kwargs)
+        return handle
+
+    def run_every(self, callback, start, interval, **kwargs):
+        # recurring timers never run, the benchmarks drive the work themselves
+        return next(self.timers.handles)
+
+    def run_at(self, callback, start, **kwargs):
+        return next(self.timers.handles)
+
+    def run_daily(self, callback, start, **kwargs):
+        return next(self.timers.handles)
+
+    def cancel_timer(self, handle):
+        self.timers.pending.pop(handle, None)
+
+    # states
+
+    def entity_exists(self, entity_id, **kwargs):
+        self.reads += 1
+        return entity_id in self.states
+
+    def split_entity(self, entity_id, **kwargs):
+        return entity_id.split('.', 1)
+
+    def get_state(self, entity_id=None, attribute=None, default=None, copy=True, **kwargs):
+        self.reads += 1
+        state = self.states.get(entity_id)
+        if state is None:
+            return default
+        if attribute == 'all':
+            return dict(state, attributes=dict(state['attributes']))
+        if attribute is not None:
+            return state['attributes'].get(attribute, default)
+        return state['state']
+
+    def set_state(self, entity_id, state=None, attributes=None, replace=False, **kwargs):
+        self.writes += 1
+        old = self.states.get(entity_id)
+        new_attributes = {} if replace or old is None else dict(old['attributes'])
+        new_attributes.update(attributes or {})
+        new_attributes.update(kwargs)
+        now = datetime.now().isoformat()
+        new = {
+            'state': state if state is not None or old is None else old['state'],
+            'attributes': new_attributes,
+            'last_updated': now,
+        }
+        new['last_changed'] = now if old is None or old['state'] != new['state'] else old['last_changed']
+        self.states[entity_id] = new
+        self._fire(entity_id, old, new)
+        return new
+
+    def remove_entity(self, entity_id, **kwargs):
+        self.writes += 1
+        self.states.pop(entity_id, None)
+
+    def listen_state(self, callback, entity_id=None, attribute=None, new=None,
+                     immediate=False, **kwargs):
+        handle = next(self.timers.handles)
+        self.listeners[handle] = (callback, entity_id, attribute, new, kwargs)
+        current = self.states.get(entity_id)
+        if immediate and current is not None:
+            value = current if attribute == 'all' else current['state']
+            if new is None or value == new:
+                callback(entity_id, attribute, None, value, kwargs)
+        return handle
+
+    def cancel_listen_state(self, handle):
+        self.listeners.pop(handle, None)
+
+    def _fire(self, entity_id, old, new):
+        for callback, entity, attribute, wanted, kwargs in list(self.listeners.values()):
+            if entity is not None and entity != entity_id:
+                continue
+            if attribute == 'all':
+                old_value, new_value = old, new
+            else:
+                old_value = old['state'] if old else None
+                new_value = new['state']
+                if old_value == new_value:
+                    continue
+            if wanted is not None and new_value != wanted:
+                continue
+            callback(entity_id, attribute, old_value, new_value, kwargs)
+
+    # events, services and MQTT
+
+    def listen_event(self, callback, event=None, **kwargs):
+        return next(self.timers.handles)
+
+    def register_service(self, service, callback, **kwargs):
+        pass
+
+    def call_service(self, service, **kwargs):
+        pass
+
+    def mqtt_publish(self, topic, payload=None, **kwargs):
+        self.published += 1
+
+
+def make_app(cls, args, plugins=('HASS', 'MQTT')):
+    """Initialize an app of class ``cls`` with ``args`` on fake APIs.
+
+    Returns the app, the plugin APIs by name and the shared timers.
+    """
+    timers = Timers()
+    apis = {name: FakeAPI(timers) for name in plugins}
+    adbase = FakeAPI(timers)
+
+    app = cls.__new__(cls)
+    app.args = args
+    app.AD = FakeAD()
+    app.get_ad_api = lambda: adbase
+    app.get_plugin_api = apis.get
+    app.initialize()
+    timers.run_due()
+    return app, apis, timers
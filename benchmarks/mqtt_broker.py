@@ -0,0 +1,184 @@
+"""Minimal MQTT 3.1.1 broker for local load tests.
+
+Enough of the protocol for AppDaemon's MQTT plugin and the presence simulator:
+CONNECT, PUBLISH at QoS 0, 1 and 2 with retained messages, SUBSCRIBE and
+UNSUBSCRIBE with wildcards, PINGREQ and DISCONNECT. Subscriptions are granted
+at QoS 0 and there are no persistent sessions, wills or authentication.
+
+    python benchmarks/mqtt_broker.py --port 1883
+
+Prints the messages routed per second every ``--report`` seconds.
+"""
+import argparse
+import asyncio
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'custom_plugins', 'hassmqtt'))
+
+from hassmqttmatcher import TopicMatcher, TopicRouter  # noqa: E402
+
+CONNECT = 1
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+UNSUBSCRIBE = 10
+PINGREQ = 12
+DISCONNECT = 14
+
+
+def packet(packet_type, body=b'', flags=0):
+    header = bytearray([packet_type << 4 | flags])
+    length = len(body)
+    while True:
+        byte = length % 128
+        length //= 128
+        header.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(header) + body
+
+
+def string(data, offset):
+    length, = struct.unpack_from('!H', data, offset)
+    return data[offset + 2:offset + 2 + length].decode(), offset + 2 + length
+
+
+def publish_packet(topic, payload, retain=False):
+    topic = topic.encode()
+    return packet(PUBLISH, struct.pack('!H', len(topic)) + topic + payload, flags=int(retain))
+
+
+class Broker:
+
+    def __init__(self):
+        self.router = TopicRouter()
+        self.subscribers = {}
+        self.retained = {}
+        self.routed = 0
+
+    async def read_packet(self, reader):
+        first = (await reader.readexactly(1))[0]
+        length = 0
+        multiplier = 1
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                break
+        return first >> 4, first & 0x0F, await reader.readexactly(length)
+
+    async def client(self, reader, writer):
+        try:
+            packet_type, _, _ = await self.read_packet(reader)
+            if packet_type != CONNECT:
+                return
+            writer.write(packet(2, b'\x00\x00'))
+
+            while True:
+                packet_type, flags, body = await self.read_packet(reader)
+                if packet_type == PUBLISH:
+                    self.publish(writer, flags, body)
+                elif packet_type == PUBREL:
+                    writer.write(packet(PUBCOMP, body[:2]))
+                elif packet_type == SUBSCRIBE:
+                    self.subscribe(writer, body)
+                elif packet_type == UNSUBSCRIBE:
+                    self.unsubscribe(writer, body)
+                elif packet_type == PINGREQ:
+                    writer.write(packet(13))
+                elif packet_type == DISCONNECT:
+                    return
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for writers in self.subscribers.values():
+                writers.discard(writer)
+            writer.close()
+
+    def publish(self, writer, flags, body):
+        qos = flags >> 1 & 0x03
+        topic, offset = string(body, 0)
+        if qos:
+            packet_id = body[offset:offset + 2]
+            offset += 2
+            writer.write(packet(PUBACK if qos == 1 else PUBREC, packet_id))
+        payload = body[offset:]
+
+        if flags & 0x01:
+            if payload:
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+
+        message = publish_packet(topic, payload)
+        receivers = set()
+        for topic_filter in self.router.match(topic):
+            receivers.update(self.subscribers.get(topic_filter, ()))
+        for receiver in receivers:
+            receiver.write(message)
+        self.routed += len(receivers)
+
+    def subscribe(self, writer, body):
+        packet_id = body[:2]
+        offset = 2
+        granted = bytearray()
+        retained = []
+        while offset < len(body):
+            topic_filter, offset = string(body, offset)
+            offset += 1
+            try:
+                self.router.add(topic_filter)
+            except ValueError:
+                granted.append(0x80)
+                continue
+            granted.append(0)
+            self.subscribers.setdefault(topic_filter, set()).add(writer)
+
+            matcher = TopicMatcher(topic_filter)
+            for topic, payload in self.retained.items():
+                if matcher.matches(topic):
+                    retained.append(publish_packet(topic, payload, retain=True))
+        writer.write(packet(9, packet_id + bytes(granted)))
+        for message in retained:
+            writer.write(message)
+
+    def unsubscribe(self, writer, body):
+        packet_id = body[:2]
+        offset = 2
+        while offset < len(body):
+            topic_filter, offset = string(body, offset)
+            self.subscribers.get(topic_filter, set()).discard(writer)
+        writer.write(packet(11, packet_id))
+
+    async def report(self, interval):
+        while True:
+            routed = self.routed
+            started = time.monotonic()
+            await asyncio.sleep(interval)
+            rate = (self.routed - routed) / (time.monotonic() - started)
+            print(f'{rate:.1f} messages/s routed, {len(self.retained)} retained')
+
+
+async def main(args):
+    broker = Broker()
+    server = await asyncio.start_server(broker.client, args.host, args.port)
+    print(f'Listening on {args.host}:{args.port}')
+    if args.report:
+        asyncio.ensure_future(broker.report(args.report))
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--report', type=float, default=10, help='seconds between reports, 0 disables')
+    asyncio.run(main(parser.parse_args()))
@@ -3,6 +3,8 @@ import appdaemon.adapi as adapi
 from appdaemon.appdaemon import AppDaemon
 import appdaemon.utils as utils
 
+from hassmqttmatcher import valid_topic_filter
+
 
 class HassMqtt(adbase.ADBase, adapi.ADAPI):
     """
@@ -116,6 +118,10 @@ class HassMqtt(adbase.ADBase, adapi.ADAPI):
 
             >>> self.listen_event(self.mqtt_message_recieved_event, "MQTT_MESSAGE", wildcard = 'homeassistant/#')
 
+            Listen events for one level of a topic tree.
+
+            >>> self.listen_event(self.mqtt_message_recieved_event, "MQTT_MESSAGE", wildcard = 'homeassistant/+/light')
+
             Listen plugin's `disconnected` events from the broker.
 
             >>> self.listen_event(self.mqtt_message_recieved_event, "MQTT_MESSAGE", state = 'Disconnected', topic = None)
@@ -125,7 +131,10 @@ class HassMqtt(adbase.ADBase, adapi.ADAPI):
             >>> self.listen_event(self.mqtt_message_recieved_event, "MQTT_MESSAGE", state = 'Connected', topic = None)
 
         Notes:
-            At this point, it is not possible to use single level wildcard like using ``homeassistant/+/light`` instead of ``homeassistant/bedroom/light``. This could be added later, if need be.
+            Wildcards follow MQTT filter syntax: ``+`` matches exactly one level anywhere in the
+            filter and ``#`` matches any number of levels at the end. Filters are compiled once into
+            the plugin's topic router, and an event matching several registered wildcards is delivered
+            once to each callback whose wildcard matched.
 
         """
 
@@ -133,7 +142,7 @@ class HassMqtt(adbase.ADBase, adapi.ADAPI):
 
         if 'wildcard' in kwargs:
             wildcard = kwargs['wildcard']
-            if wildcard[-2:] == '/#' and len(wildcard.split('/')[0]) >= 1:
+            if valid_topic_filter(wildcard) and ('+' in wildcard or '#' in wildcard):
                 plugin = await self.AD.plugins.get_plugin_object(namespace)
                 await plugin.process_mqtt_wildcard(kwargs['wildcard'])
             else:
@@ -144,6 +153,80 @@ class HassMqtt(adbase.ADBase, adapi.ADAPI):
 
         return super(HassMqtt, self).listen_event(callback, event, **kwargs)
 
+    #
+    # Lazily mirrored states
+    #
+
+    async def _lazy_plugin(self, namespace):
+        plugin = await self.AD.plugins.get_plugin_object(namespace)
+        if getattr(plugin, 'lazy_states', False):
+            return plugin
+        return None
+
+    @utils.sync_wrapper
+    async def listen_state(self, callback, entity=None, **kwargs):
+        """Listens for state changes, materializing lazily mirrored entities first.
+
+        Takes the same arguments as ``ADAPI.listen_state()``. When the plugin runs with
+        ``lazy_unobserved_states``, the entity (or domain) becomes observed immediately
+        instead of at the plugin's next interest scan.
+        """
+        namespace = self._get_namespace(**kwargs)
+        plugin = await self._lazy_plugin(namespace)
+        if plugin is not None:
+            await plugin.declare_interest([entity])
+        return await super(HassMqtt, self).listen_state(callback, entity, **kwargs)
+
+    @utils.sync_wrapper
+    async def get_state(self, entity_id=None, attribute=None, default=None, copy=True, **kwargs):
+        """Gets the state of an entity, materializing it first if it is held lazily.
+
+        Takes the same arguments as ``ADAPI.get_state()``.
+        """
+        namespace = self._get_namespace(**kwargs)
+        plugin = await self._lazy_plugin(namespace)
+        if plugin is not None:
+            await plugin.materialize(entity_id)
+        return await super(HassMqtt, self).get_state(entity_id, attribute=attribute,
+                                                     default=default, copy=copy, **kwargs)
+
+    @utils.sync_wrapper
+    async def entity_exists(self, entity_id, **kwargs):
+        """Checks if an entity exists, materializing it first if it is held lazily."""
+        namespace = self._get_namespace(**kwargs)
+        plugin = await self._lazy_plugin(namespace)
+        if plugin is not None:
+            await plugin.materialize(entity_id)
+        return await super(HassMqtt, self).entity_exists(entity_id, **kwargs)
+
+    @utils.sync_wrapper
+    async def declare_interest(self, *entities, **kwargs):
+        """Declares that the app reads the given entities or domains with ``get_state()``.
+
+        With ``lazy_unobserved_states`` enabled, the plugin only writes mirrored states for
+        entities that are listened to or declared here; everything else is kept as a cheap
+        tombstone until first accessed. Declaring interest keeps an entity current even
+        without a state listener.
+
+        Args:
+            *entities: Entity ids (``sensor.kitchen``) or domains (``sensor``).
+            **kwargs (optional): Zero or more keyword arguments.
+
+        Keyword Args:
+            namespace (str, optional): Namespace to use for the call.
+
+        Returns:
+            None.
+
+        Examples:
+            >>> self.declare_interest("sensor.kitchen_temperature", "binary_sensor")
+
+        """
+        namespace = self._get_namespace(**kwargs)
+        plugin = await self._lazy_plugin(namespace)
+        if plugin is not None:
+            await plugin.declare_interest(entities)
+
     #
     # service calls
     #
@@ -194,6 +277,90 @@ class HassMqtt(adbase.ADBase, adapi.ADAPI):
         result = self.call_service(service, **kwargs)
         return result
 
+    def mqtt_publish_many(self, messages, rate=None, **kwargs):
+        """Publishes several messages to a MQTT broker with a single service call.
+
+        Every message is handed to the MQTT client in one go, instead of one service call
+        per message. When ``rate`` is given, the plugin paces the messages itself, so apps
+        no longer need a chain of scheduler timers to space them out.
+
+        Args:
+            messages (list): ``(topic, payload, qos, retain)`` tuples. ``qos`` and ``retain``
+                are optional and default to the plugin's QOS and ``False``.
+            rate (float, optional): Maximum messages per second. By default every message is
+                sent immediately.
+            **kwargs (optional): Zero or more keyword arguments.
+
+        Keyword Args:
+            namespace (str, optional): Namespace to use for the call. See the section on
+                `namespaces <APPGUIDE.html#namespaces>`__ for a detailed description.
+                In most cases it is safe to ignore this parameter.
+
+        Returns:
+            The result code of each publish, or the number of queued messages when paced.
+
+        Examples:
+            >>> self.mqtt_publish_many([("homeassistant/bedroom/light", "ON"),
+            >>>                         ("homeassistant/kitchen/light", "OFF", 1, True)])
+
+            Send one message per second.
+
+            >>> self.mqtt_publish_many([("monitor/setup/ADD STATIC DEVICE", device)
+            >>>                         for device in devices], rate=1)
+
+        """
+
+        kwargs['messages'] = [list(message) for message in messages]
+        if rate is not None:
+            kwargs['rate'] = rate
+        service = 'mqtt/publish_many'
+        result = self.call_service(service, **kwargs)
+        return result
+
+    @utils.sync_wrapper
+    async def mqtt_request(self, topic, payload=None, response_topic=None, timeout=10, **kwargs):
+        """Publishes a request and waits for the matching reply.
+
+        A correlation ID is attached to the request: as MQTT 5 ``CorrelationData`` and
+        ``ResponseTopic`` properties when the plugin is configured with ``client_protocol: 5``,
+        otherwise as ``correlation_id`` and ``response_topic`` fields embedded in a JSON object
+        payload. The reply resolves the request when it carries the same correlation ID; a
+        reply without any correlation ID resolves the oldest request waiting on its topic,
+        which suits devices that cannot echo the ID back. The plugin subscribes to
+        ``response_topic`` if none of its subscriptions cover it.
+
+        Args:
+            topic (str): topic the request is published to.
+            payload: request payload, anything but a string or bytes is serialized to JSON.
+            response_topic (str): topic (or topic filter) the reply is expected on.
+            timeout (float, optional): seconds to wait for the reply (Default value: ``10``).
+            **kwargs (optional): Zero or more keyword arguments.
+
+        Keyword Args:
+            qos (int, optional): The Quality of Service (QOS) of the request.
+            namespace (str, optional): Namespace to use for the call. See the section on
+                `namespaces <APPGUIDE.html#namespaces>`__ for a detailed description.
+                In most cases it is safe to ignore this parameter.
+
+        Returns:
+            A dict with the reply's ``topic`` and ``payload``, or ``None`` if the request could
+            not be published.
+
+        Raises:
+            asyncio.TimeoutError: no reply arrived within ``timeout`` seconds.
+
+        Examples:
+            >>> reply = await self.mqtt_request("monitor/echo", "", response_topic="monitor/+/echo", timeout=5)
+
+        """
+        if response_topic is None:
+            raise ValueError("Response topic not provided, please provide a Response Topic")
+
+        namespace = self._get_namespace(**kwargs)
+        plugin = await self.AD.plugins.get_plugin_object(namespace)
+        return await plugin.request(topic, payload, response_topic, timeout,
+                                    qos=kwargs.get('qos', None))
+
     def mqtt_subscribe(self, topic, **kwargs):
         """Subscribes to a MQTT topic.
 
@@ -0,0 +1,121 @@
+"""Decoder for batched state payloads.
+
+A batch message carries several ``state_changed`` updates in one compressed payload:
+
+    b'HMB' + format version (b'\\x01') + codec (b'z' zlib, b's' zstd) + compressed JSON
+
+The JSON document is ``{"source": ..., "states": [...]}`` where every item is either a
+keyframe ``{"entity_id", "state", "attributes"}`` or a delta
+``{"entity_id", "state", "delta": {"set": {...}, "unset": [...]}}`` applied against the
+last attributes known for that entity. Publishers live in ``common.state_batch``.
+"""
+import json
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BATCH_MARKER = b'HMB\x01'
+CODEC_ZLIB = b'z'
+CODEC_ZSTD = b's'
+
+ATTR_ENTITY_ID = 'entity_id'
+ATTR_STATE = 'state'
+ATTR_ATTRIBUTES = 'attributes'
+ATTR_DELTA = 'delta'
+ATTR_SET = 'set'
+ATTR_UNSET = 'unset'
+ATTR_STATES = 'states'
+
+
+def is_state_batch(payload):
+    return payload[:len(BATCH_MARKER)] == BATCH_MARKER
+
+
+class StateChange:
+    """One decoded entry of a batch."""
+
+    __slots__ = ['entity_id', 'state', 'attributes', 'delta']
+
+    def __init__(self, entity_id, state, attributes=None, delta=None):
+        self.entity_id = entity_id
+        self.state = state
+        self.attributes = attributes
+        self.delta = delta
+
+    def resolve(self, base_attributes):
+        """Return the full attribute dict, applying a delta against ``base_attributes``."""
+        if self.delta is None:
+            return self.attributes
+        attributes = dict(base_attributes or {})
+        attributes.update(self.delta.get(ATTR_SET, {}))
+        for key in self.delta.get(ATTR_UNSET, []):
+            attributes.pop(key, None)
+        return attributes
+
+
+class DecodedBatch:
+    """A decoded batch and the cost of decoding it."""
+
+    __slots__ = ['changes', 'wire_size', 'raw_size', 'decode_time']
+
+    def __init__(self, changes, wire_size, raw_size, decode_time):
+        self.changes = changes
+        self.wire_size = wire_size
+        self.raw_size = raw_size
+        self.decode_time = decode_time
+
+
+def decode_state_batch(payload, logger):
+    """Decode a batch payload, logging why and returning ``None`` if it is malformed."""
+    try:
+        return _decode(payload)
+    except ValueError as err:
+        logger.info("Unable to decode state batch: %s", err)
+        return None
+
+
+def _decode(payload):
+    started = time.perf_counter()
+    header = len(BATCH_MARKER)
+    codec = payload[header:header + 1]
+    body = payload[header + 1:]
+    if codec == CODEC_ZLIB:
+        try:
+            raw = zlib.decompress(body)
+        except zlib.error as err:
+            raise ValueError(str(err))
+    elif codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise ValueError('zstd batch received but zstandard is not installed')
+        try:
+            raw = zstandard.ZstdDecompressor().decompress(body)
+        except zstandard.ZstdError as err:
+            raise ValueError(str(err))
+    else:
+        raise ValueError('Unknown batch codec {!r}'.format(codec))
+
+    # UnicodeDecodeError and JSONDecodeError are both ValueErrors
+    document = json.loads(raw.decode())
+    if not isinstance(document, dict):
+        raise ValueError('Batch document is not a JSON object')
+    items = document.get(ATTR_STATES, [])
+    if not isinstance(items, list):
+        raise ValueError('Batch states are not a JSON array')
+
+    changes = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        entity_id = item.get(ATTR_ENTITY_ID)
+        if entity_id is None:
+            continue
+        changes.append(StateChange(entity_id,
+                                   item.get(ATTR_STATE),
+                                   attributes=item.get(ATTR_ATTRIBUTES),
+                                   delta=item.get(ATTR_DELTA)))
+
+    return DecodedBatch(changes, len(payload), len(raw), time.perf_counter() - started)
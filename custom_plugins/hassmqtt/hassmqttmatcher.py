@@ -0,0 +1,163 @@
+def valid_topic_filter(topic_filter):
+    """Return ``True`` if ``topic_filter`` is a valid MQTT subscription filter."""
+    if not isinstance(topic_filter, str) or topic_filter == '':
+        return False
+    levels = topic_filter.split('/')
+    for index, level in enumerate(levels):
+        if '#' in level and (level != '#' or index != len(levels) - 1):
+            return False
+        if '+' in level and level != '+':
+            return False
+    return True
+
+
+def filter_covers(outer, inner):
+    """Return ``True`` if every topic matching filter ``inner`` also matches ``outer``."""
+    outer_levels = outer.split('/')
+    inner_levels = inner.split('/')
+    for index, level in enumerate(outer_levels):
+        if index == 0 and level in ('+', '#') and inner_levels[0].startswith('$'):
+            return False
+        if level == '#':
+            return True
+        if index >= len(inner_levels):
+            return False
+        if level == '+':
+            if inner_levels[index] == '#':
+                return False
+        elif level != inner_levels[index]:
+            return False
+    return len(outer_levels) == len(inner_levels)
+
+
+class TopicMatcher:
+    """A single MQTT topic filter, matched with the same trie as ``TopicRouter``."""
+
+    __slots__ = ['topic_filter', '_router']
+
+    def __init__(self, topic_filter):
+        self.topic_filter = topic_filter
+        self._router = TopicRouter()
+        self._router.add(topic_filter)
+
+    @property
+    def is_wildcard(self):
+        return '+' in self.topic_filter or '#' in self.topic_filter
+
+    def matches(self, topic):
+        return bool(self._router.match(topic))
+
+    def covers(self, topic_filter):
+        """Return ``True`` if this filter receives everything ``topic_filter`` does."""
+        return filter_covers(self.topic_filter, topic_filter)
+
+    def __eq__(self, o):
+        if isinstance(o, TopicMatcher):
+            return self.topic_filter == o.topic_filter
+        return self.topic_filter == o
+
+    def __hash__(self):
+        return hash(self.topic_filter)
+
+    def __str__(self):
+        return self.topic_filter
+
+
+class _RouterNode:
+    __slots__ = ['children', 'filters', 'multi_level']
+
+    def __init__(self):
+        self.children = {}
+        self.filters = set()
+        self.multi_level = set()
+
+
+class TopicRouter:
+    """Matches a topic against every registered filter in one walk over its levels.
+
+    Filters are compiled into a trie keyed by topic level, with ``+`` and ``#`` as
+    ordinary children, so matching costs O(levels) regardless of how many filters are
+    registered.
+    """
+
+    def __init__(self):
+        self._root = _RouterNode()
+        self._filters = set()
+
+    def __len__(self):
+        return len(self._filters)
+
+    def __contains__(self, topic_filter):
+        return topic_filter in self._filters
+
+    def add(self, topic_filter):
+        if not valid_topic_filter(topic_filter):
+            raise ValueError('Invalid MQTT topic filter {!r}'.format(topic_filter))
+        if topic_filter in self._filters:
+            return
+        node = self._root
+        levels = topic_filter.split('/')
+        for level in levels[:-1]:
+            node = node.children.setdefault(level, _RouterNode())
+        if levels[-1] == '#':
+            node.multi_level.add(topic_filter)
+        else:
+            node = node.children.setdefault(levels[-1], _RouterNode())
+            node.filters.add(topic_filter)
+        self._filters.add(topic_filter)
+
+    def match(self, topic):
+        """Return the set of registered filters matching ``topic``."""
+        if not self._filters:
+            return set()
+        matched = set()
+        nodes = [self._root]
+        system_topic = topic.startswith('$')
+        for index, level in enumerate(topic.split('/')):
+            wildcards_allowed = index > 0 or not system_topic
+            next_nodes = []
+            for node in nodes:
+                if wildcards_allowed:
+                    matched.update(node.multi_level)
+                    child = node.children.get('+')
+                    if child is not None:
+                        next_nodes.append(child)
+                child = node.children.get(level)
+                if child is not None:
+                    next_nodes.append(child)
+            nodes = next_nodes
+            if not nodes:
+                return matched
+        for node in nodes:
+            matched.update(node.filters)
+            matched.update(node.multi_level)
+        return matched
+
+
+class WildcardMatch(str):
+    """The ``wildcard`` value of an MQTT event matching one or more filters.
+
+    It serializes as the first matching filter, but compares equal to every filter the
+    topic matched. AppDaemon filters event callbacks with ``kwargs[key] != data[key]``,
+    so each ``listen_event(..., wildcard=...)`` callback whose filter matched fires for
+    the same single event. No hash can agree with an equality that holds for several
+    different strings, so a match is unhashable; use ``filters`` as a set key instead.
+    """
+
+    def __new__(cls, filters):
+        ordered = sorted(filters)
+        match = super().__new__(cls, ordered[0])
+        match.filters = frozenset(ordered)
+        return match
+
+    def __eq__(self, o):
+        return o in self.filters
+
+    def __ne__(self, o):
+        return o not in self.filters
+
+    __hash__ = None
+
+    def __reduce__(self):
+        # copy and pickle would otherwise rebuild it from the plain string
+        return WildcardMatch, (sorted(self.filters),)
@@ -0,0 +1,192 @@
+import time
+
+
+class IngestCounters:
+    """Counters written only from paho's network thread."""
+
+    __slots__ = ['received', 'decode_failures', 'connects', 'publish_acks', 'untracked_publishes',
+                 'batches', 'batch_states', 'batch_wire_bytes', 'batch_raw_bytes',
+                 'batch_decode_time']
+
+    def __init__(self):
+        self.received = {}
+        self.decode_failures = 0
+        self.connects = 0
+        self.publish_acks = 0
+        self.untracked_publishes = 0
+        self.batches = 0
+        self.batch_states = 0
+        self.batch_wire_bytes = 0
+        self.batch_raw_bytes = 0
+        self.batch_decode_time = 0.0
+
+
+class LoopCounters:
+    """Counters written only from the AppDaemon event loop."""
+
+    __slots__ = ['state_applied', 'state_suppressed', 'state_deferred', 'published', 'lag_total',
+                 'lag_count', 'lag_max']
+
+    def __init__(self):
+        self.state_applied = 0
+        self.state_suppressed = 0
+        self.state_deferred = 0
+        self.published = 0
+        self.lag_total = 0.0
+        self.lag_count = 0
+        self.lag_max = 0.0
+
+
+class HassmqttMetrics:
+    """Plugin health metrics.
+
+    Every counter has exactly one writer thread, so neither side takes a lock: paho's
+    network thread only touches ``ingest`` and the event loop only touches ``loop``.
+    ``snapshot`` runs on the loop and derives rates from the difference between two
+    readings of the ingest counters.
+    """
+
+    def __init__(self):
+        self.ingest = IngestCounters()
+        self.loop = LoopCounters()
+        self._last_received = {}
+        self._last_snapshot_at = time.monotonic()
+
+    #
+    # paho thread
+    #
+
+    def message_received(self, topic):
+        root = topic.split('/', 1)[0]
+        received = self.ingest.received
+        received[root] = received.get(root, 0) + 1
+
+    def decode_failed(self):
+        self.ingest.decode_failures += 1
+
+    def connected(self):
+        self.ingest.connects += 1
+
+    def publish_acked(self):
+        self.ingest.publish_acks += 1
+
+    def publish_untracked(self):
+        self.ingest.untracked_publishes += 1
+
+    def batch_decoded(self, batch):
+        ingest = self.ingest
+        ingest.batches += 1
+        ingest.batch_states += len(batch.changes)
+        ingest.batch_wire_bytes += batch.wire_size
+        ingest.batch_raw_bytes += batch.raw_size
+        ingest.batch_decode_time += batch.decode_time
+
+    #
+    # event loop
+    #
+
+    def state_applied(self):
+        self.loop.state_applied += 1
+
+    def state_suppressed(self, count=1):
+        self.loop.state_suppressed += count
+
+    def state_deferred(self):
+        self.loop.state_deferred += 1
+
+    def published(self):
+        self.loop.published += 1
+
+    def dispatched(self, received_at):
+        lag = time.monotonic() - received_at
+        self.loop.lag_total += lag
+        self.loop.lag_count += 1
+        if lag > self.loop.lag_max:
+            self.loop.lag_max = lag
+
+    def snapshot(self):
+        """Aggregate the counters since the previous snapshot."""
+        now = time.monotonic()
+        elapsed = max(now - self._last_snapshot_at, 1e-6)
+        # dict.copy() is a single C call, so it cannot observe a half-applied insert
+        received = self.ingest.received.copy()
+        rates = {
+            root: round((count - self._last_received.get(root, 0)) / elapsed, 2)
+            for root, count in received.items()
+        }
+        loop = self.loop
+        lag_mean = loop.lag_total / loop.lag_count if loop.lag_count else 0.0
+        in_flight = (loop.published + self.ingest.untracked_publishes
+                     - self.ingest.publish_acks)
+
+        snapshot = {
+            'message_rate': round(sum(rates.values()), 2),
+            'topic_rates': rates,
+            'messages_received': sum(received.values()),
+            'decode_failures': self.ingest.decode_failures,
+            'state_applied': loop.state_applied,
+            'state_suppressed': loop.state_suppressed,
+            'state_deferred': loop.state_deferred,
+            'dispatch_lag_mean_ms': round(lag_mean * 1000, 3),
+            'dispatch_lag_max_ms': round(loop.lag_max * 1000, 3),
+            'dispatched': loop.lag_count,
+            'publish_in_flight': max(in_flight, 0),
+            'reconnects': max(self.ingest.connects - 1, 0),
+            'batches': self.ingest.batches,
+            'batch_states': self.ingest.batch_states,
+            'batch_wire_bytes': self.ingest.batch_wire_bytes,
+            'batch_raw_bytes': self.ingest.batch_raw_bytes,
+            'batch_decode_time': self.ingest.batch_decode_time,
+        }
+
+        self._last_received = received
+        self._last_snapshot_at = now
+        loop.lag_total = 0.0
+        loop.lag_count = 0
+        loop.lag_max = 0.0
+        return snapshot
+
+    def entities(self, prefix, policies=None, tombstones=0):
+        """Build ``(entity_id, state, attributes)`` tuples from a fresh snapshot.
+
+        ``policies`` maps each ingest policy filter to its counters and ``tombstones``
+        is the number of unobserved entities held lazily.
+        """
+        snapshot = self.snapshot()
+        policies = policies or {}
+        absorbed = sum(counters[key]
+                       for counters in policies.values()
+                       for key in ('unchanged', 'rate_limited', 'conflated'))
+        return [
+            ('sensor.{}_message_rate'.format(prefix), snapshot['message_rate'], {
+                'unit_of_measurement': 'msg/s',
+                'topics': snapshot['topic_rates'],
+                'messages_received': snapshot['messages_received'],
+            }),
+            ('sensor.{}_decode_failures'.format(prefix), snapshot['decode_failures'], {}),
+            ('sensor.{}_state_updates'.format(prefix), snapshot['state_applied'], {
+                'applied': snapshot['state_applied'],
+                'suppressed': snapshot['state_suppressed'],
+                'deferred': snapshot['state_deferred'],
+                'tombstones': tombstones,
+            }),
+            ('sensor.{}_dispatch_lag'.format(prefix), snapshot['dispatch_lag_mean_ms'], {
+                'unit_of_measurement': 'ms',
+                'max': snapshot['dispatch_lag_max_ms'],
+                'dispatched': snapshot['dispatched'],
+            }),
+            ('sensor.{}_publish_in_flight'.format(prefix), snapshot['publish_in_flight'], {}),
+            ('sensor.{}_reconnects'.format(prefix), snapshot['reconnects'], {}),
+            ('sensor.{}_ingest_absorbed'.format(prefix), absorbed, {'policies': policies}),
+            ('sensor.{}_state_batches'.format(prefix), snapshot['batches'], {
+                'states': snapshot['batch_states'],
+                'wire_bytes': snapshot['batch_wire_bytes'],
+                'raw_bytes': snapshot['batch_raw_bytes'],
+                'compression_ratio': round(
+                    snapshot['batch_raw_bytes'] / snapshot['batch_wire_bytes'], 2)
+                if snapshot['batch_wire_bytes'] else None,
+                'decode_us_per_state': round(
+                    snapshot['batch_decode_time'] * 1e6 / snapshot['batch_states'], 2)
+                if snapshot['batch_states'] else None,
+            }),
+        ]
@@ -2,6 +2,7 @@ import asyncio
 import copy
 import json
 import ssl
+import time
 import traceback
 
 import appdaemon.utils as utils
@@ -9,6 +10,19 @@ import paho.mqtt.client as mqtt
 from appdaemon.appdaemon import AppDaemon
 from appdaemon.plugin_management import PluginBase
 
+from hassmqttbatch import decode_state_batch, is_state_batch
+from hassmqttmatcher import TopicMatcher, TopicRouter, WildcardMatch
+from hassmqttmetrics import HassmqttMetrics
+from hassmqttpolicy import IngestPolicies
+from hassmqttrpc import (PendingRequest, PendingRequests, embed_correlation,
+                         new_correlation_id)
+
+try:
+    from paho.mqtt.packettypes import PacketTypes
+    from paho.mqtt.properties import Properties
+except ImportError:
+    PacketTypes = Properties = None
+
 
 def deep_equals(current_state, new_state):
     current = json.dumps(current_state, sort_keys=True, indent=2)
@@ -49,11 +63,15 @@ class HassmqttPlugin(PluginBase):
         mqtt_client_id = self.config.get('client_id', None)
         mqtt_transport = self.config.get('client_transport', 'tcp')
         mqtt_session = self.config.get('client_clean_session', True)
+        self.mqtt_v5 = str(self.config.get('client_protocol', '3.1.1')) == '5' \
+            and Properties is not None
         self.mqtt_client_topics = self.config.get('client_topics', ['#'])
         self.mqtt_client_user = self.config.get('client_user', None)
         self.mqtt_client_password = self.config.get('client_password', None)
         self.mqtt_event_name = self.config.get('event_name', 'MQTT_MESSAGE')
         self.mqtt_client_force_start = self.config.get('force_start', False)
+        self.metrics_interval = self.config.get('metrics_interval', 10)
+        self.lazy_states = self.config.get('lazy_unobserved_states', False)
 
         status_topic = '{}/status'.format(
             self.config.get('client_id', self.name + '-client').lower())
@@ -103,15 +121,37 @@ class HassmqttPlugin(PluginBase):
             mqtt_client_id = 'appdaemon_{}_client'.format(self.name.lower())
             self.logger.info("Using %s as Client ID", mqtt_client_id)
 
-        self.mqtt_client = mqtt.Client(client_id=mqtt_client_id, clean_session=mqtt_session,
-                                       transport=mqtt_transport)
+        if self.mqtt_v5:
+            # MQTT 5 replaces clean_session with clean_start, set when connecting
+            self.mqtt_clean_start = mqtt_session
+            self.mqtt_client = mqtt.Client(client_id=mqtt_client_id, transport=mqtt_transport,
+                                           protocol=mqtt.MQTTv5)
+        else:
+            self.mqtt_client = mqtt.Client(client_id=mqtt_client_id, clean_session=mqtt_session,
+                                           transport=mqtt_transport)
         self.mqtt_client.on_connect = self.mqtt_on_connect
         self.mqtt_client.on_disconnect = self.mqtt_on_disconnect
         self.mqtt_client.on_message = self.mqtt_on_message
+        self.mqtt_client.on_publish = self.mqtt_on_publish
 
         self.loop = self.AD.loop  # get AD loop
+        self.metrics = HassmqttMetrics()
+        self.metrics_prefix = self.name.lower()
+        self.metrics_published_at = time.monotonic()
+        self.ingest_policies = IngestPolicies(self.loop, self.config.get('ingest_policies', []),
+                                              self.dispatch_message, self.message_absorbed,
+                                              self.logger)
+        self.batch_attributes = {}
+        self.tombstones = {}
+        self.declared_interest = set()
+        self.observed_interest = set()
+        self.observed_entities = set()
+        self.observed_domains = set()
+        self.observe_all = not self.lazy_states
+        self.paced_publishes = set()
+        self.pending_requests = PendingRequests()
         self.mqtt_connect_event = asyncio.Event()
-        self.mqtt_wildcards = list()
+        self.mqtt_wildcards = TopicRouter()
         self.mqtt_metadata = {
             "version": "1.0",
             "host": self.mqtt_client_host,
@@ -119,6 +159,7 @@ class HassmqttPlugin(PluginBase):
             "client_id": mqtt_client_id,
             "transport": mqtt_transport,
             "clean_session": mqtt_session,
+            "protocol": "5" if self.mqtt_v5 else "3.1.1",
             "qos": self.mqtt_qos,
             "topics": self.mqtt_client_topics,
             "username": self.mqtt_client_user,
@@ -138,7 +179,10 @@ class HassmqttPlugin(PluginBase):
             "verify_cert": self.mqtt_verify_cert,
             "tls_version": self.mqtt_tls_version,
             "timeout": self.mqtt_client_timeout,
-            "force_state": self.mqtt_client_force_start
+            "force_state": self.mqtt_client_force_start,
+            "metrics_interval": self.metrics_interval,
+            "ingest_policies": self.config.get('ingest_policies', []),
+            "lazy_unobserved_states": self.lazy_states
         }
 
     def stop(self):
@@ -158,12 +202,18 @@ class HassmqttPlugin(PluginBase):
             self.mqtt_client.disconnect()  # disconnect cleanly
 
         self.mqtt_client.loop_stop()
+        self.ingest_policies.cancel()
+        for task in self.paced_publishes:
+            task.cancel()
+        self.pending_requests.cancel()
 
-    def mqtt_on_connect(self, client, userdata, flags, rc):
+    def mqtt_on_connect(self, client, userdata, flags, rc, properties=None):
         try:
             err_msg = ""
             # means connection was successful
             if rc == 0:
+                self.metrics.connected()
+                self.metrics.publish_untracked()
                 self.mqtt_client.publish(self.mqtt_on_connect_topic, self.mqtt_on_connect_payload,
                                          self.mqtt_qos, retain=self.mqtt_on_connect_retain)
 
@@ -178,6 +228,8 @@ class HassmqttPlugin(PluginBase):
                                                   self.call_plugin_service)
                 self.AD.services.register_service(self.namespace, "mqtt", "publish",
                                                   self.call_plugin_service)
+                self.AD.services.register_service(self.namespace, "mqtt", "publish_many",
+                                                  self.call_plugin_service)
 
                 for topic in self.mqtt_client_topics:
                     self.logger.debug("Subscribing to Topic: %s", topic)
@@ -222,7 +274,7 @@ class HassmqttPlugin(PluginBase):
                 'There was an error while trying to setup the MQTT Service, with Traceback: %s',
                 traceback.format_exc())
 
-    def mqtt_on_disconnect(self, client, userdata, rc):
+    def mqtt_on_disconnect(self, client, userdata, rc, properties=None):
         try:
             # unexpected disconnection
             if rc != 0 and not self.stopping:
@@ -242,18 +294,98 @@ class HassmqttPlugin(PluginBase):
                 'There was an error while disconnecting from the MQTT Service, with Traceback: %s',
                 traceback.format_exc())
 
+    def mqtt_on_publish(self, client, userdata, mid):
+        self.metrics.publish_acked()
+
     def mqtt_on_message(self, client, userdata, msg):
+        received_at = time.monotonic()
         try:
             self.logger.debug("Message Received: Topic = %s, Payload = %s", msg.topic, msg.payload)
             topic = msg.topic
-            try:
-                payload_dict = json.loads(msg.payload.decode())
-            except TypeError as err:
-                self.logger.critical("Payload is not JSON")
+            self.metrics.message_received(topic)
+            if is_state_batch(msg.payload):
+                batch = decode_state_batch(msg.payload, self.logger)
+                if batch is None:
+                    self.metrics.decode_failed()
+                    self.logger.debug("Dropped state batch on %s", topic)
+                    return
+                self.metrics.batch_decoded(batch)
+                self.loop.call_soon_threadsafe(self.ingest_batch, batch.changes)
                 return
 
-            self.logger.debug("GOT  %s" % msg.payload.decode())
+            correlation_id = None
+            properties = getattr(msg, 'properties', None)
+            if properties is not None and hasattr(properties, 'CorrelationData'):
+                correlation_id = properties.CorrelationData.decode()
+
+            payload = msg.payload.decode()
+            try:
+                payload_dict = json.loads(payload)
+            except ValueError:
+                payload_dict = None
+            if not isinstance(payload_dict, dict):
+                # Plain payloads carry no event type, deliver them as raw MQTT messages
+                payload_dict = {}
+
+            self.logger.debug("GOT  %s" % payload)
+
+            # Everything past decoding runs on the loop, so ingest state needs no locking
+            self.loop.call_soon_threadsafe(self.ingest_message, topic, payload, payload_dict,
+                                           received_at, correlation_id, bool(msg.retain))
+        except UnicodeDecodeError:
+            self.metrics.decode_failed()
+            self.logger.info("Unable to decode MQTT message")
+            self.logger.debug('Unable to decode MQTT message, with Traceback: %s',
+                              traceback.format_exc())
+        except Exception as e:
+            self.logger.critical(
+                "There was an error while processing an MQTT message: {} {}".format(type(e), e))
+            self.logger.debug(
+                'There was an error while processing an MQTT message, with Traceback: %s',
+                traceback.format_exc())
 
+    def ingest_message(self, topic, payload, payload_dict, received_at, correlation_id=None,
+                       retained=False):
+        if len(self.pending_requests) > 0:
+            # Replies still reach regular listeners below
+            self.pending_requests.resolve(
+                topic,
+                correlation_id or payload_dict.get('correlation_id', None),
+                {'topic': topic, 'payload': payload},
+                retained=retained)
+
+        message = (topic, payload, payload_dict, received_at)
+        if self.ingest_policies:
+            message = self.ingest_policies.offer(topic, payload, message)
+            if message is None:
+                return
+        self.dispatch_message(*message)
+
+    def ingest_batch(self, changes):
+        # Batches are not subject to ingest policies, one message carries many entities.
+        # Deltas resolve against the attributes of a write still pending, then against
+        # the entity's tombstone or its namespace state. Pending writes are only
+        # remembered until apply_state has stored them.
+        current = self.state.state.get(self.namespace, {})
+        for change in changes:
+            entity_id = change.entity_id
+            base = self.batch_attributes.get(entity_id)
+            if base is None and entity_id in self.tombstones:
+                base = self.tombstones[entity_id][1]
+            if base is None:
+                base = current.get(entity_id, {}).get("attributes", None)
+            attributes = change.resolve(base)
+            self.store_state(entity_id, change.state, attributes)
+            if entity_id not in self.tombstones:
+                self.batch_attributes[entity_id] = attributes
+
+    def message_absorbed(self, message):
+        _, _, payload_dict, _ = message
+        if payload_dict.get("event_type", None) == "state_changed":
+            self.metrics.state_suppressed()
+
+    def dispatch_message(self, topic, payload, payload_dict, received_at):
+        try:
             event_type = payload_dict.get("event_type", None)
             if event_type == "state_changed":
                 try:
@@ -263,63 +395,37 @@ class HassmqttPlugin(PluginBase):
                     if entity_id is not None:
                         state = new_state.get("state", None)
                         attributes = new_state.get("attributes", None)
-                        self.loop.create_task(self.state.set_state(
-                            self.name,
-                            self.namespace,
-                            entity_id,
-                            state=state,
-                            attributes=attributes,
-                            replace=True
-                        ))
+                        self.store_state(entity_id, state, attributes)
+                    else:
+                        self.metrics.state_suppressed()
                 except Exception as err:
                     self.logger.error(str(err))
 
                 return
 
-            if self.mqtt_wildcards != [] and list(filter(lambda x: x in topic,
-                                                         self.mqtt_wildcards)) != []:  # check if any of the wildcards belong
-                wildcard = list(filter(lambda x: topic.startswith(x), self.mqtt_wildcards))[0] + '#'
-                if event_type:
-                    data = {
-                        'event_type': event_type,
-                        'data': payload_dict.get('data', {}),
-                        'topic': msg.topic,
-                        'wildcard': wildcard
-
-                    }
-                else:
-                    data = {
-                        'event_type': self.mqtt_event_name,
-                        'data': {
-                            'topic': topic,
-                            'payload': msg.payload.decode(),
-                            'wildcard': wildcard
-                        }
-                    }
-
+            wildcard = None
+            matched = self.mqtt_wildcards.match(topic)  # check if any of the wildcards belong
+            if matched:
+                wildcard = WildcardMatch(matched)
+
+            if event_type:
+                data = {
+                    'event_type': event_type,
+                    'data': payload_dict.get('data', {}),
+                    'topic': topic,
+                    'wildcard': wildcard
+                }
             else:
-                if event_type:
-                    data = {
-                        'event_type': event_type,
-                        'data': payload_dict.get('data', {}),
-                        'topic': msg.topic,
-                        'wildcard': None
-                    }
-                else:
-                    data = {
-                        'event_type': self.mqtt_event_name,
-                        'data': {
-                            'topic': topic,
-                            'payload': msg.payload.decode(),
-                            'wildcard': None
-                        }
+                data = {
+                    'event_type': self.mqtt_event_name,
+                    'data': {
+                        'topic': topic,
+                        'payload': payload,
+                        'wildcard': wildcard
                     }
+                }
 
-            self.loop.create_task(self.send_ad_event(data))
-        except UnicodeDecodeError:
-            self.logger.info("Unable to decode MQTT message")
-            self.logger.debug('Unable to decode MQTT message, with Traceback: %s',
-                              traceback.format_exc())
+            self.loop.create_task(self.send_ad_event(data, received_at))
         except Exception as e:
             self.logger.critical(
                 "There was an error while processing an MQTT message: {} {}".format(type(e), e))
@@ -330,6 +436,9 @@ class HassmqttPlugin(PluginBase):
     async def call_plugin_service(self, namespace, domain, service, kwargs):
 
         result = None
+        if service == 'publish_many':
+            return await self.publish_many(kwargs.get('messages', []), kwargs.get('rate', None))
+
         if 'topic' in kwargs:
             if not self.mqtt_connected:  # ensure mqtt plugin is connected
                 self.logger.debug("Attempt to call Mqtt Service while disconnected: %s", service)
@@ -347,6 +456,7 @@ class HassmqttPlugin(PluginBase):
                                                          payload, qos, retain)
 
                     if result[0] == 0:
+                        self.metrics.published()
                         self.logger.debug("Publishing Payload %s to Topic %s Successful", payload,
                                           topic)
                     else:
@@ -402,16 +512,222 @@ class HassmqttPlugin(PluginBase):
 
         return result
 
+    #
+    # Bulk publishing
+    #
+
+    def normalize_message(self, message):
+        topic, payload, qos, retain = (list(message) + [None, None, None])[:4]
+        return (topic,
+                payload,
+                int(qos if qos is not None else self.mqtt_qos),
+                bool(retain))
+
+    def publish_messages(self, messages):
+        """Hand every message to paho in one executor call."""
+        return [self.mqtt_client.publish(topic, payload, qos, retain)[0]
+                for topic, payload, qos, retain in messages]
+
+    def record_publish_results(self, messages, results):
+        for (topic, payload, _, _), rc in zip(messages, results):
+            if rc == 0:
+                self.metrics.published()
+            else:
+                self.logger.warning("Publishing Payload %s to Topic %s was not Successful",
+                                    payload, topic)
+
+    async def publish_many(self, messages, rate=None):
+        """Publish ``(topic, payload, qos, retain)`` messages, optionally paced.
+
+        Without ``rate`` every message is enqueued to the client at once and the list of
+        result codes is returned. With ``rate`` (messages per second) a plugin task paces
+        the messages and the number of queued messages is returned straight away.
+        """
+        if not self.mqtt_connected:
+            self.logger.debug("Attempt to call Mqtt Service while disconnected: publish_many")
+            return None
+
+        messages = [self.normalize_message(message) for message in messages]
+        if not messages:
+            return []
+
+        if not rate:
+            results = await utils.run_in_executor(self, self.publish_messages, messages)
+            self.record_publish_results(messages, results)
+            return results
+
+        task = self.loop.create_task(self.publish_paced(messages, float(rate)))
+        self.paced_publishes.add(task)
+        task.add_done_callback(self.paced_publishes.discard)
+        return len(messages)
+
+    async def publish_paced(self, messages, rate):
+        interval = 1.0 / rate
+        next_at = self.loop.time()
+        for message in messages:
+            if self.stopping:
+                return
+            delay = next_at - self.loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            next_at = max(next_at, self.loop.time()) + interval
+            results = await utils.run_in_executor(self, self.publish_messages, [message])
+            self.record_publish_results([message], results)
+
+    #
+    # Request/response
+    #
+
+    async def ensure_subscribed(self, topic_filter, qos):
+        for topic in self.mqtt_client_topics:
+            if TopicMatcher(topic).covers(topic_filter):
+                return
+        result = await utils.run_in_executor(self, self.mqtt_client.subscribe, topic_filter, qos)
+        if result[0] == 0:
+            self.mqtt_client_topics.append(topic_filter)
+        else:
+            self.logger.warning("Subscription to Topic %s was not Successful", topic_filter)
+
+    async def request(self, topic, payload, response_topic, timeout, qos=None):
+        """Publish a request and wait for its reply on ``response_topic``.
+
+        With MQTT 5 the correlation ID and response topic travel as publish properties,
+        otherwise they are embedded in JSON object payloads. Raises
+        ``asyncio.TimeoutError`` if no reply arrives within ``timeout`` seconds.
+        """
+        if not self.mqtt_connected:
+            self.logger.debug("Attempt to call Mqtt Service while disconnected: request")
+            return None
+
+        qos = int(qos if qos is not None else self.mqtt_qos)
+        correlation_id = new_correlation_id()
+        await self.ensure_subscribed(response_topic, qos)
+
+        if payload is not None and not isinstance(payload, (str, bytes, bytearray)):
+            # paho only publishes strings and bytes
+            payload = json.dumps(payload)
+
+        properties = None
+        correlated = True
+        if self.mqtt_v5:
+            properties = Properties(PacketTypes.PUBLISH)
+            properties.ResponseTopic = response_topic
+            properties.CorrelationData = correlation_id.encode()
+        else:
+            embedded = embed_correlation(payload, correlation_id, response_topic)
+            correlated = embedded is not payload
+            payload = embedded
+
+        pending = PendingRequest(correlation_id, response_topic, self.loop.create_future(),
+                                 correlated=correlated)
+        self.pending_requests.add(pending)
+
+        try:
+            result = await utils.run_in_executor(self, self.mqtt_client.publish, topic, payload,
+                                                 qos, False, properties)
+            if result[0] != 0:
+                self.logger.warning("Publishing Payload %s to Topic %s was not Successful",
+                                    payload, topic)
+                return None
+            self.metrics.published()
+            return await asyncio.wait_for(pending.future, timeout)
+        finally:
+            self.pending_requests.discard(pending)
+
     async def process_mqtt_wildcard(self, wildcard):
-        if wildcard.rstrip('#') not in self.mqtt_wildcards:
-            self.mqtt_wildcards.append(wildcard.rstrip('#'))
+        self.mqtt_wildcards.add(wildcard)
 
     async def mqtt_client_state(self):
         return self.mqtt_connected
 
-    async def send_ad_event(self, data):
+    async def send_ad_event(self, data, received_at=None):
+        if received_at is not None:
+            self.metrics.dispatched(received_at)
         await self.AD.events.process_event(self.namespace, data)
 
+    #
+    # Lazy states for entities no app observes
+    #
+
+    def is_observed(self, entity_id):
+        return (self.observe_all
+                or entity_id in self.observed_entities
+                or entity_id.partition('.')[0] in self.observed_domains)
+
+    def store_state(self, entity_id, state, attributes):
+        """Write a mirrored state, or keep it as a tombstone if nothing observes it.
+
+        Entities already present in the namespace keep being written so they never go
+        stale, tombstones only hold entities that were never materialized.
+        """
+        # Whatever a pending batch write held is superseded by this state
+        self.batch_attributes.pop(entity_id, None)
+        if self.is_observed(entity_id) or entity_id in self.state.state.get(self.namespace, {}):
+            self.tombstones.pop(entity_id, None)
+            self.loop.create_task(self.apply_state(entity_id, state, attributes))
+            return
+
+        self.tombstones[entity_id] = (state, attributes)
+        self.metrics.state_deferred()
+
+    async def materialize(self, entity_id=None):
+        """Apply the tombstones matching an entity, a domain or, if None, every entity."""
+        if not self.tombstones:
+            return
+        if entity_id is None:
+            entities = list(self.tombstones)
+        elif '.' in entity_id:
+            entities = [entity_id] if entity_id in self.tombstones else []
+        else:
+            prefix = entity_id + '.'
+            entities = [entity for entity in self.tombstones if entity.startswith(prefix)]
+
+        for entity in entities:
+            state, attributes = self.tombstones.pop(entity)
+            await self.apply_state(entity, state, attributes)
+
+    async def declare_interest(self, entities):
+        """Mark entities or domains as read by an app, materializing them right away."""
+        for entity in entities:
+            self.declared_interest.add(entity)
+            await self.materialize(entity)
+        self.refresh_interest()
+
+    def refresh_interest(self):
+        interest = set(self.declared_interest)
+        with self.AD.callbacks.callbacks_lock:
+            for callbacks in self.AD.callbacks.callbacks.values():
+                for callback in callbacks.values():
+                    if callback.get("type") == "state" \
+                            and callback.get("namespace") in (self.namespace, "global"):
+                        interest.add(callback.get("entity"))
+
+        if interest == self.observed_interest:
+            return
+        self.observed_interest = interest
+        self.observe_all = None in interest
+        self.observed_entities = {entity for entity in interest
+                                  if entity is not None and '.' in entity}
+        self.observed_domains = {entity for entity in interest
+                                 if entity is not None and '.' not in entity}
+
+        for entity in [entity for entity in self.tombstones if self.is_observed(entity)]:
+            state, attributes = self.tombstones.pop(entity)
+            self.loop.create_task(self.apply_state(entity, state, attributes))
+
+    async def apply_state(self, entity_id, state, attributes):
+        self.metrics.state_applied()
+        await self.state.set_state(
+            self.name,
+            self.namespace,
+            entity_id,
+            state=state,
+            attributes=attributes,
+            replace=True
+        )
+        if self.batch_attributes.get(entity_id) is attributes:
+            del self.batch_attributes[entity_id]
+
     #
     # Get initial state
     #
@@ -430,8 +746,27 @@ class HassmqttPlugin(PluginBase):
     #
 
     def utility(self):
-        # self.logger.info("utility".format(self.state)
-        return
+        if self.lazy_states:
+            self.refresh_interest()
+
+        if not self.metrics_interval or not self.initialized:
+            return
+
+        now = time.monotonic()
+        if now - self.metrics_published_at < self.metrics_interval:
+            return
+        self.metrics_published_at = now
+
+        for entity_id, state, attributes in self.metrics.entities(
+                self.metrics_prefix, self.ingest_policies.counters(), len(self.tombstones)):
+            self.loop.create_task(self.state.set_state(
+                self.name,
+                self.namespace,
+                entity_id,
+                state=state,
+                attributes=attributes,
+                replace=True
+            ))
 
     #
     # Handle state updates
@@ -535,8 +870,13 @@ class HassmqttPlugin(PluginBase):
                 self.mqtt_client.will_set(self.mqtt_will_topic, self.mqtt_will_payload,
                                           self.mqtt_qos, retain=self.mqtt_will_retain)
 
-            self.mqtt_client.connect_async(self.mqtt_client_host, self.mqtt_client_port,
-                                           self.mqtt_client_timeout)
+            if self.mqtt_v5:
+                self.mqtt_client.connect_async(self.mqtt_client_host, self.mqtt_client_port,
+                                               self.mqtt_client_timeout,
+                                               clean_start=self.mqtt_clean_start)
+            else:
+                self.mqtt_client.connect_async(self.mqtt_client_host, self.mqtt_client_port,
+                                               self.mqtt_client_timeout)
             self.mqtt_client.loop_start()
         except Exception as e:
             self.logger.critical(
@@ -0,0 +1,148 @@
+import time
+
+from hassmqttmatcher import TopicMatcher
+
+
+class IngestPolicy:
+    """Rate limiting and sampling rules for the topics matching one filter.
+
+    Three mechanisms can be combined in one policy and are applied in this order:
+
+      - ``drop_unchanged``: drop a message whose payload equals the last payload
+        forwarded, or waiting to be forwarded, on the same topic.
+      - ``rate_limit``/``burst``: token bucket refilled at ``rate_limit`` messages per
+        second, holding at most ``burst`` tokens.
+      - ``conflate``: forward at most one message per topic every ``conflate`` seconds,
+        keeping only the latest message received in between.
+
+    State is tracked per concrete topic, so ``monitor/+/+/rssi`` limits every device
+    and location independently.
+    """
+
+    def __init__(self, config):
+        self.matcher = TopicMatcher(config['topic'])
+        self.drop_unchanged = bool(config.get('drop_unchanged', False))
+        self.rate_limit = float(config['rate_limit']) if config.get('rate_limit') else None
+        self.burst = float(config.get('burst', max(1.0, self.rate_limit or 1.0)))
+        self.conflate = float(config['conflate']) if config.get('conflate') else None
+        self.topics = {}
+        self.counters = {
+            'passed': 0,
+            'unchanged': 0,
+            'rate_limited': 0,
+            'conflated': 0,
+        }
+
+    @property
+    def topic_filter(self):
+        return self.matcher.topic_filter
+
+
+class TopicState:
+    """Per-topic state of a policy."""
+
+    __slots__ = ['last_payload', 'tokens', 'refilled_at', 'forwarded_at', 'pending', 'flush_handle']
+
+    def __init__(self, burst):
+        self.last_payload = None
+        self.tokens = burst
+        self.refilled_at = time.monotonic()
+        self.forwarded_at = None
+        self.pending = None
+        self.flush_handle = None
+
+
+class IngestPolicies:
+    """Applies the configured ingest policies before a message is dispatched.
+
+    Runs on the event loop only. ``offer`` returns the message when it may be
+    dispatched immediately and ``None`` otherwise. Conflated messages are handed to
+    ``dispatch`` once their interval ends, and every message that will never be
+    dispatched is passed to ``absorbed``.
+    """
+
+    def __init__(self, loop, configs, dispatch, absorbed, logger):
+        self.loop = loop
+        self.dispatch = dispatch
+        self.absorbed = absorbed
+        self.policies = []
+        for config in configs or []:
+            try:
+                self.policies.append(IngestPolicy(config))
+            except (KeyError, TypeError, ValueError) as err:
+                logger.warning("Ignoring invalid ingest policy %s: %s", config, err)
+
+    def __bool__(self):
+        return len(self.policies) > 0
+
+    def find(self, topic):
+        for policy in self.policies:
+            if policy.matcher.matches(topic):
+                return policy
+        return None
+
+    def offer(self, topic, payload, message):
+        policy = self.find(topic)
+        if policy is None:
+            return message
+
+        state = policy.topics.get(topic)
+        if state is None:
+            state = policy.topics[topic] = TopicState(policy.burst)
+
+        if policy.drop_unchanged:
+            # Compared with what downstream will see next, a change that was throttled
+            # or replaced while conflated has not been forwarded
+            latest = state.pending[1] if state.pending is not None else state.last_payload
+            if latest == payload:
+                policy.counters['unchanged'] += 1
+                self.absorbed(message)
+                return None
+
+        now = time.monotonic()
+        if policy.rate_limit is not None:
+            state.tokens = min(policy.burst,
+                               state.tokens + (now - state.refilled_at) * policy.rate_limit)
+            state.refilled_at = now
+            if state.tokens < 1.0:
+                policy.counters['rate_limited'] += 1
+                self.absorbed(message)
+                return None
+            state.tokens -= 1.0
+
+        if policy.conflate is not None:
+            if state.forwarded_at is not None and now - state.forwarded_at < policy.conflate:
+                if state.pending is not None:
+                    policy.counters['conflated'] += 1
+                    self.absorbed(state.pending)
+                state.pending = message
+                if state.flush_handle is None:
+                    state.flush_handle = self.loop.call_later(
+                        policy.conflate - (now - state.forwarded_at), self._flush, policy, state)
+                return None
+            state.forwarded_at = now
+
+        state.last_payload = payload
+        policy.counters['passed'] += 1
+        return message
+
+    def _flush(self, policy, state):
+        state.flush_handle = None
+        message = state.pending
+        if message is None:
+            return
+        state.pending = None
+        state.forwarded_at = time.monotonic()
+        state.last_payload = message[1]
+        policy.counters['passed'] += 1
+        self.dispatch(*message)
+
+    def cancel(self):
+        for policy in self.policies:
+            for state in policy.topics.values():
+                if state.flush_handle is not None:
+                    state.flush_handle.cancel()
+                    state.flush_handle = None
+
+    def counters(self):
+        return {policy.topic_filter: dict(policy.counters) for policy in self.policies}
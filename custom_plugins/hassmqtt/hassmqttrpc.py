@@ -0,0 +1,108 @@
+import json
+import uuid
+
+from hassmqttmatcher import TopicRouter
+
+ATTR_CORRELATION_ID = 'correlation_id'
+ATTR_RESPONSE_TOPIC = 'response_topic'
+
+
+def new_correlation_id():
+    return uuid.uuid4().hex
+
+
+def embed_correlation(payload, correlation_id, response_topic):
+    """Embed the correlation fields in a JSON object payload.
+
+    Returns the payload unchanged when it is not a JSON object, those requests can only
+    be matched to the next reply on their response topic.
+    """
+    if isinstance(payload, dict):
+        document = dict(payload)
+    else:
+        try:
+            document = json.loads(payload) if payload else None
+        except (TypeError, ValueError):
+            document = None
+        if not isinstance(document, dict):
+            return payload
+    document[ATTR_CORRELATION_ID] = correlation_id
+    document[ATTR_RESPONSE_TOPIC] = response_topic
+    return json.dumps(document)
+
+
+class PendingRequest:
+    """A request waiting for its reply.
+
+    ``correlated`` is ``True`` when the correlation ID was actually sent, as MQTT 5
+    properties or embedded in the payload; its reply must then carry it back.
+    """
+
+    __slots__ = ['correlation_id', 'response_topic', 'future', 'correlated']
+
+    def __init__(self, correlation_id, response_topic, future, correlated=True):
+        self.correlation_id = correlation_id
+        self.response_topic = response_topic
+        self.future = future
+        self.correlated = correlated
+
+
+class PendingRequests:
+    """Requests waiting for a reply, indexed by response topic filter.
+
+    Runs on the event loop only. A reply carrying a correlation ID resolves the request
+    with that ID; a reply without one resolves the oldest request on its topic that was
+    sent without an ID. Retained messages are never replies, the broker replays them to
+    every new subscriber.
+    """
+
+    def __init__(self):
+        self._router = TopicRouter()
+        self._by_topic = {}
+        self._by_id = {}
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def add(self, request):
+        if request.response_topic not in self._router:
+            self._router.add(request.response_topic)
+        self._by_topic.setdefault(request.response_topic, []).append(request)
+        self._by_id[request.correlation_id] = request
+
+    def discard(self, request):
+        self._by_id.pop(request.correlation_id, None)
+        waiting = self._by_topic.get(request.response_topic, [])
+        if request in waiting:
+            waiting.remove(request)
+
+    def resolve(self, topic, correlation_id, reply, retained=False):
+        """Resolve the request a reply belongs to, returning ``True`` if one matched."""
+        if not self._by_id or retained:
+            return False
+
+        if correlation_id is not None:
+            request = self._by_id.get(correlation_id)
+            # The request itself carries the ID too, only accept it on the response topic
+            if request is None or request.response_topic not in self._router.match(topic):
+                return False
+        else:
+            waiting = [request
+                       for response_topic in self._router.match(topic)
+                       for request in self._by_topic.get(response_topic, [])
+                       if not request.correlated]
+            if not waiting:
+                return False
+            request = waiting[0]
+
+        self.discard(request)
+        if not request.future.done():
+            request.future.set_result(reply)
+        return True
+
+    def cancel(self):
+        for request in list(self._by_id.values()):
+            if not request.future.done():
+                request.future.cancel()
+        self._by_id = {}
+        self._by_topic = {}
@@ -0,0 +1,19 @@
+import importlib
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Apps import each other the way AppDaemon loads them, from the apps directory
+sys.path.insert(0, os.path.join(ROOT, 'apps'))
+sys.path.insert(0, os.path.join(ROOT, 'custom_plugins', 'hassmqtt'))
+
+# AppDaemon puts its package directory on the path for the apps' `import adbase`, here
+# that would shadow the standard threading and logging modules with AppDaemon's own
+try:
+    sys.modules['adbase'] = importlib.import_module('appdaemon.adbase')
+except ImportError:
+    # The classes under test never call into AppDaemon, the apps only subclass ADBase
+    adbase = types.ModuleType('adbase')
+    adbase.ADBase = type('ADBase', (), {})
+    sys.modules['adbase'] = adbase
@@ -0,0 +1,61 @@
+"""SlidingWindow and its skiplist against recomputing from a plain sorted list."""
+import random
+import statistics
+
+import pytest
+
+from common.aggregation import IndexableSkiplist, SlidingWindow
+
+
+def test_skiplist_matches_a_sorted_list():
+    rng = random.Random(1)
+    skiplist = IndexableSkiplist(expected_size=64)
+    expected = []
+    for _ in range(5000):
+        if expected and rng.random() < 0.45:
+            value = rng.choice(expected)
+            expected.remove(value)
+            skiplist.remove(value)
+        else:
+            # few distinct values, so duplicates are common
+            value = rng.randint(0, 50) / 2
+            expected.append(value)
+            expected.sort()
+            skiplist.insert(value)
+        assert len(skiplist) == len(expected)
+    assert list(skiplist) == expected
+    assert [skiplist[index] for index in range(len(expected))] == expected
+    assert skiplist[-1] == expected[-1]
+    for value in (-1, 0, 10.5, 12.25, 100):
+        assert skiplist.bisect_left(value) == sum(1 for item in expected if item < value)
+
+
+def test_skiplist_rejects_missing_values_and_indexes():
+    skiplist = IndexableSkiplist()
+    skiplist.insert(1.0)
+    with pytest.raises(ValueError):
+        skiplist.remove(2.0)
+    with pytest.raises(IndexError):
+        skiplist[1]
+
+
+def test_window_order_statistics_match_recomputing():
+    rng = random.Random(2)
+    window = SlidingWindow(60, max_samples=100)
+    for second in range(1000):
+        window.add(second, rng.gauss(20, 3))
+        values = sorted(sample[1] for sample in window._samples)
+        assert window.median == pytest.approx(statistics.median(values))
+        assert window.minimum == values[0]
+        assert window.maximum == values[-1]
+        deviations = [abs(value - statistics.median(values)) for value in values]
+        assert window.mad == pytest.approx(statistics.median(deviations))
+
+
+@pytest.mark.parametrize('value', [float('nan'), float('inf'), float('-inf')])
+def test_window_rejects_non_finite_values(value):
+    window = SlidingWindow(60)
+    window.add(0, 1.0)
+    with pytest.raises(ValueError):
+        window.add(1, value)
+    assert len(window) == 1
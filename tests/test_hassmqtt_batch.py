@@ -0,0 +1,58 @@
+"""State batches, from common.state_batch's encoder to the plugin's decoder."""
+import json
+import logging
+import zlib
+
+import pytest
+
+from common.state_batch import CODEC_ZSTD, StateBatchEncoder
+from hassmqttbatch import BATCH_MARKER, decode_state_batch
+
+LOGGER = logging.getLogger(__name__)
+
+
+def batch(body, codec=b'z'):
+    return BATCH_MARKER + codec + body
+
+
+def test_decodes_keyframes_and_deltas():
+    encoder = StateBatchEncoder('monitor')
+    encoder.add('sensor.kitchen', {'state': '21', 'attributes': {'unit': 'C', 'battery': 90}})
+    first = decode_state_batch(encoder.encode(), LOGGER)
+    encoder.add('sensor.kitchen', {'state': '22', 'attributes': {'unit': 'C'}})
+    second = decode_state_batch(encoder.encode(), LOGGER)
+
+    [keyframe] = first.changes
+    [delta] = second.changes
+    assert keyframe.resolve(None) == {'unit': 'C', 'battery': 90}
+    assert delta.state == '22'
+    assert delta.resolve(keyframe.resolve(None)) == {'unit': 'C'}
+
+
+@pytest.mark.parametrize('payload', [
+    batch(b'not zlib'),
+    batch(zlib.compress(b'{"states": [')),
+    batch(zlib.compress(b'\xff\xfe')),
+    batch(zlib.compress(b'[1, 2]')),
+    batch(zlib.compress(b'{"states": 5}')),
+    batch(b'', codec=b'x'),
+])
+def test_malformed_batches_are_logged_and_dropped(payload, caplog):
+    with caplog.at_level(logging.INFO):
+        assert decode_state_batch(payload, LOGGER) is None
+    assert 'Unable to decode state batch' in caplog.text
+
+
+def test_malformed_zstd_batch_is_dropped():
+    pytest.importorskip('zstandard')
+    assert decode_state_batch(batch(b'not zstd', codec=b's'), LOGGER) is None
+    encoder = StateBatchEncoder('monitor', codec=CODEC_ZSTD)
+    encoder.add('sensor.kitchen', {'state': '21', 'attributes': {}})
+    assert len(decode_state_batch(encoder.encode(), LOGGER).changes) == 1
+
+
+def test_items_that_are_not_objects_are_skipped():
+    document = {'states': ['sensor.kitchen', {'entity_id': 'sensor.attic', 'state': '30'}]}
+    decoded = decode_state_batch(batch(zlib.compress(json.dumps(document).encode())), LOGGER)
+    assert [change.entity_id for change in decoded.changes] == ['sensor.attic']
+
@@ -0,0 +1,177 @@
+"""Lazily mirrored states: tombstones for unobserved entities and their materialization."""
+import asyncio
+import logging
+import threading
+import types
+
+import pytest
+
+pytest.importorskip('appdaemon')
+pytest.importorskip('paho.mqtt.client')
+
+from common.state_batch import StateBatchEncoder  # noqa: E402
+from hassmqttbatch import decode_state_batch  # noqa: E402
+from hassmqttmetrics import HassmqttMetrics  # noqa: E402
+from hassmqttplugin import HassmqttPlugin  # noqa: E402
+
+NAMESPACE = 'hass'
+
+
+class StandInState:
+    """AppDaemon's state store, reduced to the namespace dict and ``set_state``."""
+
+    def __init__(self):
+        self.state = {NAMESPACE: {}}
+
+    async def set_state(self, name, namespace, entity_id, state=None, attributes=None,
+                        replace=False):
+        self.state[namespace][entity_id] = {'state': state, 'attributes': attributes}
+
+
+def make_plugin(loop):
+    plugin = HassmqttPlugin.__new__(HassmqttPlugin)
+    plugin.AD = types.SimpleNamespace(
+        loop=loop,
+        callbacks=types.SimpleNamespace(callbacks_lock=threading.Lock(), callbacks={}))
+    plugin.loop = loop
+    plugin.logger = logging.getLogger(__name__)
+    plugin.metrics = HassmqttMetrics()
+    plugin.name = 'HASSMQTT'
+    plugin.namespace = NAMESPACE
+    plugin.state = StandInState()
+    plugin.lazy_states = True
+    plugin.tombstones = {}
+    plugin.batch_attributes = {}
+    plugin.declared_interest = set()
+    plugin.observed_interest = set()
+    plugin.observed_entities = set()
+    plugin.observed_domains = set()
+    plugin.observe_all = False
+    return plugin
+
+
+def listen(plugin, entity, handle):
+    plugin.AD.callbacks.callbacks.setdefault('app', {})[handle] = {
+        'type': 'state', 'namespace': NAMESPACE, 'entity': entity}
+
+
+def run(coro_function):
+    async def wrapper():
+        plugin = make_plugin(asyncio.get_running_loop())
+        await coro_function(plugin)
+    asyncio.run(wrapper())
+
+
+def test_unobserved_entities_become_tombstones():
+    async def check(plugin):
+        listen(plugin, 'sensor.kitchen', 1)
+        plugin.refresh_interest()
+        plugin.store_state('sensor.kitchen', '21', {'unit': 'C'})
+        plugin.store_state('sensor.attic', '30', {'unit': 'C'})
+        await asyncio.sleep(0)
+
+        assert list(plugin.state.state[NAMESPACE]) == ['sensor.kitchen']
+        assert plugin.tombstones == {'sensor.attic': ('30', {'unit': 'C'})}
+
+        # a newer state replaces the tombstone instead of adding a second one
+        plugin.store_state('sensor.attic', '31', {'unit': 'C'})
+        assert plugin.tombstones == {'sensor.attic': ('31', {'unit': 'C'})}
+    run(check)
+
+
+def test_get_state_materializes_a_tombstone():
+    async def check(plugin):
+        plugin.store_state('sensor.attic', '30', {'unit': 'C'})
+        plugin.store_state('sensor.cellar', '12', {'unit': 'C'})
+
+        # what HassMqtt.get_state does before reading the namespace
+        await plugin.materialize('sensor.attic')
+
+        assert plugin.state.state[NAMESPACE]['sensor.attic'] == {
+            'state': '30', 'attributes': {'unit': 'C'}}
+        assert list(plugin.tombstones) == ['sensor.cellar']
+
+        # once in the namespace the entity is written directly, it never goes stale
+        plugin.store_state('sensor.attic', '32', {'unit': 'C'})
+        await asyncio.sleep(0)
+        assert plugin.state.state[NAMESPACE]['sensor.attic']['state'] == '32'
+        assert list(plugin.tombstones) == ['sensor.cellar']
+    run(check)
+
+
+def test_listen_state_materializes_a_domain():
+    async def check(plugin):
+        plugin.store_state('sensor.attic', '30', {})
+        plugin.store_state('sensor.cellar', '12', {})
+        plugin.store_state('light.hall', 'on', {})
+
+        # what HassMqtt.listen_state does before registering the callback
+        await plugin.declare_interest(['sensor'])
+
+        assert sorted(plugin.state.state[NAMESPACE]) == ['sensor.attic', 'sensor.cellar']
+        assert list(plugin.tombstones) == ['light.hall']
+        assert plugin.is_observed('sensor.new')
+    run(check)
+
+
+def test_interest_scan_materializes_observed_tombstones():
+    async def check(plugin):
+        plugin.store_state('light.hall', 'on', {})
+        plugin.store_state('light.porch', 'off', {})
+
+        # a listener registered without going through HassMqtt.listen_state
+        listen(plugin, 'light.porch', 1)
+        plugin.refresh_interest()
+        await asyncio.sleep(0)
+
+        assert list(plugin.state.state[NAMESPACE]) == ['light.porch']
+        assert list(plugin.tombstones) == ['light.hall']
+
+        # listening to everything materializes the rest
+        listen(plugin, None, 2)
+        plugin.refresh_interest()
+        await asyncio.sleep(0)
+        assert sorted(plugin.state.state[NAMESPACE]) == ['light.hall', 'light.porch']
+        assert plugin.tombstones == {}
+    run(check)
+
+
+def test_plugin_forgets_batch_attributes_once_applied():
+    encoder = StateBatchEncoder('monitor', keyframe_interval=100)
+
+    def ingest(plugin, states):
+        for entity, state in states.items():
+            encoder.add(entity, state)
+        plugin.ingest_batch(decode_state_batch(encoder.encode(), plugin.logger).changes)
+
+    async def check(plugin):
+        await plugin.declare_interest(['sensor.kitchen'])
+
+        ingest(plugin, {
+            'sensor.kitchen': {'state': '21', 'attributes': {'unit': 'C', 'battery': 90}},
+            'sensor.attic': {'state': '30', 'attributes': {'unit': 'C', 'battery': 50}},
+        })
+        # a second delta lands before the first write has been applied
+        ingest(plugin, {
+            'sensor.kitchen': {'state': '22', 'attributes': {'unit': 'C', 'battery': 80}},
+            'sensor.attic': {'state': '31', 'attributes': {'unit': 'C', 'battery': 40}},
+        })
+        assert list(plugin.batch_attributes) == ['sensor.kitchen']
+        await asyncio.sleep(0)
+
+        assert plugin.batch_attributes == {}
+        assert plugin.state.state[NAMESPACE]['sensor.kitchen'] == {
+            'state': '22', 'attributes': {'unit': 'C', 'battery': 80}}
+        assert plugin.tombstones == {'sensor.attic': ('31', {'unit': 'C', 'battery': 40})}
+
+        # later deltas resolve against the namespace state and the tombstone
+        ingest(plugin, {
+            'sensor.kitchen': {'state': '23', 'attributes': {'unit': 'C', 'battery': 70}},
+            'sensor.attic': {'state': '32', 'attributes': {'unit': 'C'}},
+        })
+        await asyncio.sleep(0)
+        assert plugin.state.state[NAMESPACE]['sensor.kitchen']['attributes'] == {
+            'unit': 'C', 'battery': 70}
+        assert plugin.tombstones['sensor.attic'] == ('32', {'unit': 'C'})
+        assert plugin.batch_attributes == {}
+    run(check)
@@ -0,0 +1,45 @@
+"""Topic filters, the topic router and the wildcard value of MQTT events."""
+import copy
+import json
+import pickle
+
+import pytest
+
+from hassmqttmatcher import TopicRouter, WildcardMatch
+
+
+def test_router_matches_every_covering_filter():
+    router = TopicRouter()
+    for topic_filter in ('monitor/#', 'monitor/+/rssi', 'monitor/kitchen/+', 'other/#'):
+        router.add(topic_filter)
+
+    assert router.match('monitor/kitchen/rssi') == {
+        'monitor/#', 'monitor/+/rssi', 'monitor/kitchen/+'}
+    assert router.match('monitor') == {'monitor/#'}
+    assert router.match('$SYS/monitor') == set()
+
+
+def test_wildcard_match_equals_every_matched_filter():
+    match = WildcardMatch({'monitor/+/rssi', 'monitor/#'})
+
+    assert str(match) == 'monitor/#'
+    # AppDaemon's event filter puts the listener's kwarg on the left
+    assert not 'monitor/+/rssi' != match
+    assert not 'monitor/#' != match
+    assert 'other/#' != match
+    assert json.dumps(match) == '"monitor/#"'
+
+
+def test_wildcard_match_is_not_hashable():
+    match = WildcardMatch({'monitor/+/rssi', 'monitor/#'})
+    with pytest.raises(TypeError):
+        hash(match)
+    # the filters are what to key on
+    assert match.filters in {frozenset({'monitor/#', 'monitor/+/rssi'})}
+
+
+def test_wildcard_match_survives_copy_and_pickle():
+    match = WildcardMatch({'monitor/+/rssi', 'monitor/#'})
+    for other in (copy.copy(match), copy.deepcopy(match), pickle.loads(pickle.dumps(match))):
+        assert isinstance(other, WildcardMatch)
+        assert other.filters == match.filters
@@ -0,0 +1,73 @@
+"""HassmqttPlugin.request against a client stand-in that answers every request."""
+import asyncio
+import json
+import logging
+import types
+
+import pytest
+
+pytest.importorskip('appdaemon')
+mqtt = pytest.importorskip('paho.mqtt.client')
+
+from hassmqttmetrics import HassmqttMetrics  # noqa: E402
+from hassmqttplugin import HassmqttPlugin  # noqa: E402
+from hassmqttrpc import ATTR_CORRELATION_ID, PendingRequests  # noqa: E402
+
+RESPONSE_TOPIC = 'monitor/reply'
+
+
+class StandInClient:
+    """Publishes like paho and replies on the response topic with the correlation ID."""
+
+    def __init__(self, plugin):
+        self.plugin = plugin
+        self.published = []
+
+    def subscribe(self, topic, qos):
+        return (0, 1)
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        if payload is not None and not isinstance(payload, (str, bytes, bytearray, int, float)):
+            raise TypeError('payload must be a string, bytearray, int, float or None.')
+        self.published.append((topic, payload, properties))
+        if properties is not None:
+            correlation_id = properties.CorrelationData.decode()
+        else:
+            correlation_id = json.loads(payload)[ATTR_CORRELATION_ID]
+        self.plugin.loop.call_soon_threadsafe(
+            self.plugin.pending_requests.resolve, RESPONSE_TOPIC, correlation_id,
+            {'topic': RESPONSE_TOPIC, 'payload': 'done'})
+        return (0, len(self.published))
+
+
+def make_plugin(loop, mqtt_v5):
+    plugin = HassmqttPlugin.__new__(HassmqttPlugin)
+    plugin.AD = types.SimpleNamespace(loop=loop, executor=None)
+    plugin.loop = loop
+    plugin.logger = logging.getLogger(__name__)
+    plugin.metrics = HassmqttMetrics()
+    plugin.mqtt_connected = True
+    plugin.mqtt_v5 = mqtt_v5
+    plugin.mqtt_qos = 0
+    plugin.mqtt_client_topics = []
+    plugin.pending_requests = PendingRequests()
+    plugin.mqtt_client = StandInClient(plugin)
+    return plugin
+
+
+@pytest.mark.parametrize('mqtt_v5', [True, False])
+def test_request_publishes_a_dict_payload_as_json(mqtt_v5):
+    async def request():
+        plugin = make_plugin(asyncio.get_running_loop(), mqtt_v5)
+        reply = await plugin.request('monitor/scan', {'scan': 'arrive'}, RESPONSE_TOPIC, 1)
+        return plugin, reply
+
+    plugin, reply = asyncio.run(request())
+
+    assert reply == {'topic': RESPONSE_TOPIC, 'payload': 'done'}
+    [(topic, payload, properties)] = plugin.mqtt_client.published
+    assert topic == 'monitor/scan'
+    assert json.loads(payload)['scan'] == 'arrive'
+    assert (properties is not None) == mqtt_v5
+    assert plugin.mqtt_client_topics == [RESPONSE_TOPIC]
+    assert len(plugin.pending_requests) == 0
@@ -0,0 +1,98 @@
+"""IngestPolicies with a loop stand-in whose timers run when the test says so."""
+import logging
+
+from hassmqttpolicy import IngestPolicies
+
+
+class StandInLoop:
+
+    def __init__(self):
+        self.timers = []
+
+    def call_later(self, delay, callback, *args):
+        handle = StandInHandle(callback, args)
+        self.timers.append(handle)
+        return handle
+
+    def run_timers(self):
+        timers, self.timers = self.timers, []
+        for handle in timers:
+            if not handle.cancelled:
+                handle.callback(*handle.args)
+
+
+class StandInHandle:
+
+    def __init__(self, callback, args):
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+def make_policies(config):
+    loop = StandInLoop()
+    dispatched = []
+    absorbed = []
+    policies = IngestPolicies(loop, [config], lambda *message: dispatched.append(message),
+                              absorbed.append, logging.getLogger(__name__))
+    return policies, loop, dispatched, absorbed
+
+
+def offer(policies, topic, payload):
+    message = (topic, payload, {}, 0.0)
+    return policies.offer(topic, payload, message)
+
+
+def test_drop_unchanged_drops_repeats():
+    policies, _, _, absorbed = make_policies({'topic': 'monitor/#', 'drop_unchanged': True})
+
+    assert offer(policies, 'monitor/a', '1') is not None
+    assert offer(policies, 'monitor/a', '1') is None
+    assert offer(policies, 'monitor/b', '1') is not None
+    assert offer(policies, 'monitor/a', '2') is not None
+    assert len(absorbed) == 1
+
+
+def test_throttled_change_is_delivered_when_repeated():
+    policies, _, _, _ = make_policies(
+        {'topic': 'monitor/#', 'drop_unchanged': True, 'rate_limit': 0.001, 'burst': 1})
+
+    assert offer(policies, 'monitor/a', '1') is not None
+    # the bucket is empty, the change is throttled
+    assert offer(policies, 'monitor/a', '2') is None
+    policies.policies[0].topics['monitor/a'].tokens = 1.0
+    assert offer(policies, 'monitor/a', '2') is not None
+    assert offer(policies, 'monitor/a', '2') is None
+
+
+def test_conflated_change_is_delivered_when_repeated():
+    policies, loop, dispatched, _ = make_policies(
+        {'topic': 'monitor/#', 'drop_unchanged': True, 'conflate': 60})
+
+    assert offer(policies, 'monitor/a', '1') is not None
+    assert offer(policies, 'monitor/a', '2') is None
+    assert offer(policies, 'monitor/a', '2') is None
+    assert offer(policies, 'monitor/a', '1') is None
+    loop.run_timers()
+    # the pending '2' was replaced by '1' before it was due
+    assert [message[1] for message in dispatched] == ['1']
+
+    policies.policies[0].topics['monitor/a'].forwarded_at = None
+    assert offer(policies, 'monitor/a', '2') is not None
+    assert offer(policies, 'monitor/a', '2') is None
+
+
+def test_conflate_forwards_the_latest_message():
+    policies, loop, dispatched, absorbed = make_policies({'topic': 'monitor/+', 'conflate': 60})
+
+    assert offer(policies, 'monitor/a', '1') is not None
+    assert offer(policies, 'monitor/a', '2') is None
+    assert offer(policies, 'monitor/a', '3') is None
+    loop.run_timers()
+
+    assert [message[1] for message in dispatched] == ['3']
+    assert [message[1] for message in absorbed] == ['2']
+    assert policies.counters()['monitor/+']['passed'] == 2
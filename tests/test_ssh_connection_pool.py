@@ -0,0 +1,181 @@
+"""SSHConnectionPool against a local paramiko SSH server stand-in.
+
+The stand-in accepts one user and understands three commands:
+
+    lines N        print N lines and exit 0
+    drip S         print a line every S seconds, forever
+    exit N         exit with status N
+"""
+import socket
+import threading
+import time
+
+import pytest
+
+paramiko = pytest.importorskip('paramiko')
+
+from home_presence import SSHConnectionPool  # noqa: E402
+
+USERNAME = 'monitor'
+PASSWORD = 'secret'
+
+
+class StandInServer(paramiko.ServerInterface):
+
+    def __init__(self):
+        self.commands = []
+
+    def check_auth_password(self, username, password):
+        if (username, password) == (USERNAME, PASSWORD):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        command = command.decode()
+        self.commands.append(command)
+        threading.Thread(target=self.execute, args=(channel, command), daemon=True).start()
+        return True
+
+    @staticmethod
+    def execute(channel, command):
+        # Let the transport answer the exec request before any output
+        time.sleep(0.05)
+        name, _, argument = command.partition(' ')
+        try:
+            if name == 'lines':
+                for index in range(int(argument)):
+                    channel.sendall('line {}\n'.format(index).encode())
+                status = 0
+            elif name == 'drip':
+                while not channel.closed:
+                    channel.sendall(b'drip\n')
+                    time.sleep(float(argument))
+                return
+            else:
+                status = int(argument)
+            channel.send_exit_status(status)
+        except (OSError, EOFError):
+            return
+        finally:
+            if name != 'drip':
+                channel.close()
+
+
+class StandInHost:
+    """Listens on localhost and serves every connection with ``StandInServer``."""
+
+    def __init__(self):
+        self.key = paramiko.RSAKey.generate(2048)
+        self.server = StandInServer()
+        self.connections = 0
+        self.transports = []
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.listen(10)
+        self.port = self.socket.getsockname()[1]
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            try:
+                client, _ = self.socket.accept()
+            except OSError:
+                return
+            self.connections += 1
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self.key)
+            transport.start_server(server=self.server)
+            self.transports.append(transport)
+
+    @property
+    def setting(self):
+        return {'host': '127.0.0.1', 'port': self.port, 'username': USERNAME,
+                'password': PASSWORD}
+
+    def close(self):
+        self.socket.close()
+        for transport in self.transports:
+            transport.close()
+
+
+@pytest.fixture(scope='module')
+def host():
+    host = StandInHost()
+    yield host
+    host.close()
+
+
+@pytest.fixture
+def pool():
+    pool = SSHConnectionPool(keepalive=5, idle_timeout=60)
+    yield pool
+    pool.close()
+
+
+def test_streams_output_lines(host, pool):
+    streamed = []
+    status, lines = pool.run('node', host.setting, 'lines 3', 5, on_line=streamed.append)
+
+    assert status == 0
+    assert lines == ['line 0', 'line 1', 'line 2']
+    assert streamed == lines
+
+
+def test_returns_exit_status(host, pool):
+    status, lines = pool.run('node', host.setting, 'exit 3', 5)
+
+    assert status == 3
+    assert lines == []
+
+
+def test_reuses_idle_connection(host, pool):
+    connections = host.connections
+    pool.run('node', host.setting, 'lines 1', 5)
+    pool.run('node', host.setting, 'lines 1', 5)
+
+    assert host.connections == connections + 1
+
+
+def test_does_not_reuse_when_asked(host, pool):
+    connections = host.connections
+    pool.run('node', host.setting, 'lines 1', 5, reuse=False)
+    pool.run('node', host.setting, 'lines 1', 5, reuse=False)
+
+    assert host.connections == connections + 2
+    assert not pool.idle.get('node')
+
+
+def test_timeout_bounds_whole_command(host, pool):
+    # Output keeps arriving, so only the overall deadline can stop the command
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        pool.run('node', host.setting, 'drip 0.3', 1)
+    elapsed = time.monotonic() - started
+
+    assert elapsed < 1.5
+    assert not pool.idle.get('node')
+
+
+def test_timeout_while_waiting_for_output(host, pool):
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        pool.run('node', host.setting, 'drip 5', 1)
+
+    assert time.monotonic() - started < 1.5
+
+
+def test_evicts_idle_connections(host):
+    pool = SSHConnectionPool(keepalive=5, idle_timeout=0)
+    pool.run('node', host.setting, 'lines 1', 5)
+    time.sleep(0.01)
+
+    assert pool.evict() == 1
+    assert not pool.idle.get('node')